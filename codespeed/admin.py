@@ -4,7 +4,8 @@ from django import forms
 from django.contrib import admin
 
 from codespeed.models import (Project, Revision, Executable, Benchmark, Branch,
-                              Result, Environment, Report)
+                              Result, Environment, Report, ReportJob)
+from codespeed.results import delete_results
 
 
 class ProjectForm(forms.ModelForm):
@@ -79,6 +80,12 @@ class ResultAdmin(admin.ModelAdmin):
                     'value', 'date')
     list_filter = ('environment', 'executable', 'date', 'benchmark')
 
+    def delete_model(self, request, obj):
+        delete_results(Result.objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        delete_results(queryset)
+
 
 def recalculate_report(modeladmin, request, queryset):
     for report in queryset:
@@ -94,3 +101,11 @@ class ReportAdmin(admin.ModelAdmin):
     list_filter = ('environment', 'executable')
     ordering = ['-revision']
     actions = [recalculate_report]
+
+
+@admin.register(ReportJob)
+class ReportJobAdmin(admin.ModelAdmin):
+    list_display = ('revision', 'executable', 'environment', 'created',
+                    'attempts', 'error')
+    list_filter = ('environment', 'executable')
+    ordering = ['created']
@@ -7,6 +7,7 @@ class CodespeedConfig(AppConfig):
 
     def ready(self):
         import warnings
+        from . import metadata, timelines, versions  # noqa: connect signal receivers
         if settings.ALLOW_ANONYMOUS_POST:
             warnings.warn("Results can be posted by unregistered users")
             warnings.warn(
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""Change point detection
+
+Reports compare a revision with the previous one, or with the average of a
+few revisions, so a single noisy result is enough to flag a change. Here,
+the newest CHANGEPOINT_DEPTH results of each series of an executable and
+environment on a branch are instead segmented where their mean changes, by
+binary segmentation. A change point is only kept when it explains the
+results better than the noise of the series does, and when the levels before
+and after it differ by more than CHANGE_THRESHOLD percent.
+
+Change points are stored in ChangePoint rows. With the CHANGEPOINT_DETECTION
+setting, they are detected whenever a report is generated, and the change
+points confirmed by the revision of the report, instead of its changes and
+trends, set its colorcode and summary. The ``detect_changes`` command
+detects them for every series.
+"""
+from __future__ import absolute_import
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Benchmark, ChangePoint, Result, Revision
+
+# Smallest number of results on each side of a change point
+MIN_SEGMENT_SIZE = 3
+
+
+def get_depth():
+    return getattr(settings, 'CHANGEPOINT_DEPTH', 200)
+
+
+def _get_change_threshold():
+    threshold = getattr(settings, 'CHANGE_THRESHOLD', None)
+    return 3.0 if threshold is None else threshold
+
+
+def _median_filter(values):
+    """Replaces each value by the median of itself and its neighbours, which
+    removes isolated outliers but keeps level shifts"""
+    import numpy as np
+
+    filtered = values.copy()
+    if len(values) > 2:
+        filtered[1:-1] = np.median(
+            np.vstack([values[:-2], values[1:-1], values[2:]]), axis=0)
+    return filtered
+
+
+def find_change_points(values, min_size=MIN_SEGMENT_SIZE, penalty=None):
+    """Returns the indexes of the values that start a new mean level
+
+    Isolated outliers are filtered out first. Then the series is split at
+    the index that most reduces its sum of squared errors, and so on for
+    each part, for as long as a split reduces it by more than penalty. The
+    reductions of all the candidate splits of a part are computed at once
+    from cumulative sums.
+
+    penalty defaults to CHANGEPOINT_PENALTY * sigma² * log(n), where sigma
+    is the noise of the series, estimated from the differences between
+    consecutive values so that level shifts barely affect it.
+    """
+    # NumPy is only imported by the processes that detect change points
+    import numpy as np
+
+    values = np.asarray(values, dtype=float)
+    length = len(values)
+    if length < 2 * min_size:
+        return []
+
+    if penalty is None:
+        sigma = np.median(np.abs(np.diff(values))) / (0.6745 * np.sqrt(2))
+        penalty = (getattr(settings, 'CHANGEPOINT_PENALTY', 4.0) *
+                   sigma ** 2 * np.log(length))
+
+    # Centered, to keep the cumulative sums small
+    values = _median_filter(values)
+    values -= values.mean()
+    sums = np.concatenate(([0.0], np.cumsum(values)))
+    squares = np.concatenate(([0.0], np.cumsum(values ** 2)))
+    # Series without noise would otherwise be split by rounding errors
+    penalty = max(penalty, 1e-9 * squares[-1])
+
+    def cost(start, end):
+        # Sum of squared errors of values[start:end] around their mean
+        return (squares[end] - squares[start] -
+                (sums[end] - sums[start]) ** 2 / (end - start))
+
+    change_points = []
+    parts = [(0, length)]
+    while parts:
+        start, end = parts.pop()
+        if end - start < 2 * min_size:
+            continue
+        splits = np.arange(start + min_size, end - min_size + 1)
+        gains = cost(start, end) - cost(start, splits) - cost(splits, end)
+        best = int(np.argmax(gains))
+        if gains[best] > penalty:
+            split = int(splits[best])
+            change_points.append(split)
+            parts.extend([(start, split), (split, end)])
+    return sorted(change_points)
+
+
+def detect(values):
+    """Returns the (index, level before, level after, change in percent) of
+    the change points of values larger than CHANGE_THRESHOLD
+
+    The level of the results between two change points is their median.
+    """
+    import numpy as np
+
+    threshold = _get_change_threshold()
+    indexes = find_change_points(values)
+    bounds = [0] + indexes + [len(values)]
+    detected = []
+    for i, index in enumerate(indexes):
+        before = float(np.median(values[bounds[i]:index]))
+        after = float(np.median(values[index:bounds[i + 2]]))
+        if before == 0:
+            continue
+        change = (after - before) * 100.0 / abs(before)
+        if abs(change) > threshold:
+            detected.append((index, before, after, change))
+    return detected
+
+
+def update_change_points(revision, executable, environment):
+    """Detects the change points of the series of executable and environment
+    on the branch of revision, in the CHANGEPOINT_DEPTH revisions up to it
+
+    Change points previously detected for those revisions are replaced.
+    Returns the detected change points. The confirmed_by attribute of each
+    is the revision of the MIN_SEGMENT_SIZE-th result of the new level,
+    which is the first revision at which the change point can be detected.
+    """
+    branch = revision.branch
+    revisions = list(Revision.objects.filter(
+        branch=branch, date__lte=revision.date
+    ).order_by('-date')[:get_depth()])
+    revisions.reverse()
+
+    series = {}
+    for bench_id, rev_id, value in Result.objects.filter(
+            revision__in=revisions,
+            executable=executable,
+            environment=environment,
+    ).values_list('benchmark', 'revision', 'value'):
+        series.setdefault(bench_id, {})[rev_id] = value
+    benchmarks = Benchmark.objects.in_bulk(list(series))
+
+    change_points = []
+    for bench_id in sorted(series):
+        values_by_revision = series[bench_id]
+        bench_revisions = [rev for rev in revisions
+                           if rev.id in values_by_revision]
+        values = [values_by_revision[rev.id] for rev in bench_revisions]
+        for index, before, after, change in detect(values):
+            change_point = ChangePoint(
+                revision=bench_revisions[index],
+                benchmark=benchmarks[bench_id],
+                environment=environment,
+                executable=executable,
+                branch=branch,
+                before=before,
+                after=after,
+                change=change)
+            change_point.confirmed_by = bench_revisions[
+                index + MIN_SEGMENT_SIZE - 1]
+            change_points.append(change_point)
+
+    with transaction.atomic():
+        ChangePoint.objects.filter(
+            revision__in=revisions,
+            executable=executable,
+            environment=environment,
+        ).delete()
+        ChangePoint.objects.bulk_create(change_points)
+    return change_points
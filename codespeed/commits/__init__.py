@@ -1 +1 @@
-from .logs import get_logs  # noqa
+from .logs import get_logs, iter_logs, update_repository  # noqa
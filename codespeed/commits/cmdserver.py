@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Client for the Mercurial command server
+
+"hg serve --cmdserver pipe" keeps a Mercurial process running and reads
+commands from its stdin, which avoids starting a new interpreter for each
+command. Servers are pooled per working copy and closed once they've been
+idle for HG_CMDSERVER_IDLE_TIMEOUT seconds.
+
+See https://www.mercurial-scm.org/wiki/CommandServer for the protocol.
+"""
+from __future__ import absolute_import
+
+import atexit
+import logging
+import os
+import struct
+import threading
+import time
+from subprocess import Popen, PIPE
+
+from django.conf import settings
+
+from .exceptions import CommitLogError
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct('>cI')
+RESULT = struct.Struct('>i')
+
+
+class CommandServerError(CommitLogError):
+    pass
+
+
+class CommandServer(object):
+    """A running "hg serve --cmdserver pipe" process for a working copy"""
+
+    def __init__(self, working_copy):
+        self.working_copy = working_copy
+        env = dict(os.environ, HGPLAIN='1', HGENCODING='UTF-8')
+        self.process = Popen(
+            ['hg', 'serve', '--cmdserver', 'pipe'],
+            stdin=PIPE, stdout=PIPE, cwd=working_copy, env=env)
+        self.lock = threading.Lock()
+        self.last_used = time.time()
+
+        channel, hello = self._read_message()
+        if channel != b'o':
+            self.close()
+            raise CommandServerError(
+                "unexpected hello message from hg: %r" % hello)
+        self.capabilities = []
+        for line in hello.decode('utf-8').splitlines():
+            name, _, value = line.partition(': ')
+            if name == 'capabilities':
+                self.capabilities = value.split()
+        if 'runcommand' not in self.capabilities:
+            self.close()
+            raise CommandServerError("hg command server can't run commands")
+
+    def _read_message(self):
+        header = self.process.stdout.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise EOFError("hg command server exited")
+        channel, length = HEADER.unpack(header)
+        if channel.isupper():
+            # Input requests carry the size of the input wanted, not data
+            return channel, length
+        data = self.process.stdout.read(length)
+        if len(data) < length:
+            raise EOFError("hg command server exited")
+        return channel, data
+
+    def runcommand(self, args):
+        """Runs hg with args and returns its (returncode, stdout, stderr)"""
+        data = b'\0'.join(arg.encode('utf-8') for arg in args)
+        stdout, stderr = [], []
+        with self.lock:
+            self.last_used = time.time()
+            self.process.stdin.write(
+                b'runcommand\n' + struct.pack('>I', len(data)) + data)
+            self.process.stdin.flush()
+            while True:
+                channel, data = self._read_message()
+                if channel == b'o':
+                    stdout.append(data)
+                elif channel == b'e':
+                    stderr.append(data)
+                elif channel == b'r':
+                    returncode = RESULT.unpack(data)[0]
+                    break
+                elif channel.isupper():
+                    # Required channels, e.g. input, are not supported
+                    raise CommandServerError(
+                        "hg %s asked for input" % " ".join(args))
+            self.last_used = time.time()
+        return returncode, b''.join(stdout), b''.join(stderr)
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except IOError:
+            pass
+        self.process.wait()
+
+
+_servers = {}
+_servers_lock = threading.Lock()
+
+
+def reap_idle_servers(now=None):
+    """Closes the servers that have been idle for too long"""
+    timeout = getattr(settings, 'HG_CMDSERVER_IDLE_TIMEOUT', 300)
+    now = time.time() if now is None else now
+    with _servers_lock:
+        idle = [working_copy for working_copy, server in _servers.items()
+                if now - server.last_used > timeout]
+        idle = [_servers.pop(working_copy) for working_copy in idle]
+    for server in idle:
+        logger.debug("Closing idle hg command server for %s",
+                     server.working_copy)
+        server.close()
+
+
+@atexit.register
+def close_servers():
+    with _servers_lock:
+        servers = list(_servers.values())
+        _servers.clear()
+    for server in servers:
+        server.close()
+
+
+def get_server(working_copy):
+    """Returns the pooled command server of working_copy"""
+    reap_idle_servers()
+    with _servers_lock:
+        server = _servers.get(working_copy)
+        if server is None:
+            server = _servers[working_copy] = CommandServer(working_copy)
+        return server
+
+
+def discard_server(server):
+    with _servers_lock:
+        if _servers.get(server.working_copy) is server:
+            del _servers[server.working_copy]
+    server.close()
+
+
+def runcommand(args, working_copy):
+    """Runs hg with args in the pooled server of working_copy
+
+    A server that died since it was last used is replaced once.
+    """
+    for attempt in range(2):
+        server = get_server(working_copy)
+        try:
+            return server.runcommand(args)
+        except CommandServerError:
+            discard_server(server)
+            raise
+        except (EOFError, IOError) as e:
+            discard_server(server)
+            if attempt:
+                raise CommandServerError(
+                    "hg command server for %s failed: %s" % (working_copy, e))
@@ -1,13 +1,18 @@
 import datetime
 import logging
 import os
+import tempfile
 
 from subprocess import Popen, PIPE
 from django.conf import settings
 from .exceptions import CommitLogError
+from .logs import split_stream
 
 logger = logging.getLogger(__name__)
 
+# working copy -> (signature of its tag refs, tags by commit id)
+_tags_cache = {}
+
 
 def execute_command(cmd, cwd):
     p = Popen(cmd, stdout=PIPE, stderr=PIPE, cwd=cwd)
@@ -42,17 +47,140 @@ def updaterepo(project, update=True):
             return [{'error': False}]
 
 
-def getlogs(endrev, startrev):
-    updaterepo(endrev.branch.project, update=False)
-
+def _get_tag_refs_signature(working_copy):
+    """Returns the modification times of the tag refs of a working copy,
+    or None when they can't be found"""
+    git_dir = os.path.join(working_copy, '.git')
+    if not os.path.isdir(git_dir):
+        return None
+    signature = []
+    packed_refs = os.path.join(git_dir, 'packed-refs')
+    if os.path.exists(packed_refs):
+        stat = os.stat(packed_refs)
+        signature.append((packed_refs, stat.st_mtime, stat.st_size))
+    for dirpath, _, filenames in os.walk(os.path.join(git_dir, 'refs', 'tags')):
+        signature.append((dirpath, os.stat(dirpath).st_mtime))
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            signature.append((path, os.stat(path).st_mtime))
+    return tuple(signature)
+
+
+def get_tags(working_copy):
+    """Returns the tags of a repository, keyed by the commit they point at
+
+    Tags are listed with a single git command, and cached until the tag
+    refs of the working copy change. Several tags of a commit are separated
+    by newlines, as in the output of "git tag --points-at"
+    """
+    signature = _get_tag_refs_signature(working_copy)
+    cached = _tags_cache.get(working_copy)
+    if signature is not None and cached is not None and cached[0] == signature:
+        return cached[1]
+
+    cmd = ["git", "show-ref", "--tags", "--dereference"]
+    try:
+        p, stdout, stderr = execute_command(cmd, working_copy)
+    except Exception:
+        logger.debug('Failed to get tags', exc_info=True)
+        return {}
+    # show-ref exits with 1 when there are no tags
+    if p.returncode not in (0, 1):
+        logger.debug('%s returned %s: %s', " ".join(cmd), p.returncode,
+                     stderr)
+        return {}
+
+    refs = []
+    for line in stdout.splitlines():
+        commit_id, _, ref = line.strip().partition(' ')
+        if ref.startswith('refs/tags/'):
+            refs.append((commit_id, ref[len('refs/tags/'):]))
+    # Annotated tags are listed twice: as the tag object, and as the commit
+    # it points at with a ^{} suffix
+    peeled = set(name[:-len('^{}')] for _, name in refs if name.endswith('^{}'))
+    names = {}
+    for commit_id, name in refs:
+        if name.endswith('^{}'):
+            name = name[:-len('^{}')]
+        elif name in peeled:
+            continue
+        names.setdefault(commit_id, []).append(name)
+    tags = dict((commit_id, "\n".join(sorted(commit_names)))
+                for commit_id, commit_names in names.items())
+
+    if signature is not None:
+        _tags_cache[working_copy] = (signature, tags)
+    return tags
+
+
+def _get_logfmt():
     # NULL separated values delimited by 0x1e record separators
     # See PRETTY FORMATS in git-log(1):
     if hasattr(settings, 'GIT_USE_COMMIT_DATE') and settings.GIT_USE_COMMIT_DATE:
-        logfmt = '--format=format:%h%x00%H%x00%ct%x00%an%x00%ae%x00%s%x00%b%x1e'
+        return '--format=format:%h%x00%H%x00%ct%x00%an%x00%ae%x00%s%x00%b%x1e'
     else:
-        logfmt = '--format=format:%h%x00%H%x00%at%x00%an%x00%ae%x00%s%x00%b%x1e'
+        return '--format=format:%h%x00%H%x00%at%x00%an%x00%ae%x00%s%x00%b%x1e'
+
+
+def _parse_log(log, tags):
+    (short_commit_id, commit_id, date_t, author_name, author_email,
+        subject, body) = map(lambda s: s.strip(), log.split('\x00', 7))
+
+    tag = tags.get(commit_id, "")
+    date = datetime.datetime.fromtimestamp(
+        int(date_t)).strftime("%Y-%m-%d %H:%M:%S")
+
+    return {
+        'date': date,
+        'message': subject,
+        'commitid': commit_id,
+        'author': author_name,
+        'author_email': author_email,
+        'body': body,
+        'short_commit_id': short_commit_id,
+        'tag': tag
+    }
+
+
+def _stream_logs(cmd, working_copy):
+    """Runs a git log command and yields its logs
+
+    The output is parsed as it is produced, so that memory use doesn't
+    depend on the size of the range. git is stopped when the generator is
+    closed early.
+    """
+    tags = get_tags(working_copy)
+    with tempfile.TemporaryFile() as stderr:
+        p = Popen(cmd, stdout=PIPE, stderr=stderr, cwd=working_copy)
+        try:
+            for log in split_stream(p.stdout, b'\x1e'):
+                if log.strip():
+                    yield _parse_log(log.decode('utf8', 'replace'), tags)
+            p.wait()
+            if p.returncode != 0:
+                stderr.seek(0)
+                raise CommitLogError("%s returned %s: %s" % (
+                    " ".join(cmd), p.returncode,
+                    stderr.read().decode('utf8', 'replace')))
+        finally:
+            if p.poll() is None:
+                p.kill()
+            p.stdout.close()
+            p.wait()
+
+
+def getlogs(endrev, startrev, limit=None, offset=0):
+    """Returns the logs of the commits after startrev, up to endrev
+
+    At most limit logs are returned, after skipping the offset newest ones
+    """
+    updaterepo(endrev.branch.project, update=False)
 
-    cmd = ["git", "log", logfmt]
+    cmd = ["git", "log", _get_logfmt()]
+    if offset:
+        cmd.append("--skip=%d" % offset)
+    if limit is not None:
+        cmd.append("--max-count=%d" % limit)
 
     if endrev.commitid != startrev.commitid:
         cmd.append("%s...%s" % (startrev.commitid, endrev.commitid))
@@ -60,37 +188,9 @@ def getlogs(endrev, startrev):
         cmd.append("-1")  # Only return one commit
         cmd.append(endrev.commitid)
 
-    working_copy = endrev.branch.project.working_copy
-    p, stdout, stderr = execute_command(cmd, working_copy)
-
-    if p.returncode != 0:
-        raise CommitLogError("%s returned %s: %s" % (
-                             " ".join(cmd), p.returncode, stderr))
-    logs = []
-    for log in filter(None, stdout.split('\x1e')):
-        (short_commit_id, commit_id, date_t, author_name, author_email,
-            subject, body) = map(lambda s: s.strip(), log.split('\x00', 7))
+    return list(_stream_logs(cmd, endrev.branch.project.working_copy))
 
-        cmd = ["git", "tag", "--points-at", commit_id]
 
-        try:
-            p, stdout, stderr = execute_command(cmd, working_copy)
-        except Exception:
-            logger.debug('Failed to get tag', exc_info=True)
-
-        tag = stdout.strip() if p.returncode == 0 else ""
-        date = datetime.datetime.fromtimestamp(
-            int(date_t)).strftime("%Y-%m-%d %H:%M:%S")
-
-        logs.append({
-            'date': date,
-            'message': subject,
-            'commitid': commit_id,
-            'author': author_name,
-            'author_email': author_email,
-            'body': body,
-            'short_commit_id': short_commit_id,
-            'tag': tag
-        })
-
-    return logs
+def iterlogs(working_copy):
+    """Yields the logs of all the commits of a working copy, newest first"""
+    return _stream_logs(["git", "log", "--all", _get_logfmt()], working_copy)
@@ -10,12 +10,15 @@ from __future__ import absolute_import
 import logging
 try:
     # Python 3
+    from urllib.error import HTTPError
     from urllib.request import urlopen
     from urllib.request import Request
 except ImportError:
     # Python 2
+    from urllib2 import HTTPError
     from urllib2 import urlopen
     from urllib2 import Request
+from multiprocessing.pool import ThreadPool
 import re
 import json
 
@@ -36,86 +39,114 @@ GITHUB_URL_RE = re.compile(
 # revisions.
 GITHUB_REVISION_LIMIT = 10
 
+GITHUB_API_URL = 'https://api.github.com'
+
+# The compare API lists at most 250 commits, longer ranges are read page
+# by page
+COMPARE_PAGE_SIZE = 100
+
+# Responses are cached for a very long time since SCM diffs shouldn't
+# change, errors only briefly to avoid making too many requests
+SUCCESS_TIMEOUT = 86400 * 30
+ERROR_TIMEOUT = 300
+
 
 def updaterepo(project, update=True):
     return
 
 
-def fetch_json(url):
-    json_obj = cache.get(url)
+def api_url(path, *args):
+    base_url = getattr(settings, 'GITHUB_API_URL', GITHUB_API_URL)
+    return base_url.rstrip('/') + path % args
+
+
+def is_error(json_obj):
+    return (isinstance(json_obj, dict) and
+            json_obj.get("message") in ("Not Found", "Server Error",))
+
+
+def fetch_json(url, revalidate=False):
+    """Returns the decoded JSON document at url
+
+    Documents are cached along with their ETag. When revalidate is True, a
+    cached document is only reused after Github confirms it did not change,
+    which costs a conditional request that does not count against the rate
+    limit.
+    """
+    cache_key = 'github:%s' % url
+    cached = cache.get(cache_key)
 
-    if json_obj is None:
+    if cached is not None and not (revalidate and cached['etag']):
+        json_obj = cached['json']
+    else:
         github_oauth_token = getattr(settings, 'GITHUB_OAUTH_TOKEN', None)
 
         if github_oauth_token:
             headers = {'Authorization': 'token %s' % (github_oauth_token)}
         else:
             headers = {}
+        if cached is not None:
+            headers['If-None-Match'] = cached['etag']
 
         request = Request(url=url, headers=headers)
 
         try:
-            json_obj = json.load(urlopen(request))
+            response = urlopen(request)
+            json_obj = json.loads(response.read().decode('utf-8'))
+            etag = response.info().get('ETag')
+        except HTTPError as e:
+            if e.code == 304 and cached is not None:
+                json_obj, etag = cached['json'], cached['etag']
+            else:
+                try:
+                    json_obj, etag = json.loads(e.read().decode('utf-8')), None
+                except ValueError:
+                    json_obj = None
+                if not is_error(json_obj):
+                    logger.exception("Unable to load %s: %s",
+                                     url, e, exc_info=True)
+                    raise e
         except IOError as e:
             logger.exception("Unable to load %s: %s",
                              url, e, exc_info=True)
             raise e
 
-        if "message" in json_obj and \
-           json_obj["message"] in ("Not Found", "Server Error",):
-            # We'll still cache these for a brief period of time to avoid
-            # making too many requests:
-            cache.set(url, json_obj, 300)
-        else:
-            # We'll cache successes for a very long period of time since
-            # SCM diffs shouldn't change:
-            cache.set(url, json_obj, 86400 * 30)
+        cache.set(cache_key, {'json': json_obj, 'etag': etag},
+                  ERROR_TIMEOUT if is_error(json_obj) else SUCCESS_TIMEOUT)
 
-    if "message" in json_obj and \
-       json_obj["message"] in ("Not Found", "Server Error",):
+    if is_error(json_obj):
         raise CommitLogError(
             "Unable to load %s: %s" % (url, json_obj["message"]))
 
     return json_obj
 
 
-def retrieve_tag(commit_id, username, project):
-    tags_url = 'https://api.github.com/repos/%s/%s/git/refs/tags' % (
-        username, project)
-
-    tags_json = fetch_json(tags_url)
-    for tag in tags_json:
-        if tag['object']['sha'] == commit_id:
-            return tag['ref'].split("refs/tags/")[-1]
-
-    return ""
+def get_tags(username, project):
+    """Returns a dict mapping the sha of each tagged object to its tag"""
+    tags_url = api_url('/repos/%s/%s/git/refs/tags', username, project)
 
+    try:
+        # Tags can be added at any time, so they are always revalidated
+        tags_json = fetch_json(tags_url, revalidate=True)
+    except CommitLogError:
+        # Github answers "Not Found" for repositories without tags
+        return {}
 
-def retrieve_revision(commit_id, username, project, revision=None):
-    commit_url = 'https://api.github.com/repos/%s/%s/git/commits/%s' % (
-        username, project, commit_id)
+    tags = {}
+    for tag in tags_json:
+        tags.setdefault(tag['object']['sha'],
+                        tag['ref'].split("refs/tags/")[-1])
+    return tags
 
-    commit_json = fetch_json(commit_url)
 
-    date = isodate.parse_datetime(commit_json['committer']['date'])
-    tag = retrieve_tag(commit_id, username, project)
+def retrieve_tag(commit_id, username, project):
+    return get_tags(username, project).get(commit_id, "")
 
-    if revision:
-        # Overwrite any existing data we might have for this revision since
-        # we never want our records to be out of sync with the actual VCS:
-        if not getattr(settings, 'USE_TZ_AWARE_DATES', False):
-            # We need to convert the timezone-aware date to a naive (i.e.
-            # timezone-less) date in UTC to avoid killing MySQL:
-            logger.debug('USE_TZ_AWARE_DATES setting is set to False, '
-                         'converting datetime object to a naive one')
-            revision.date = date.astimezone(
-                isodate.tzinfo.Utc()).replace(tzinfo=None)
-        revision.author = commit_json['author']['name']
-        revision.message = commit_json['message']
-        revision.full_clean()
-        revision.save()
 
-    return {'date':         date,
+def make_log(commit_json, tag):
+    """Converts a Github git commit object to a Codespeed log"""
+    return {'date':         isodate.parse_datetime(
+                                commit_json['committer']['date']),
             'message':      commit_json['message'],
             'body':         "",   # TODO: pretty-print diffs
             'author':       commit_json['author']['name'],
@@ -126,52 +157,175 @@ def retrieve_revision(commit_id, username, project, revision=None):
             'tag':          tag}
 
 
-def getlogs(endrev, startrev):
-    if endrev != startrev:
-        revisions = endrev.branch.revisions.filter(
-            date__lte=endrev.date, date__gte=startrev.date)
-    else:
-        revisions = [i for i in (startrev, endrev) if i.commitid]
+def update_revision(revision, log):
+    """Updates revision with the data of its commit log, if it differs"""
+    # Overwrite any existing data we might have for this revision since
+    # we never want our records to be out of sync with the actual VCS:
+    date = log['date']
+    if not getattr(settings, 'USE_TZ_AWARE_DATES', False):
+        # We need to convert the timezone-aware date to a naive (i.e.
+        # timezone-less) date in UTC to avoid killing MySQL:
+        logger.debug('USE_TZ_AWARE_DATES setting is set to False, '
+                     'converting datetime object to a naive one')
+        date = date.astimezone(isodate.tzinfo.Utc()).replace(tzinfo=None)
+
+    if (revision.date, revision.author, revision.message) != (
+            date, log['author'], log['message']):
+        revision.date = date
+        revision.author = log['author']
+        revision.message = log['message']
+        revision.full_clean()
+        revision.save()
 
-    if endrev.branch.project.repo_path[-1] == '/':
-        endrev.branch.project.repo_path = endrev.branch.project.repo_path[:-1]
 
-    m = GITHUB_URL_RE.match(endrev.branch.project.repo_path)
+def retrieve_revision(commit_id, username, project, revision=None,
+                      tags=None):
+    commit_url = api_url(
+        '/repos/%s/%s/git/commits/%s', username, project, commit_id)
 
-    if not m:
-        raise ValueError(
-            "Unable to parse Github URL %s" % endrev.branch.project.repo_path)
+    commit_json = fetch_json(commit_url)
 
-    username = m.group("username")
-    project = m.group("project")
+    if tags is None:
+        tags = get_tags(username, project)
+    log = make_log(commit_json, tags.get(commit_id, ""))
 
-    logs = []
-    last_rev_data = None
-    revision_count = 0
-    ancestor_found = False
-    # TODO: get all revisions between endrev and startrev,
-    # not only those present in the Codespeed DB
+    if revision:
+        update_revision(revision, log)
+
+    return log
+
+
+def retrieve_revisions(commit_ids, username, project, tags):
+    """Fetches the logs of commit_ids concurrently
+
+    At most GITHUB_FETCH_THREADS requests are made at the same time. The
+    threads only make requests, so that the database is only used from the
+    calling thread.
+    """
+    commit_ids = list(commit_ids)
+    threads = min(getattr(settings, 'GITHUB_FETCH_THREADS', 4),
+                  len(commit_ids))
+    if threads <= 1:
+        return [retrieve_revision(commit_id, username, project, tags=tags)
+                for commit_id in commit_ids]
+
+    pool = ThreadPool(threads)
+    try:
+        return pool.map(
+            lambda commit_id: retrieve_revision(
+                commit_id, username, project, tags=tags),
+            commit_ids)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def compare(startrev, endrev, username, project, tags):
+    """Returns the logs of the commits after startrev up to endrev
+
+    The range is fetched with a single request to the compare API, which
+    lists at most 250 commits, and the rest of longer ranges page by page.
+    Returns None when Github can't compare both commits, for instance when
+    startrev is not an ancestor of endrev, or when a page is missing.
+    """
+    compare_url = api_url('/repos/%s/%s/compare/%s...%s', username, project,
+                          startrev.commitid, endrev.commitid)
+    try:
+        compare_json = fetch_json(compare_url)
+        if compare_json.get('status') not in ('ahead', 'identical'):
+            return None
+        commits = list(compare_json['commits'])
+        total = compare_json.get('total_commits', len(commits))
+        while len(commits) < total:
+            # Commits are listed oldest first, so the page holding the
+            # first missing commit also holds some of the listed ones
+            page = len(commits) // COMPARE_PAGE_SIZE + 1
+            page_json = fetch_json('%s?per_page=%d&page=%d' % (
+                compare_url, COMPARE_PAGE_SIZE, page))
+            missing = page_json['commits'][
+                len(commits) - (page - 1) * COMPARE_PAGE_SIZE:]
+            if not missing:
+                logger.warning("Only %d of the %d commits of %s were listed",
+                               len(commits), total, compare_url)
+                return None
+            commits.extend(missing)
+    except (CommitLogError, IOError):
+        return None
 
-    for revision in revisions:
-        last_rev_data = retrieve_revision(
-            revision.commitid, username, project, revision)
-        logs.append(last_rev_data)
-        revision_count += 1
-        ancestor_found = (
-            startrev.commitid in [
-                rev['sha'] for rev in last_rev_data['parents']])
+    logs = []
+    for commit in commits:
+        commit_json = dict(
+            commit['commit'], sha=commit['sha'], parents=commit['parents'])
+        logs.append(make_log(commit_json, tags.get(commit['sha'], "")))
+    return logs
+
+
+def walk_parents(startrev, revisions, username, project, tags):
+    """Returns the logs of revisions, followed by their first ancestors
+
+    This is the fallback used when the range can't be compared.
+    """
+    logs = retrieve_revisions(
+        [revision.commitid for revision in revisions], username, project,
+        tags)
+    for revision, log in zip(revisions, logs):
+        update_revision(revision, log)
+
+    last_rev_data = logs[-1] if logs else None
+    revision_count = len(logs)
+    ancestor_found = last_rev_data is not None and (
+        startrev.commitid in [
+            rev['sha'] for rev in last_rev_data['parents']])
 
     # Simple approach to find the startrev, stop after found or after
     # #GITHUB_REVISION_LIMIT revisions are fetched
-    while (revision_count < GITHUB_REVISION_LIMIT
+    while (last_rev_data is not None
+            and revision_count < GITHUB_REVISION_LIMIT
             and not ancestor_found
             and len(last_rev_data['parents']) > 0):
         last_rev_data = retrieve_revision(
-            last_rev_data['parents'][0]['sha'], username, project)
+            last_rev_data['parents'][0]['sha'], username, project, tags=tags)
         logs.append(last_rev_data)
         revision_count += 1
         ancestor_found = (
             startrev.commitid in [
                 rev['sha'] for rev in last_rev_data['parents']])
 
+    return logs
+
+
+def getlogs(endrev, startrev):
+    if endrev.branch.project.repo_path[-1] == '/':
+        endrev.branch.project.repo_path = endrev.branch.project.repo_path[:-1]
+
+    m = GITHUB_URL_RE.match(endrev.branch.project.repo_path)
+
+    if not m:
+        raise ValueError(
+            "Unable to parse Github URL %s" % endrev.branch.project.repo_path)
+
+    username = m.group("username")
+    project = m.group("project")
+
+    # The tags are listed once for the whole range
+    tags = get_tags(username, project)
+
+    if endrev.commitid == startrev.commitid:
+        # A single commit, as when a result is saved
+        logs = [retrieve_revision(
+            endrev.commitid, username, project, endrev, tags)]
+    else:
+        logs = compare(startrev, endrev, username, project, tags)
+        if logs is None:
+            revisions = list(endrev.branch.revisions.filter(
+                date__lte=endrev.date, date__gte=startrev.date
+            ).exclude(commitid=startrev.commitid).order_by('-date'))
+            logs = walk_parents(startrev, revisions, username, project, tags)
+        else:
+            # Keep the revisions of the range in sync with Github
+            logs_by_id = dict((log['commitid'], log) for log in logs)
+            for revision in endrev.branch.revisions.filter(
+                    commitid__in=list(logs_by_id)):
+                update_revision(revision, logs_by_id[revision.commitid])
+
     return sorted(logs, key=lambda i: i['date'], reverse=True)
@@ -3,12 +3,16 @@ from __future__ import absolute_import, unicode_literals
 
 import logging
 
+from django.db import IntegrityError, transaction
+
+from .exceptions import CommitLogError
+
 logger = logging.getLogger(__name__)
 
 
-def get_logs(rev, startrev, update=False):
-    logs = []
-    project = rev.branch.project
+def get_backend(project):
+    """Returns the (getlogs, updaterepo) functions of the VCS of project,
+    or None when its logs can't be retrieved"""
     if project.repo_type == project.SUBVERSION:
         from .subversion import getlogs, updaterepo
     elif project.repo_type == project.MERCURIAL:
@@ -21,15 +25,168 @@ def get_logs(rev, startrev, update=False):
         if project.repo_type not in (project.NO_LOGS, ""):
             logger.warning("Don't know how to retrieve logs from %s project",
                            project.get_repo_type_display())
+        return None
+    return getlogs, updaterepo
+
+
+def update_repository(project):
+    """Updates the working copy of project, cloning it if needed"""
+    backend = get_backend(project)
+    if backend is not None:
+        backend[1](project)
+
+
+def get_logs(rev, startrev, update=False, cached=False, limit=None,
+             offset=0):
+    """Returns the logs of the commits after startrev, up to rev
+
+    When cached is True, the logs are read from the database if they were
+    stored by a previous call, and stored after being read from the
+    repository otherwise
+
+    When limit is given, at most limit logs are returned, after skipping the
+    offset newest ones. Git only reads those from the repository.
+    """
+    logs = []
+    project = rev.branch.project
+    backend = get_backend(project)
+    if backend is None:
         return logs
+    getlogs, updaterepo = backend
+    end = None if limit is None else offset + limit
+
+    if cached and not update:
+        stored_logs = get_stored_logs(project, rev, startrev, end)
+        if stored_logs is not None:
+            return stored_logs[offset:end]
 
     if update:
         updaterepo(rev.branch.project)
 
-    logs = getlogs(rev, startrev)
+    paged = project.repo_type == project.GIT and (
+        limit is not None or offset)
+    if paged:
+        logs = getlogs(rev, startrev, limit=limit, offset=offset)
+        # The last page of the range
+        complete = limit is None or len(logs) < limit
+    else:
+        logs = getlogs(rev, startrev)
+        complete = True
 
     # Remove last log because the startrev log shouldn't be shown
     if len(logs) > 1 and logs[-1].get('commitid') == startrev.commitid:
         logs.pop()
+        complete = True
 
+    if cached:
+        store_logs(project, rev, startrev, logs, offset if paged else 0,
+                   complete)
+
+    if not paged:
+        logs = logs[offset:end]
     return logs
+
+
+def iter_logs(project):
+    """Yields the logs of all the commits in the working copy of project,
+    newest first, as the VCS outputs them"""
+    if project.repo_type == project.GIT:
+        from .git import iterlogs
+    elif project.repo_type == project.MERCURIAL:
+        from .mercurial import iterlogs
+    else:
+        raise CommitLogError("Can't list the commits of %s projects" %
+                             project.get_repo_type_display())
+    return iterlogs(project.working_copy)
+
+
+def split_stream(stream, separator, chunk_size=65536):
+    """Yields the separator-terminated records read from a binary stream,
+    without reading the whole stream into memory"""
+    buf = b''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        records = (buf + chunk).split(separator)
+        buf = records.pop()
+        for record in records:
+            yield record
+    if buf:
+        yield buf
+
+
+def get_stored_logs(project, rev, startrev, end=None):
+    """Returns the stored logs of a commit range, or None when some of
+    them are missing
+
+    When end is given, the stored logs of a range that was only partly read
+    are returned if they include its end newest commits.
+    """
+    from ..models import CommitLog, CommitLogRange
+
+    try:
+        commit_range = CommitLogRange.objects.get(
+            project=project, startcommitid=startrev.commitid,
+            endcommitid=rev.commitid)
+    except CommitLogRange.DoesNotExist:
+        return None
+    commitids = commit_range.get_commitids()
+    if not commit_range.complete and (end is None or len(commitids) < end):
+        return None
+    commit_logs = dict(
+        (commit_log.commitid, commit_log)
+        for commit_log in CommitLog.objects.filter(
+            project=project, commitid__in=commitids))
+    if len(commit_logs) < len(set(commitids)):
+        return None
+    return [commit_logs[commitid].as_log() for commitid in commitids]
+
+
+def store_logs(project, rev, startrev, logs, offset=0, complete=True):
+    """Stores the logs of a commit range, unless they contain errors
+
+    Ranges can be stored page by page: logs are then the ones after the
+    offset newest commits, and complete tells whether they are the last
+    ones of the range. A page is only added to the stored newest commits
+    of the range when it follows them.
+    """
+    from ..models import CommitLog, CommitLogRange
+
+    if not logs:
+        return
+    for log in logs:
+        if 'error' in log or log.get('commitid') in (None, '-'):
+            return
+
+    commit_logs = [CommitLog.from_log(project, log) for log in logs]
+    commitids = [commit_log.commitid for commit_log in commit_logs]
+    existing = set(CommitLog.objects.filter(
+        project=project, commitid__in=commitids
+    ).values_list('commitid', flat=True))
+    new_logs = {}
+    for commit_log in commit_logs:
+        if commit_log.commitid not in existing:
+            new_logs.setdefault(commit_log.commitid, commit_log)
+
+    range_filter = dict(project=project, startcommitid=startrev.commitid,
+                        endcommitid=rev.commitid)
+    try:
+        with transaction.atomic():
+            if offset:
+                stored = CommitLogRange.objects.select_for_update().filter(
+                    **range_filter).first()
+                if stored is None or stored.complete:
+                    return
+                stored_commitids = stored.get_commitids()
+                if len(stored_commitids) < offset:
+                    return
+                commitids = stored_commitids[:offset] + commitids
+            commit_range = CommitLogRange(complete=complete, **range_filter)
+            commit_range.set_commitids(commitids)
+            CommitLog.objects.bulk_create(new_logs.values())
+            CommitLogRange.objects.filter(**range_filter).delete()
+            commit_range.save()
+    except IntegrityError:
+        # Stored concurrently by another request
+        pass
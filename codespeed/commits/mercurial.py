@@ -3,27 +3,46 @@ from __future__ import absolute_import
 
 import os
 import datetime
+import tempfile
 from subprocess import Popen, PIPE
 import logging
 
 from django.conf import settings
 
+from . import cmdserver
 from .exceptions import CommitLogError
+from .logs import split_stream
 
 logger = logging.getLogger(__name__)
 
 
+def run_hg(args, working_copy):
+    """Runs hg with args in working_copy
+
+    Returns the return code and the decoded stdout and stderr. With the
+    HG_USE_CMDSERVER setting, the command is run by a pooled command server
+    instead of a new hg process.
+    """
+    if getattr(settings, 'HG_USE_CMDSERVER', False):
+        returncode, stdout, stderr = cmdserver.runcommand(args, working_copy)
+    else:
+        p = Popen(['hg'] + args, stdout=PIPE, stderr=PIPE, cwd=working_copy)
+        stdout, stderr = p.communicate()
+        returncode = p.returncode
+    return (returncode, stdout.decode('utf-8', 'replace'),
+            stderr.decode('utf-8', 'replace'))
+
+
 def updaterepo(project, update=True):
     if os.path.exists(project.working_copy):
         if not update:
             return
 
-        p = Popen(['hg', 'pull', '-u'], stdout=PIPE, stderr=PIPE,
-                  cwd=project.working_copy)
-        stdout, stderr = p.communicate()
+        returncode, stdout, stderr = run_hg(['pull', '-u'],
+                                            project.working_copy)
 
-        if p.returncode != 0 or stderr:
-            raise CommitLogError("hg pull returned %s: %s" % (p.returncode,
+        if returncode != 0 or stderr:
+            raise CommitLogError("hg pull returned %s: %s" % (returncode,
                                                               stderr))
         else:
             return [{'error': False}]
@@ -45,60 +64,88 @@ def updaterepo(project, update=True):
             return [{'error': False}]
 
 
+LOG_TEMPLATE = ("{rev}:{node|short}\n{node}\n{author|user}\n{author|email}"
+                "\n{date}\n{tags}\n{desc}\n=newlog=\n")
+
+
+def _parse_log(log):
+    elements = log.split('\n')[:-1]
+    if len(elements) < 7:
+        # "Malformed" log
+        return {'date': '-', 'message': 'error parsing log', 'commitid': '-'}
+
+    short_commit_id = elements.pop(0)
+    commit_id = elements.pop(0)
+    author_name = elements.pop(0)
+    author_email = elements.pop(0)
+    date = elements.pop(0)
+    tag = elements.pop(0)
+    tag = "" if tag == "tip" else tag
+    # All other newlines should belong to the description text. Join.
+    message = '\n'.join(elements)
+
+    # Parse date
+    date = date.split('-')[0]
+    date = datetime.datetime.fromtimestamp(
+        float(date)).strftime("%Y-%m-%d %H:%M:%S")
+
+    # Add changeset info
+    return {
+        'date': date,
+        'author': author_name,
+        'author_email': author_email,
+        'message': message,
+        'short_commit_id': short_commit_id,
+        'commitid': commit_id,
+        'tag': tag
+    }
+
+
 def getlogs(endrev, startrev):
     updaterepo(endrev.branch.project, update=False)
 
     cmd = [
-        "hg", "log",
+        "log",
         "-r", "%s::%s" % (startrev.commitid, endrev.commitid),
-        "--template",
-        ("{rev}:{node|short}\n{node}\n{author|user}\n{author|email}"
-         "\n{date}\n{tags}\n{desc}\n=newlog=\n")
+        "--template", LOG_TEMPLATE
     ]
 
     working_copy = endrev.branch.project.working_copy
-    p = Popen(cmd, stdout=PIPE, stderr=PIPE, cwd=working_copy)
-    stdout, stderr = p.communicate()
+    returncode, stdout, stderr = run_hg(cmd, working_copy)
 
-    if p.returncode != 0:
-        raise CommitLogError(str(stderr))
+    if returncode != 0:
+        raise CommitLogError(stderr)
     else:
         stdout = stdout.rstrip('\n')  # Remove last newline
-        logs = []
-        for log in stdout.split("=newlog=\n"):
-            elements = []
-            elements = log.split('\n')[:-1]
-            if len(elements) < 7:
-                # "Malformed" log
-                logs.append({
-                    'date': '-', 'message': 'error parsing log', 'commitid': '-'})
-            else:
-                short_commit_id = elements.pop(0)
-                commit_id = elements.pop(0)
-                author_name = elements.pop(0)
-                author_email = elements.pop(0)
-                date = elements.pop(0)
-                tag = elements.pop(0)
-                tag = "" if tag == "tip" else tag
-                # All other newlines should belong to the description text. Join.
-                message = '\n'.join(elements)
-
-                # Parse date
-                date = date.split('-')[0]
-                date = datetime.datetime.fromtimestamp(
-                    float(date)).strftime("%Y-%m-%d %H:%M:%S")
-
-                # Add changeset info
-                logs.append({
-                    'date': date,
-                    'author': author_name,
-                    'author_email': author_email,
-                    'message': message,
-                    'short_commit_id': short_commit_id,
-                    'commitid': commit_id,
-                    'tag': tag
-                })
+        logs = [_parse_log(log) for log in stdout.split("=newlog=\n")]
     # Remove last log here because mercurial saves the short hast as commitid now
     if len(logs) > 1 and logs[-1].get('short_commit_id') == startrev.commitid:
         logs.pop()
     return logs
+
+
+def iterlogs(working_copy):
+    """Yields the logs of all the commits of a working copy, newest first
+
+    The output of hg log is parsed as it is produced, so that memory use
+    doesn't depend on the size of the history. hg is stopped when the
+    generator is closed early.
+    """
+    cmd = ["hg", "log", "--template", LOG_TEMPLATE]
+    env = dict(os.environ, HGPLAIN='1', HGENCODING='UTF-8')
+    with tempfile.TemporaryFile() as stderr:
+        p = Popen(cmd, stdout=PIPE, stderr=stderr, cwd=working_copy, env=env)
+        try:
+            for log in split_stream(p.stdout, b'=newlog=\n'):
+                yield _parse_log(log.decode('utf-8', 'replace'))
+            p.wait()
+            if p.returncode != 0:
+                stderr.seek(0)
+                raise CommitLogError("%s returned %s: %s" % (
+                    " ".join(cmd), p.returncode,
+                    stderr.read().decode('utf-8', 'replace')))
+        finally:
+            if p.poll() is None:
+                p.kill()
+            p.stdout.close()
+            p.wait()
@@ -2,64 +2,124 @@
 """Subversion commit logs support"""
 from __future__ import absolute_import
 
+import threading
 from datetime import datetime
 
 from .exceptions import CommitLogError
 
+# Maximum number of logs returned for a range
+LOG_LIMIT = 200
+
+# (repo_path, repo_user, repo_pass) -> (client, lock)
+_clients = {}
+# tags URL -> (revision of the index, {tag name: created revision number})
+_tag_indexes = {}
+_lock = threading.Lock()
+
 
 def updaterepo(project):
     """Not needed for a remote subversion repo"""
     return [{'error': False}]
 
 
-def get_tag(rev_num, repo_path, client):
+def get_client(project):
+    """Returns the client of project and the lock that serializes its use
+
+    Clients are kept for the life of the process, since creating one reads
+    the subversion configuration and authentication caches.
+    """
+    import pysvn
+
+    key = (project.repo_path, project.repo_user, project.repo_pass)
+    with _lock:
+        if key not in _clients:
+            client = pysvn.Client()
+            if project.repo_user != "":
+                def get_login(realm, username, may_save):
+                    return True, key[1], key[2], False
+                client.callback_get_login = get_login
+            _clients[key] = (client, threading.Lock())
+        return _clients[key]
+
+
+def _number(rev_num):
+    import pysvn
+    return pysvn.Revision(pysvn.opt_revision_kind.number, rev_num)
+
+
+def get_tags(repo_path, client):
+    """Returns the tags of a repository, keyed by their created revision
+
+    The tags directory is only listed once. Afterwards, the tags added,
+    changed or removed since the index was built are read from the log of
+    the tags directory, when its last changed revision shows that there
+    are any.
+    """
     tags_url = repo_path + '/tags'
-    tags = client.ls(tags_url)
+    _, info = client.info2(tags_url, recurse=False)[0]
+    last_changed = info['last_changed_rev'].number
+
+    with _lock:
+        index = _tag_indexes.get(tags_url)
 
-    for tag in tags:
-        if 'created_rev' in tag and tag['created_rev'].number == rev_num:
-            if 'name' in tag:
-                return tag['name'].split('/')[-1]
-    return ''
+    if index is None:
+        tags = {}
+        for tag in client.ls(tags_url):
+            if 'created_rev' in tag and 'name' in tag:
+                tags[tag['name'].split('/')[-1]] = tag['created_rev'].number
+    elif index[0] < last_changed:
+        tags = dict(index[1])
+        prefix = tags_url[len(info['repos_root_URL']):] + '/'
+        for log in client.log(tags_url,
+                              revision_start=_number(index[0] + 1),
+                              revision_end=_number(last_changed),
+                              discover_changed_paths=True):
+            for changed_path in log.changed_paths:
+                path = changed_path['path']
+                if not path.startswith(prefix):
+                    continue
+                name = path[len(prefix):].split('/')[0]
+                if changed_path['action'] == 'D' and path[len(prefix):] == name:
+                    tags.pop(name, None)
+                else:
+                    tags[name] = log.revision.number
+    else:
+        tags = index[1]
+
+    with _lock:
+        _tag_indexes[tags_url] = (last_changed, tags)
+    return dict((rev_num, name) for name, rev_num in sorted(tags.items()))
+
+
+def get_tag(rev_num, repo_path, client):
+    return get_tags(repo_path, client).get(rev_num, '')
 
 
 def getlogs(newrev, startrev):
     import pysvn
 
     logs = []
-    log_messages = []
-    loglimit = 200
-
-    def get_login(realm, username, may_save):
-        repo_user = newrev.branch.project.repo_user
-        repo_pass = newrev.branch.project.repo_pass
-        return True, repo_user, repo_pass, False
-
-    client = pysvn.Client()
-    if newrev.branch.project.repo_user != "":
-        client.callback_get_login = get_login
+    repo_path = newrev.branch.project.repo_path
+    client, client_lock = get_client(newrev.branch.project)
 
     try:
-        log_messages = \
-            client.log(
-                newrev.branch.project.repo_path,
-                revision_start=pysvn.Revision(
-                    pysvn.opt_revision_kind.number, startrev.commitid
-                ),
-                revision_end=pysvn.Revision(
-                    pysvn.opt_revision_kind.number, newrev.commitid
-                )
-            )
+        with client_lock:
+            # Newest first, so that limit keeps the latest logs
+            log_messages = client.log(
+                repo_path,
+                revision_start=_number(int(newrev.commitid)),
+                revision_end=_number(int(startrev.commitid)),
+                limit=LOG_LIMIT)
+            try:
+                tags = get_tags(repo_path, client)
+            except pysvn.ClientError:
+                # No tags directory
+                tags = {}
     except pysvn.ClientError as e:
         raise CommitLogError(e.args)
     except ValueError:
         raise CommitLogError(
             "'%s' is an invalid subversion revision number" % newrev.commitid)
-    log_messages.reverse()
-    s = len(log_messages)
-    while s > loglimit:
-        log_messages = log_messages[:s]
-        s = len(log_messages) - 1
 
     for log in log_messages:
         try:
@@ -68,8 +128,7 @@ def getlogs(newrev, startrev):
             author = ""
         date = datetime.fromtimestamp(log.date).strftime("%Y-%m-%d %H:%M:%S")
         message = log.message
-        tag = get_tag(log.revision.number,
-                      newrev.branch.project.repo_path, client)
+        tag = tags.get(log.revision.number, '')
         # Add log unless it is the last commit log, which has already been tested
         logs.append({
             'date': date, 'author': author, 'message': message,
@@ -1,8 +1,19 @@
+import shutil
+import tempfile
 from datetime import datetime
+from io import BytesIO
+from subprocess import check_output
+from unittest import skipUnless
+try:
+    from shutil import which
+except ImportError:
+    # Python 2
+    from distutils.spawn import find_executable as which
+
 from django.test import TestCase, override_settings
 from mock import Mock, patch
 
-from codespeed.commits.git import getlogs
+from codespeed.commits.git import getlogs, get_tags, iterlogs
 from codespeed.models import Project, Revision, Branch, Environment
 
 
@@ -29,15 +40,17 @@ class GitTest(TestCase):
         # given
         outputs = {
             "log": b"id\x00long_id\x001583489681\x00author\x00email\x00msg\x00\x1e",
-            "tag": b'tag',
+            "show-ref": b"long_id refs/tags/tag\n",
         }
 
         def side_effect(cmd, *args, **kwargs):
             ret = Mock()
             ret.returncode = 0
+            ret.poll.return_value = 0
             git_command = cmd[1] if len(cmd) > 0 else None
             output = outputs.get(git_command, b'')
             ret.communicate.return_value = (output, b'')
+            ret.stdout = BytesIO(output)
             return ret
 
         popen.side_effect = side_effect
@@ -58,3 +71,101 @@ class GitTest(TestCase):
             'tag': 'tag',
         }
         self.assertEquals([expected], logs)
+
+    @patch("codespeed.commits.git.Popen")
+    def test_tags_listed_once(self, popen):
+        outputs = {
+            "log": (b"id1\x00long_id1\x001583489681\x00a\x00e\x00m1\x00\x1e"
+                    b"id2\x00long_id2\x001583489682\x00a\x00e\x00m2\x00\x1e"
+                    b"id3\x00long_id3\x001583489683\x00a\x00e\x00m3\x00\x1e"),
+            "show-ref": (b"long_id1 refs/tags/v1.0\n"
+                         b"tag_object refs/tags/v2.0\n"
+                         b"long_id2 refs/tags/v2.0^{}\n"
+                         b"long_id2 refs/tags/latest\n"),
+        }
+
+        def side_effect(cmd, *args, **kwargs):
+            ret = Mock()
+            ret.returncode = 0
+            ret.poll.return_value = 0
+            ret.communicate.return_value = (outputs.get(cmd[1], b''), b'')
+            ret.stdout = BytesIO(outputs.get(cmd[1], b''))
+            return ret
+
+        popen.side_effect = side_effect
+        logs = getlogs(self.revision, self.revision)
+
+        commands = [call[0][0][1] for call in popen.call_args_list]
+        self.assertEqual(commands.count('show-ref'), 1)
+        self.assertNotIn('tag', commands)
+        self.assertEqual([log['tag'] for log in logs],
+                         ['v1.0', 'latest\nv2.0', ''])
+
+
+@skipUnless(which('git'), "git is not installed")
+class GitTagsTest(TestCase):
+    def setUp(self):
+        self.working_copy = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.working_copy)
+        self.git('init', '-q')
+        self.git('-c', 'user.name=a', '-c', 'user.email=a@example.com',
+                 'commit', '-q', '--allow-empty', '-m', 'first')
+        self.commit_id = self.git('rev-parse', 'HEAD').strip()
+
+    def git(self, *args):
+        return check_output(('git',) + args, cwd=self.working_copy).decode()
+
+    def test_tags_cached_until_refs_change(self):
+        self.git('tag', 'v1.0')
+        self.assertEqual(get_tags(self.working_copy),
+                         {self.commit_id: 'v1.0'})
+
+        with patch("codespeed.commits.git.Popen") as popen:
+            self.assertEqual(get_tags(self.working_copy),
+                             {self.commit_id: 'v1.0'})
+            self.assertFalse(popen.called)
+
+        self.git('-c', 'user.name=a', '-c', 'user.email=a@example.com',
+                 'tag', '-a', '-m', 'annotated', 'v2.0')
+        self.assertEqual(get_tags(self.working_copy),
+                         {self.commit_id: 'v1.0\nv2.0'})
+
+        self.git('pack-refs', '--all')
+        self.git('tag', '-d', 'v1.0')
+        self.assertEqual(get_tags(self.working_copy),
+                         {self.commit_id: 'v2.0'})
+
+
+@skipUnless(which('git'), "git is not installed")
+class GitLogsTest(TestCase):
+    def setUp(self):
+        self.working_copy = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.working_copy)
+        self.git('init', '-q')
+        for i in range(6):
+            self.git('-c', 'user.name=a', '-c', 'user.email=a@example.com',
+                     'commit', '-q', '--allow-empty', '-m', 'commit %d' % i)
+        self.commit_ids = self.git('rev-list', 'HEAD').split()
+
+        project = Mock(working_copy=self.working_copy)
+        branch = Mock(project=project)
+        self.endrev = Mock(commitid=self.commit_ids[0], branch=branch)
+        self.startrev = Mock(commitid=self.commit_ids[-1], branch=branch)
+
+    def git(self, *args):
+        return check_output(('git',) + args, cwd=self.working_copy).decode()
+
+    def test_pages(self):
+        logs = getlogs(self.endrev, self.startrev)
+        self.assertEqual([log['commitid'] for log in logs],
+                         self.commit_ids[:-1])
+
+        logs = getlogs(self.endrev, self.startrev, limit=2, offset=1)
+        self.assertEqual([log['message'] for log in logs],
+                         ['commit 4', 'commit 3'])
+
+    def test_iterlogs_closed_early(self):
+        logs = iterlogs(self.working_copy)
+        self.assertEqual(next(logs)['commitid'], self.commit_ids[0])
+        logs.close()
+        self.assertEqual(len(list(iterlogs(self.working_copy))), 6)
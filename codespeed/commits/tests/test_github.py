@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+from datetime import datetime
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from mock import patch
+
+from codespeed.commits import get_logs
+from codespeed.models import Project, Revision, Branch
+
+
+def make_commit(sha, parent, day):
+    return {
+        'sha': sha,
+        'message': 'message of %s' % sha,
+        'author': {'name': 'author', 'email': 'author@example.com',
+                   'date': '2020-03-%02dT10:00:00Z' % day},
+        'committer': {'name': 'author', 'email': 'author@example.com',
+                      'date': '2020-03-%02dT10:00:00Z' % day},
+        'parents': [{'sha': parent}] if parent else [],
+    }
+
+
+COMMITS = [make_commit('sha1', None, 1), make_commit('sha2', 'sha1', 2),
+           make_commit('sha3', 'sha2', 3), make_commit('sha4', 'sha3', 4)]
+
+TAGS = [{'ref': 'refs/tags/v1.0', 'object': {'sha': 'sha3'}}]
+
+REPO = '/repos/user/repo'
+
+
+def make_documents():
+    documents = {REPO + '/git/refs/tags': TAGS}
+    for commit in COMMITS:
+        documents[REPO + '/git/commits/' + commit['sha']] = commit
+    documents[REPO + '/compare/sha1...sha4'] = {
+        'status': 'ahead',
+        'commits': [{'sha': commit['sha'],
+                     'commit': dict((key, commit[key]) for key in
+                                    ('message', 'author', 'committer')),
+                     'parents': commit['parents']}
+                    for commit in COMMITS[1:]],
+    }
+    return documents
+
+
+class GithubHandler(BaseHTTPRequestHandler):
+    """Serves the documents of the server, with ETags"""
+
+    def do_GET(self):
+        self.server.requests.append(
+            (self.path, self.headers.get('If-None-Match')))
+        document = self.server.documents.get(self.path)
+        if document is None:
+            status, body = 404, json.dumps({'message': 'Not Found'})
+        else:
+            status, body = 200, json.dumps(document)
+        etag = '"%d"' % (hash(body) & 0xffffffff)
+        if status == 200 and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body.encode('utf-8'))
+
+    def log_message(self, *args):
+        pass
+
+
+class GithubTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(GithubTest, cls).setUpClass()
+        cls.server = HTTPServer(('127.0.0.1', 0), GithubHandler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+        cls.settings = override_settings(
+            GITHUB_API_URL='http://127.0.0.1:%d/' % cls.server.server_port,
+            GITHUB_FETCH_THREADS=2)
+        cls.settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings.disable()
+        cls.server.shutdown()
+        cls.server.server_close()
+        super(GithubTest, cls).tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.server.documents = make_documents()
+        self.server.requests = []
+        project = Project.objects.create(
+            name='project', repo_path='https://github.com/user/repo',
+            repo_type=Project.GITHUB)
+        self.branch = Branch.objects.create(name='master', project=project)
+        self.startrev = Revision.objects.create(
+            commitid='sha1', date=datetime(2020, 3, 1, 10), branch=self.branch)
+        self.rev = Revision.objects.create(
+            commitid='sha4', date=datetime(2020, 1, 1), branch=self.branch)
+
+    def paths(self):
+        return [path for path, etag in self.server.requests]
+
+    def test_range_is_compared(self):
+        logs = get_logs(self.rev, self.startrev)
+        self.assertEqual([log['commitid'] for log in logs],
+                         ['sha4', 'sha3', 'sha2'])
+        self.assertEqual([log['tag'] for log in logs], ['', 'v1.0', ''])
+        self.assertEqual(logs[0]['short_commit_id'], 'sha4')
+        self.assertEqual(sorted(self.paths()), [
+            REPO + '/compare/sha1...sha4', REPO + '/git/refs/tags'])
+
+        # Revisions of the range are kept in sync with Github
+        rev = Revision.objects.get(pk=self.rev.pk)
+        self.assertEqual(rev.date, datetime(2020, 3, 4, 10))
+        self.assertEqual(rev.message, 'message of sha4')
+
+    @patch('codespeed.commits.github.COMPARE_PAGE_SIZE', 2)
+    def test_long_ranges_are_paged(self):
+        compare = self.server.documents[REPO + '/compare/sha1...sha4']
+        commits = compare['commits']
+        # Truncated as by Github
+        compare.update(commits=commits[:2], total_commits=3)
+        self.server.documents[
+            REPO + '/compare/sha1...sha4?per_page=2&page=2'] = dict(
+                compare, commits=commits[2:])
+
+        logs = get_logs(self.rev, self.startrev)
+        self.assertEqual([log['commitid'] for log in logs],
+                         ['sha4', 'sha3', 'sha2'])
+        self.assertIn(REPO + '/compare/sha1...sha4?per_page=2&page=2',
+                      self.paths())
+
+        # Incomplete ranges are walked instead
+        cache.clear()
+        del self.server.documents[
+            REPO + '/compare/sha1...sha4?per_page=2&page=2']
+        Revision.objects.create(
+            commitid='sha3', date=datetime(2020, 3, 3, 10), branch=self.branch)
+        # Dated by the first call
+        rev = Revision.objects.get(pk=self.rev.pk)
+        logs = get_logs(rev, self.startrev)
+        self.assertEqual([log['commitid'] for log in logs],
+                         ['sha4', 'sha3', 'sha2'])
+        self.assertIn(REPO + '/git/commits/sha2', self.paths())
+
+    def test_tags_revalidated(self):
+        get_logs(self.rev, self.startrev)
+        self.server.requests = []
+
+        get_logs(self.rev, self.startrev)
+        self.assertEqual(len(self.server.requests), 1)
+        path, etag = self.server.requests[0]
+        self.assertEqual(path, REPO + '/git/refs/tags')
+        self.assertIsNotNone(etag)
+
+        # A new tag is seen on the next call
+        self.server.documents[REPO + '/git/refs/tags'] = TAGS + [
+            {'ref': 'refs/tags/v2.0', 'object': {'sha': 'sha4'}}]
+        logs = get_logs(self.rev, self.startrev)
+        self.assertEqual(logs[0]['tag'], 'v2.0')
+
+    def test_no_tags(self):
+        del self.server.documents[REPO + '/git/refs/tags']
+        logs = get_logs(self.rev, self.startrev)
+        self.assertEqual([log['tag'] for log in logs], ['', '', ''])
+
+    def test_single_commit(self):
+        logs = get_logs(self.rev, self.rev)
+        self.assertEqual([log['commitid'] for log in logs], ['sha4'])
+        self.assertEqual(sorted(self.paths()), [
+            REPO + '/git/commits/sha4', REPO + '/git/refs/tags'])
+        self.assertEqual(Revision.objects.get(pk=self.rev.pk).date,
+                         datetime(2020, 3, 4, 10))
+
+    def test_fallback_without_compare(self):
+        del self.server.documents[REPO + '/compare/sha1...sha4']
+        Revision.objects.filter(pk=self.rev.pk).update(
+            date=datetime(2020, 3, 4, 10))
+        self.rev.date = datetime(2020, 3, 4, 10)
+        Revision.objects.create(
+            commitid='sha3', date=datetime(2020, 3, 3, 10), branch=self.branch)
+
+        logs = get_logs(self.rev, self.startrev)
+        self.assertEqual([log['commitid'] for log in logs],
+                         ['sha4', 'sha3', 'sha2'])
+        self.assertEqual(logs[1]['tag'], 'v1.0')
+        self.assertIn(REPO + '/git/commits/sha2', self.paths())
+        self.assertNotIn(REPO + '/git/commits/sha1', self.paths())
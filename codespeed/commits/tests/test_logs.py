@@ -0,0 +1,126 @@
+from datetime import datetime, timedelta
+from io import BytesIO
+
+from django.test import TestCase
+from mock import patch
+
+from codespeed.commits import get_logs
+from codespeed.commits.logs import split_stream
+from codespeed.models import (Project, Revision, Branch, CommitLog,
+                              CommitLogRange)
+
+
+def make_log(commitid, tag=''):
+    return {
+        'date': '2020-03-06 04:14:41',
+        'message': 'message of %s' % commitid,
+        'commitid': commitid,
+        'author': 'author',
+        'author_email': 'email',
+        'body': 'body',
+        'short_commit_id': commitid[:2],
+        'tag': tag,
+    }
+
+
+class StoredLogsTest(TestCase):
+    def setUp(self):
+        self.project = Project.objects.create(name='project',
+                                              repo_path='path',
+                                              repo_type=Project.GIT)
+        branch = Branch.objects.create(name='default', project=self.project)
+        self.startrev = Revision.objects.create(
+            commitid='id1', date=datetime.now() - timedelta(days=1),
+            branch=branch)
+        self.rev = Revision.objects.create(
+            commitid='id4', date=datetime.now(), branch=branch)
+        self.logs = [make_log('id4'), make_log('id3', tag='v1.0'),
+                     make_log('id2'), make_log('id1')]
+
+    @patch('codespeed.commits.git.getlogs')
+    def test_logs_read_once(self, getlogs):
+        getlogs.return_value = list(self.logs)
+
+        logs = get_logs(self.rev, self.startrev, cached=True)
+        self.assertEqual(logs, self.logs[:-1])
+        self.assertEqual(CommitLog.objects.count(), 3)
+
+        with self.assertNumQueries(2):
+            self.assertEqual(
+                get_logs(self.rev, self.startrev, cached=True), logs)
+        self.assertEqual(getlogs.call_count, 1)
+
+        # Not read from the database unless asked to
+        get_logs(self.rev, self.startrev)
+        self.assertEqual(getlogs.call_count, 2)
+
+    @patch('codespeed.commits.git.getlogs')
+    def test_missing_logs_are_read_again(self, getlogs):
+        getlogs.return_value = list(self.logs)
+        get_logs(self.rev, self.startrev, cached=True)
+
+        CommitLog.objects.filter(commitid='id3').delete()
+        self.assertEqual(get_logs(self.rev, self.startrev, cached=True),
+                         self.logs[:-1])
+        self.assertEqual(getlogs.call_count, 2)
+        self.assertEqual(CommitLog.objects.count(), 3)
+        self.assertEqual(CommitLogRange.objects.count(), 1)
+
+    @patch('codespeed.commits.git.getlogs')
+    def test_pages(self, getlogs):
+        getlogs.return_value = self.logs[1:3]
+        logs = get_logs(self.rev, self.startrev, cached=True, limit=2,
+                        offset=1)
+        self.assertEqual(logs, self.logs[1:3])
+        getlogs.assert_called_with(self.rev, self.startrev, limit=2, offset=1)
+        # Not stored, as the newest commit of the range is unknown
+        self.assertEqual(CommitLogRange.objects.count(), 0)
+
+        getlogs.return_value = list(self.logs)
+        get_logs(self.rev, self.startrev, cached=True, limit=10)
+        self.assertEqual(CommitLogRange.objects.count(), 1)
+        with self.assertNumQueries(2):
+            self.assertEqual(get_logs(self.rev, self.startrev, cached=True,
+                                      limit=2, offset=1),
+                             self.logs[1:3])
+        self.assertEqual(getlogs.call_count, 2)
+
+    @patch('codespeed.commits.git.getlogs')
+    def test_ranges_stored_page_by_page(self, getlogs):
+        getlogs.side_effect = lambda rev, startrev, limit, offset: (
+            self.logs[offset:offset + limit])
+
+        self.assertEqual(get_logs(self.rev, self.startrev, cached=True,
+                                  limit=2), self.logs[:2])
+        commit_range = CommitLogRange.objects.get()
+        self.assertFalse(commit_range.complete)
+        # Pages within the stored newest commits are not read again
+        self.assertEqual(get_logs(self.rev, self.startrev, cached=True,
+                                  limit=1, offset=1), self.logs[1:2])
+        self.assertEqual(getlogs.call_count, 1)
+
+        self.assertEqual(get_logs(self.rev, self.startrev, cached=True,
+                                  limit=2, offset=2), self.logs[2:3])
+        commit_range = CommitLogRange.objects.get()
+        self.assertTrue(commit_range.complete)
+        self.assertEqual(commit_range.get_commitids(), ['id4', 'id3', 'id2'])
+        self.assertEqual(get_logs(self.rev, self.startrev, cached=True),
+                         self.logs[:-1])
+        self.assertEqual(getlogs.call_count, 2)
+
+    @patch('codespeed.commits.git.getlogs')
+    def test_errors_are_not_stored(self, getlogs):
+        getlogs.return_value = [
+            {'date': '-', 'message': 'error parsing log', 'commitid': '-'}]
+        get_logs(self.rev, self.startrev, cached=True)
+        get_logs(self.rev, self.startrev, cached=True)
+        self.assertEqual(getlogs.call_count, 2)
+        self.assertEqual(CommitLog.objects.count(), 0)
+
+
+class SplitStreamTest(TestCase):
+    def test_records_across_chunks(self):
+        stream = BytesIO(b'first\x1esecond record\x1e\x1elast')
+        self.assertEqual(
+            list(split_stream(stream, b'\x1e', chunk_size=3)),
+            [b'first', b'second record', b'', b'last'])
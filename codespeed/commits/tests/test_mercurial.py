@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import struct
+import tempfile
+from datetime import datetime
+from io import BytesIO
+
+from django.test import TestCase, override_settings
+from mock import Mock, patch
+
+from codespeed.commits import cmdserver
+from codespeed.commits.exceptions import CommitLogError
+from codespeed.commits.mercurial import getlogs
+from codespeed.models import Project, Revision, Branch
+
+HELLO = b'capabilities: getencoding runcommand\nencoding: UTF-8\npid: 1'
+
+LOG = (u'1:2d1c4bf0fa6e\n2d1c4bf0fa6e\nauthor\nauthor@example.com\n'
+       u'1583489681.0-3600\ntag\nmessage é\n=newlog=\n').encode('utf-8')
+
+
+def message(channel, data):
+    return struct.pack('>cI', channel, len(data)) + data
+
+
+def result(returncode):
+    return message(b'r', struct.pack('>i', returncode))
+
+
+class FakeStdin(BytesIO):
+    def close(self):
+        self.closed_by_client = True
+
+
+class FakeServer(object):
+    """Stands in for the pipes of an "hg serve --cmdserver pipe" process"""
+
+    def __init__(self, output):
+        self.stdin = FakeStdin()
+        self.stdout = BytesIO(message(b'o', HELLO) + output)
+        self.wait = Mock(return_value=0)
+
+
+class CommandServerTest(TestCase):
+    @patch('codespeed.commits.cmdserver.Popen')
+    def test_runcommand(self, popen):
+        popen.return_value = FakeServer(
+            message(b'o', b'out') + message(b'e', b'err') +
+            message(b'd', b'debug') + message(b'o', b'put') + result(1))
+
+        server = cmdserver.CommandServer('/repo')
+        self.assertEqual(server.capabilities, ['getencoding', 'runcommand'])
+        self.assertEqual(server.runcommand(['log', '-r', 'tip']),
+                         (1, b'output', b'err'))
+        self.assertEqual(popen.return_value.stdin.getvalue(),
+                         b'runcommand\n\x00\x00\x00\x0alog\x00-r\x00tip')
+        self.assertEqual(popen.call_args[0][0],
+                         ['hg', 'serve', '--cmdserver', 'pipe'])
+
+    @patch('codespeed.commits.cmdserver.Popen')
+    def test_input_is_not_supported(self, popen):
+        popen.return_value = FakeServer(message(b'I', b'')[:5])
+        server = cmdserver.CommandServer('/repo')
+        self.assertRaises(cmdserver.CommandServerError,
+                          server.runcommand, ['commit'])
+
+    @patch('codespeed.commits.cmdserver.Popen')
+    def test_server_exited(self, popen):
+        popen.return_value = FakeServer(message(b'o', b'out')[:3])
+        server = cmdserver.CommandServer('/repo')
+        self.assertRaises(EOFError, server.runcommand, ['log'])
+
+
+@override_settings(HG_USE_CMDSERVER=True, HG_CMDSERVER_IDLE_TIMEOUT=60)
+class MercurialTest(TestCase):
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+        self.settings = override_settings(REPOSITORY_BASE_PATH=self.base_path)
+        self.settings.enable()
+        os.mkdir(os.path.join(self.base_path, 'repo'))
+        project = Project.objects.create(
+            name='project', repo_path='https://hg.example.com/repo',
+            repo_type=Project.MERCURIAL)
+        branch = Branch.objects.create(name='default', project=project)
+        self.rev = Revision.objects.create(
+            commitid='2d1c4bf0fa6e', date=datetime.now(), branch=branch)
+
+    def tearDown(self):
+        cmdserver.close_servers()
+        self.settings.disable()
+        shutil.rmtree(self.base_path)
+
+    @patch('codespeed.commits.cmdserver.Popen')
+    def test_server_is_reused(self, popen):
+        popen.return_value = FakeServer(
+            (message(b'o', LOG) + result(0)) * 2)
+
+        for _ in range(2):
+            logs = getlogs(self.rev, self.rev)
+            self.assertEqual(len(logs), 1)
+            self.assertEqual(logs[0]['commitid'], '2d1c4bf0fa6e')
+            self.assertEqual(logs[0]['message'], u'message é')
+            self.assertEqual(logs[0]['tag'], 'tag')
+        self.assertEqual(popen.call_count, 1)
+
+    @patch('codespeed.commits.cmdserver.Popen')
+    def test_idle_servers_are_reaped(self, popen):
+        popen.side_effect = lambda *args, **kwargs: FakeServer(
+            message(b'o', LOG) + result(0))
+
+        getlogs(self.rev, self.rev)
+        server = cmdserver.get_server(self.rev.branch.project.working_copy)
+        cmdserver.reap_idle_servers(server.last_used + 30)
+        self.assertFalse(server.process.wait.called)
+        cmdserver.reap_idle_servers(server.last_used + 90)
+        self.assertTrue(server.process.stdin.closed_by_client)
+        self.assertTrue(server.process.wait.called)
+
+        getlogs(self.rev, self.rev)
+        self.assertEqual(popen.call_count, 2)
+
+    @patch('codespeed.commits.cmdserver.Popen')
+    def test_dead_server_is_replaced(self, popen):
+        servers = [FakeServer(b''), FakeServer(message(b'o', LOG) + result(0))]
+        popen.side_effect = lambda *args, **kwargs: servers.pop(0)
+
+        self.assertEqual(len(getlogs(self.rev, self.rev)), 1)
+        self.assertEqual(popen.call_count, 2)
+
+    @patch('codespeed.commits.cmdserver.Popen')
+    def test_command_error(self, popen):
+        popen.return_value = FakeServer(
+            message(b'e', b'abort: unknown revision') + result(255))
+        self.assertRaises(CommitLogError, getlogs, self.rev, self.rev)
+
+    @override_settings(HG_USE_CMDSERVER=False)
+    @patch('codespeed.commits.mercurial.Popen')
+    def test_without_cmdserver(self, popen):
+        popen.return_value.communicate.return_value = (LOG, b'')
+        popen.return_value.returncode = 0
+
+        for _ in range(2):
+            logs = getlogs(self.rev, self.rev)
+            self.assertEqual(logs[0]['message'], u'message é')
+        self.assertEqual(popen.call_count, 2)
+        self.assertEqual(popen.call_args[0][0][:2], ['hg', 'log'])
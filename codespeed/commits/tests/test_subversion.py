@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import shutil
+import subprocess
+import tempfile
+from unittest import skipUnless
+try:
+    from shutil import which
+except ImportError:
+    # Python 2
+    from distutils.spawn import find_executable as which
+
+from django.test import TestCase
+from mock import Mock, patch
+
+from codespeed.commits import subversion
+
+try:
+    import pysvn
+except ImportError:
+    pysvn = None
+
+
+class CountingClient(object):
+    """Forwards to a pysvn client, counting the directory listings"""
+
+    def __init__(self, client):
+        self.client = client
+        self.ls_calls = 0
+
+    def ls(self, *args, **kwargs):
+        self.ls_calls += 1
+        return self.client.ls(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+@skipUnless(pysvn and which('svnadmin'), "pysvn or svnadmin not installed")
+class SubversionTest(TestCase):
+    def setUp(self):
+        subversion._clients.clear()
+        subversion._tag_indexes.clear()
+        repo_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, repo_dir)
+        subprocess.check_call(['svnadmin', 'create', repo_dir])
+        self.url = 'file://' + repo_dir
+
+        self.client = pysvn.Client()
+        self.message = 'layout'
+        self.client.callback_get_log_message = lambda: (True, self.message)
+        # r1, then r2 to r4
+        self.client.mkdir([self.url + '/trunk', self.url + '/tags'], 'layout')
+        for i in range(3):
+            self.client.mkdir(self.url + '/trunk/dir%d' % i, 'commit %d' % i)
+        # r5
+        self.tag('v1.0')
+
+        project = Mock(repo_path=self.url, repo_user='', repo_pass='')
+        branch = Mock(project=project)
+        self.startrev = Mock(commitid='1', branch=branch)
+        self.endrev = Mock(commitid='5', branch=branch)
+
+    def tag(self, name):
+        self.message = 'tag %s' % name
+        self.client.copy(self.url + '/trunk', self.url + '/tags/' + name)
+
+    def test_getlogs(self):
+        logs = subversion.getlogs(self.endrev, self.startrev)
+        self.assertEqual([log['commitid'] for log in logs], [5, 4, 3, 2, 1])
+        self.assertEqual(logs[0]['tag'], 'v1.0')
+        self.assertEqual(logs[1]['message'], 'commit 2')
+        self.assertEqual([log['tag'] for log in logs[1:]], [''] * 4)
+
+    @patch('codespeed.commits.subversion.LOG_LIMIT', 2)
+    def test_limit(self):
+        logs = subversion.getlogs(self.endrev, self.startrev)
+        self.assertEqual([log['commitid'] for log in logs], [5, 4])
+
+    def test_client_reused(self):
+        project = self.endrev.branch.project
+        self.assertIs(subversion.get_client(project)[0],
+                      subversion.get_client(project)[0])
+
+    def test_tags_refreshed_incrementally(self):
+        client = CountingClient(pysvn.Client())
+        self.assertEqual(subversion.get_tags(self.url, client), {5: 'v1.0'})
+        self.assertEqual(subversion.get_tags(self.url, client), {5: 'v1.0'})
+
+        self.tag('v2.0')
+        self.message = 'remove v1.0'
+        self.client.remove(self.url + '/tags/v1.0')
+        self.assertEqual(subversion.get_tags(self.url, client), {6: 'v2.0'})
+        self.assertEqual(client.ls_calls, 1)
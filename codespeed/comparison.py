@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""Data of the comparison page
+
+The comparison page needs the value of every benchmark for each of its
+executables (an executable at a revision) and environments. The whole
+matrix is loaded with a single query on the results and cached in
+COMPARISON_CACHE under the global data version (see versions.py), so that
+every server process stops reading it as soon as results or the objects
+listed on the page change.
+"""
+from __future__ import absolute_import
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import Benchmark, Environment, Result
+from .views_data import getcomparisonexes
+from .versions import get_data_version
+
+CACHE_KEY = 'codespeed.comparisondata'
+
+
+def build_comparison_data():
+    """Returns the compdata served by getcomparisondata:
+
+    {exe key: {environment id: {benchmark id: value or None}}}, plus an
+    'error' entry.
+    """
+    executables, exekeys = getcomparisonexes()
+    benchmark_ids = list(Benchmark.objects.values_list('id', flat=True))
+    environment_ids = list(Environment.objects.values_list('id', flat=True))
+
+    pairs = set()
+    for proj in executables:
+        for exe in executables[proj]:
+            pairs.add((exe['revision'].id, exe['executable'].id))
+
+    values = {}
+    if pairs and environment_ids:
+        for rev_id, exe_id, env_id, bench_id, value in Result.objects.filter(
+                revision__in=set(pair[0] for pair in pairs),
+                executable__in=set(pair[1] for pair in pairs),
+        ).values_list('revision', 'executable', 'environment', 'benchmark',
+                      'value'):
+            values[(rev_id, exe_id, env_id, bench_id)] = value
+
+    compdata = {}
+    compdata['error'] = "Unknown error"
+    for proj in executables:
+        for exe in executables[proj]:
+            rev_id = exe['revision'].id
+            exe_id = exe['executable'].id
+            compdata[exe['key']] = {}
+            for env_id in environment_ids:
+                compdata[exe['key']][env_id] = dict(
+                    (bench_id, values.get((rev_id, exe_id, env_id, bench_id)))
+                    for bench_id in benchmark_ids)
+    compdata['error'] = "None"
+    return compdata
+
+
+def get_comparison_data_cache():
+    """Returns the cache holding the comparison data"""
+    return caches[getattr(settings, 'COMPARISON_CACHE', 'default')]
+
+
+def get_comparison_data():
+    """Returns the cached compdata, building it if needed"""
+    # Read before the results, so that the data is at least as recent as
+    # the version it is cached under
+    key = '%s.%s' % (CACHE_KEY, get_data_version()[0])
+    cache = get_comparison_data_cache()
+    compdata = cache.get(key)
+    if compdata is None:
+        compdata = build_comparison_data()
+        cache.set(key, compdata,
+                  getattr(settings, 'COMPARISON_CACHE_TIMEOUT', 604800))
+    return compdata
@@ -1,7 +1,9 @@
+import hashlib
+import json
 from io import BytesIO
-from matplotlib.figure import Figure
-from matplotlib.ticker import FormatStrFormatter
-from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from django.conf import settings
+from django.core.cache import caches
 
 DEF_CHART_W = 600
 DEF_CHART_H = 500
@@ -10,14 +12,75 @@ MIN_CHART_W = 400
 MIN_CHART_H = 300
 
 
-def gen_image_from_results(result_data, width, height):
+def get_plot_data(result_data, width, height):
+    """Returns everything the plot depends on, as plain data
+
+    The plot data can be sent to other processes and identifies the image
+    """
     canvas_width = width if width is not None else DEF_CHART_W
     canvas_height = height if height is not None else DEF_CHART_H
 
-    canvas_width = max(canvas_width, MIN_CHART_W)
-    canvas_height = max(canvas_height, MIN_CHART_H)
+    return {
+        'title': result_data['benchmark'].name,
+        'values': [element.value for element in result_data['results']],
+        'labels': [element.date.strftime('%d %b') for element in
+                   result_data['results']],
+        'relative': result_data['relative'],
+        'width': max(canvas_width, MIN_CHART_W),
+        'height': max(canvas_height, MIN_CHART_H),
+    }
+
+
+def get_plot_etag(plot_data):
+    """Returns a digest of the plot data, used as ETag and cache key"""
+    return hashlib.sha1(
+        json.dumps(plot_data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def get_image_cache():
+    return caches[getattr(settings, 'IMAGE_CACHE', 'default')]
+
+
+def _get_image_key(etag):
+    return 'codespeed.image.' + etag
+
+
+def is_image_cached(etag):
+    return get_image_cache().get(_get_image_key(etag)) is not None
+
+
+def cache_image(etag, image_data):
+    get_image_cache().set(_get_image_key(etag), image_data,
+                          getattr(settings, 'IMAGE_CACHE_TIMEOUT', 86400))
+
+
+def get_cached_image(plot_data, etag=None):
+    """Returns the PNG image of the plot, rendering it only when it is not
+    in the image cache"""
+    if etag is None:
+        etag = get_plot_etag(plot_data)
+    image_data = get_image_cache().get(_get_image_key(etag))
+    if image_data is None:
+        image_data = render_image(plot_data)
+        cache_image(etag, image_data)
+    return image_data
+
+
+def gen_image_from_results(result_data, width, height):
+    return render_image(get_plot_data(result_data, width, height))
+
+
+def render_image(plot_data):
+    # matplotlib is only imported by the processes that render images,
+    # as it dominates the import time and memory use of the application
+    from matplotlib.figure import Figure
+    from matplotlib.ticker import FormatStrFormatter
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    canvas_width = plot_data['width']
+    canvas_height = plot_data['height']
 
-    values = [element.value for element in result_data['results']]
+    values = plot_data['values']
 
     max_value = max(values)
     min_value = min(values)
@@ -32,11 +95,10 @@ def gen_image_from_results(result_data, width, height):
     yax = values
 
     ax.set_xticks(xax)
-    ax.set_xticklabels([element.date.strftime('%d %b') for element in
-                       result_data['results']], rotation=75)
-    ax.set_title(result_data['benchmark'].name)
+    ax.set_xticklabels(plot_data['labels'], rotation=75)
+    ax.set_title(plot_data['title'])
 
-    if result_data['relative']:
+    if plot_data['relative']:
         ax.yaxis.set_major_formatter(FormatStrFormatter('%.2f%%'))
 
     font_sizes = [16, 16]
@@ -48,7 +110,7 @@ def gen_image_from_results(result_data, width, height):
         elif value < 1000:
             font_sizes[idx] = 12
 
-    if result_data['relative']:
+    if plot_data['relative']:
         font_sizes[0] -= 2
 
     for item in ax.get_yticklabels():
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+from django.core.management.base import BaseCommand, CommandError
+
+from codespeed.commits.exceptions import CommitLogError
+from codespeed.models import Project
+from codespeed.repositories import backfill_revisions, is_fetched
+
+
+class Command(BaseCommand):
+    help = ("Sets the author, date, message and tag of the revisions that "
+            "have none, e.g. because the repository was unreachable when "
+            "they were created, reading the history of each working copy "
+            "once. Updates are saved in batches, so an interrupted run "
+            "resumes where it stopped when run again")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'projects', nargs='*', metavar='project',
+            help="Names of the projects to backfill (default: all the git "
+                 "and mercurial projects)")
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help="Number of revisions saved per transaction")
+
+    def handle(self, *args, **options):
+        projects = Project.objects.filter(
+            repo_type__in=(Project.GIT, Project.MERCURIAL)).order_by('name')
+        if options['projects']:
+            projects = projects.filter(name__in=options['projects'])
+            missing = set(options['projects']) - set(
+                project.name for project in projects)
+            if missing:
+                raise CommandError("Unknown git or mercurial projects: %s" %
+                                   ", ".join(sorted(missing)))
+
+        for project in projects:
+            if not is_fetched(project):
+                self.stdout.write(
+                    "%s: skipped, its working copy was not fetched" % project)
+                continue
+
+            def progress(updated, read):
+                self.stdout.write("%s: %d revisions updated, %d commits read"
+                                  % (project, updated, read))
+
+            try:
+                updated, not_found = backfill_revisions(
+                    project, options['batch_size'], progress)
+            except CommitLogError as e:
+                self.stderr.write("%s: %s" % (project, e))
+                continue
+            self.stdout.write("%s: updated %d revisions, %d not found" % (
+                project, updated, not_found))
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+from django.core.management.base import BaseCommand
+
+from codespeed.changepoints import update_change_points
+from codespeed.models import Environment, Executable, Result
+
+
+class Command(BaseCommand):
+    help = ("Detects the change points of the results of every executable "
+            "and environment, in the newest CHANGEPOINT_DEPTH revisions of "
+            "each branch with results")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--executable', action='append', default=[], dest='executables',
+            help="Name of an executable to process (default: all of them). "
+                 "Can be given several times")
+
+    def handle(self, *args, **options):
+        results = Result.objects.all()
+        if options['executables']:
+            results = results.filter(
+                executable__name__in=options['executables'])
+        series = results.values_list(
+            'executable', 'environment', 'branch').distinct()
+        executables = Executable.objects.in_bulk(
+            set(exe_id for exe_id, _, _ in series))
+        environments = Environment.objects.in_bulk(
+            set(env_id for _, env_id, _ in series))
+
+        detected = 0
+        for exe_id, env_id, branch_id in sorted(series):
+            latest = Result.objects.filter(
+                executable=exe_id, environment=env_id, branch=branch_id
+            ).select_related('revision__branch').order_by(
+                '-revision__date').first()
+            change_points = update_change_points(
+                latest.revision, executables[exe_id], environments[env_id])
+            detected += len(change_points)
+            self.stdout.write("%s@%s on %s: %d change points" % (
+                executables[exe_id], environments[env_id],
+                latest.revision.branch.name, len(change_points)))
+        self.stdout.write("%d change points detected" % detected)
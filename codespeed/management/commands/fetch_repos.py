@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from codespeed.repositories import fetch_project, get_due_projects
+
+
+class Command(BaseCommand):
+    help = ("Fetches the working copies of the git and mercurial projects "
+            "when REPOSITORY_FETCH_BACKGROUND is enabled. A project is "
+            "fetched when an upload requested it, and every "
+            "REPOSITORY_FETCH_INTERVAL seconds")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true', default=False,
+            help="Fetch the projects that are due and exit instead of polling")
+        parser.add_argument(
+            '--interval', type=float, default=5.0,
+            help="Seconds to wait between polls when no project is due")
+
+    def handle(self, *args, **options):
+        while True:
+            projects = get_due_projects()
+            for project in projects:
+                updated = fetch_project(project)
+                self.stdout.write("Fetched %s, updated %d revisions" % (
+                    project, updated))
+            if options['once']:
+                break
+            if not projects:
+                time.sleep(options['interval'])
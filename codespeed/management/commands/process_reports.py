@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from codespeed.tasks import DatabaseQueue
+
+
+class Command(BaseCommand):
+    help = ("Generates the reports queued by result uploads when "
+            "REPORT_QUEUE_BACKEND stores report jobs in the database")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true', default=False,
+            help="Process the queued jobs and exit instead of polling")
+        parser.add_argument(
+            '--interval', type=float, default=5.0,
+            help="Seconds to wait between polls of an empty queue")
+        parser.add_argument(
+            '--limit', type=int, default=None,
+            help="Maximum number of jobs to process per poll")
+
+    def handle(self, *args, **options):
+        queue = DatabaseQueue()
+        while True:
+            processed = queue.process(limit=options['limit'])
+            if processed:
+                self.stdout.write("Processed %d report jobs" % processed)
+            if options['once']:
+                break
+            if not processed:
+                time.sleep(options['interval'])
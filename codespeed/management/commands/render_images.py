@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+from multiprocessing import Pool
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from codespeed.images import (get_plot_data, get_plot_etag, is_image_cached,
+                              cache_image, render_image)
+from codespeed.models import Result
+from codespeed.views_data import get_benchmark_results
+
+
+class Command(BaseCommand):
+    help = ("Renders the makeimage plots of every series of the tracked "
+            "projects into the image cache. Plots that are already cached "
+            "are skipped, so it can be run after each upload")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--revs', type=int, default=10,
+            help="Number of revisions shown in each plot")
+        parser.add_argument(
+            '--width', type=int, default=None, help="Width of the plots")
+        parser.add_argument(
+            '--height', type=int, default=None, help="Height of the plots")
+        parser.add_argument(
+            '--processes', type=int, default=None,
+            help="Number of rendering processes (default: one per CPU)")
+
+    def handle(self, *args, **options):
+        series = Result.objects.filter(
+            branch__project__track=True
+        ).values_list(
+            'environment__name', 'branch__project__name', 'branch__name',
+            'executable__name', 'benchmark__name'
+        ).distinct()
+
+        # Data is loaded here, the rendering processes only get plain data
+        plots = {}
+        for env, proj, branch, exe, ben in series:
+            try:
+                result_data = get_benchmark_results({
+                    'env': env, 'proj': proj, 'branch': branch, 'exe': exe,
+                    'ben': ben, 'revs': options['revs']})
+            except ObjectDoesNotExist:
+                continue
+            plot_data = get_plot_data(
+                result_data, options['width'], options['height'])
+            etag = get_plot_etag(plot_data)
+            if not is_image_cached(etag):
+                plots[etag] = plot_data
+
+        etags = list(plots)
+        plots = [plots[etag] for etag in etags]
+        if options['processes'] == 1:
+            images = [render_image(plot_data) for plot_data in plots]
+        else:
+            # Forked processes must not share the database connections
+            connections.close_all()
+            pool = Pool(options['processes'])
+            try:
+                images = pool.map(render_image, plots)
+            finally:
+                pool.close()
+                pool.join()
+
+        for etag, image_data in zip(etags, images):
+            cache_image(etag, image_data)
+        self.stdout.write("Rendered %d images" % len(images))
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""Process-local cache of the dimension tables
+
+Projects, branches, executables, benchmarks and environments are read by
+nearly every request, but rarely change. get_metadata returns a snapshot of
+all of them, which is kept by the process until they change: saving or
+deleting one of them drops the snapshot of the process at once, and the
+version of the dimension tables (see versions.py), which saving results
+doesn't bump, is read by every get_metadata call to notice the changes made
+by other processes.
+
+Snapshots are shared by requests and threads, so their instances must be
+treated as read-only.
+
+Queryset updates, such as ``Benchmark.objects.update(...)``, send no signals
+and don't bump the version, so snapshots taken before them are kept by every
+process. Call bump_data_versions with metadata=True after them, or
+clear_metadata in the process that made them.
+"""
+from __future__ import absolute_import
+
+import threading
+
+from django.db.models.signals import post_save, post_delete
+
+from .models import Project, Branch, Executable, Benchmark, Environment
+from .versions import METADATA_MODELS, get_metadata_version
+
+_metadata = None
+_lock = threading.Lock()
+
+
+class Metadata(object):
+    """The dimension tables, ordered by id unless stated otherwise"""
+
+    def __init__(self):
+        self.projects = list(Project.objects.order_by('id'))
+        projects = dict((proj.id, proj) for proj in self.projects)
+
+        self.branches = list(Branch.objects.order_by('id'))
+        self.executables = list(Executable.objects.order_by('id'))
+        for instance in self.branches + self.executables:
+            # Shared, instead of fetched by each instance
+            instance.project = projects[instance.project_id]
+        self.executables_by_id = dict(
+            (exe.id, exe) for exe in self.executables)
+
+        self.benchmarks = list(Benchmark.objects.order_by('id'))
+        self.benchmarks_by_name = dict(
+            (bench.name, bench) for bench in self.benchmarks)
+
+        self.environments = list(Environment.objects.order_by('id'))
+        self.environments_by_id = dict(
+            (env.id, env) for env in self.environments)
+        self.environments_by_name = dict(
+            (env.name, env) for env in self.environments)
+
+    def tracked_projects(self):
+        return [proj for proj in self.projects if proj.track]
+
+    def default_branches(self):
+        """The default branch of every tracked project"""
+        return [branch for branch in self.branches
+                if branch.project.track and
+                branch.name == branch.project.default_branch]
+
+    def project_branches(self, project):
+        return [branch for branch in self.branches
+                if branch.project_id == project.id]
+
+    def project_executables(self, project):
+        return [exe for exe in self.executables
+                if exe.project_id == project.id]
+
+    def tracked_executables(self):
+        return [exe for exe in self.executables if exe.project.track]
+
+
+def get_metadata():
+    """Returns the current snapshot of the dimension tables"""
+    global _metadata
+    version = get_metadata_version()
+    current = _metadata
+    if current is not None and current[0] == version:
+        return current[1]
+    with _lock:
+        if _metadata is not None and _metadata[0] == version:
+            return _metadata[1]
+        metadata = Metadata()
+        _metadata = (version, metadata)
+    return metadata
+
+
+def clear_metadata(**kwargs):
+    """Drops the snapshot of this process"""
+    global _metadata
+    _metadata = None
+
+
+# Also on raw saves, which don't bump the data version, e.g. fixtures
+for model in METADATA_MODELS:
+    post_save.connect(clear_metadata, sender=model,
+                      dispatch_uid='metadata_%s_saved' % model.__name__)
+    post_delete.connect(clear_metadata, sender=model,
+                        dispatch_uid='metadata_%s_deleted' % model.__name__)
@@ -0,0 +1,33 @@
+# Generated by Django 2.1.15 on 2026-10-18 12:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('codespeed', '0004_branch_display_on_comparison_page'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('claimed', models.DateTimeField(blank=True, null=True)),
+                ('claim', models.CharField(blank=True, max_length=32)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('requeued', models.BooleanField(default=False)),
+                ('environment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='report_jobs', to='codespeed.Environment')),
+                ('executable', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='report_jobs', to='codespeed.Executable')),
+                ('revision', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='report_jobs', to='codespeed.Revision')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='reportjob',
+            unique_together={('revision', 'executable', 'environment')},
+        ),
+    ]
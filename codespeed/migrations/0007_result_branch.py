@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_revision_branch(apps, schema_editor):
+    Result = apps.get_model('codespeed', 'Result')
+    Revision = apps.get_model('codespeed', 'Revision')
+    Result.objects.update(branch=models.Subquery(
+        Revision.objects.filter(
+            pk=models.OuterRef('revision')).values('branch')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('codespeed', '0006_timelineseries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='result',
+            name='branch',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='results', to='codespeed.Branch'),
+        ),
+        migrations.RunPython(copy_revision_branch, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='result',
+            name='branch',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='results', to='codespeed.Branch'),
+        ),
+        migrations.AddIndex(
+            model_name='result',
+            index=models.Index(fields=['benchmark', 'environment', 'executable', 'branch', 'date'], name='result_series_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='revision',
+            index=models.Index(fields=['branch', 'date'], name='revision_branch_date_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.1.15 on 2026-10-18 12:56
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('codespeed', '0007_result_branch'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='report',
+            name='_tablecache',
+        ),
+    ]
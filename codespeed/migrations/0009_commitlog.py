@@ -0,0 +1,48 @@
+# Generated by Django 2.1.15 on 2026-10-18 13:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('codespeed', '0008_remove_report_tablecache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CommitLog',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('commitid', models.CharField(max_length=42)),
+                ('short_commit_id', models.CharField(blank=True, max_length=42)),
+                ('date', models.CharField(blank=True, max_length=32)),
+                ('author', models.CharField(blank=True, max_length=100)),
+                ('author_email', models.CharField(blank=True, max_length=100)),
+                ('message', models.TextField(blank=True)),
+                ('body', models.TextField(blank=True)),
+                ('tag', models.TextField(blank=True)),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='commit_logs', to='codespeed.Project')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CommitLogRange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('startcommitid', models.CharField(max_length=42)),
+                ('endcommitid', models.CharField(max_length=42)),
+                ('_commitids', models.TextField(default='[]')),
+                ('complete', models.BooleanField(default=True)),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='commit_log_ranges', to='codespeed.Project')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='commitlogrange',
+            unique_together={('project', 'startcommitid', 'endcommitid')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='commitlog',
+            unique_together={('project', 'commitid')},
+        ),
+    ]
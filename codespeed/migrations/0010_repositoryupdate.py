@@ -0,0 +1,24 @@
+# Generated by Django 2.1.15 on 2026-10-18 13:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('codespeed', '0009_commitlog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RepositoryUpdate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('requested', models.DateTimeField(blank=True, null=True)),
+                ('fetched', models.DateTimeField(blank=True, null=True)),
+                ('_commitids', models.TextField(default='[]')),
+                ('project', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='repository_update', to='codespeed.Project')),
+            ],
+        ),
+    ]
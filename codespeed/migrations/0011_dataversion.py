@@ -0,0 +1,24 @@
+# Generated by Django 2.1.15 on 2026-10-18 13:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('codespeed', '0010_repositoryupdate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('metadata_version', models.PositiveIntegerField(default=0)),
+                ('modified', models.DateTimeField()),
+                ('project', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='data_version', to='codespeed.Project')),
+            ],
+        ),
+    ]
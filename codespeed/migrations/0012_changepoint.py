@@ -0,0 +1,33 @@
+# Generated by Django 2.1.15 on 2026-10-18 13:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('codespeed', '0011_dataversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangePoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('before', models.FloatField()),
+                ('after', models.FloatField()),
+                ('change', models.FloatField()),
+                ('detected', models.DateTimeField(auto_now=True)),
+                ('benchmark', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='change_points', to='codespeed.Benchmark')),
+                ('branch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='change_points', to='codespeed.Branch')),
+                ('environment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='change_points', to='codespeed.Environment')),
+                ('executable', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='change_points', to='codespeed.Executable')),
+                ('revision', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='change_points', to='codespeed.Revision')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='changepoint',
+            unique_together={('revision', 'benchmark', 'executable', 'environment')},
+        ),
+    ]
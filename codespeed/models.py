@@ -4,17 +4,26 @@ from __future__ import absolute_import, unicode_literals
 import logging
 import os
 import json
+from collections import OrderedDict
 
 from django.core.exceptions import ValidationError
 from django.urls import reverse
 from django.conf import settings
+from django.core.cache import caches
 from django.db import models
-from django.utils.encoding import python_2_unicode_compatible
+from django.utils.encoding import force_text, python_2_unicode_compatible
 
 from .commits.github import GITHUB_URL_RE
 
 logger = logging.getLogger(__name__)
 
+# Trend depths that can be selected in the changes view
+CHANGES_TRENDS = [5, 10, 20, 50, 100]
+
+# Part of the key of cached changes tables. Increase it when the format of
+# the tables changes, so that tables cached by older versions are ignored
+CHANGES_TABLE_VERSION = 1
+
 
 @python_2_unicode_compatible
 class Project(models.Model):
@@ -151,6 +160,10 @@ class Revision(models.Model):
 
     class Meta:
         unique_together = ("commitid", "branch")
+        indexes = [
+            models.Index(fields=["branch", "date"],
+                         name="revision_branch_date_idx"),
+        ]
 
     def clean(self):
         if not self.commitid or self.commitid == "None":
@@ -162,6 +175,119 @@ class Revision(models.Model):
                 raise ValidationError("Invalid SVN commit id %s" % self.commitid)
 
 
+@python_2_unicode_compatible
+class CommitLog(models.Model):
+    """Log of a commit, as read from the repository of its project
+
+    Stored by codespeed.commits.get_logs, so that logs can be displayed
+    without querying the repository again. The tags are the ones the commit
+    had when its log was read
+    """
+    project = models.ForeignKey(
+        Project, on_delete=models.CASCADE, related_name="commit_logs")
+    commitid = models.CharField(max_length=42)
+    short_commit_id = models.CharField(max_length=42, blank=True)
+    date = models.CharField(max_length=32, blank=True)
+    author = models.CharField(max_length=100, blank=True)
+    author_email = models.CharField(max_length=100, blank=True)
+    message = models.TextField(blank=True)
+    body = models.TextField(blank=True)
+    tag = models.TextField(blank=True)
+
+    LOG_FIELDS = ('commitid', 'short_commit_id', 'date', 'author',
+                  'author_email', 'message', 'body', 'tag')
+
+    def __str__(self):
+        return u"Log of %s" % self.commitid
+
+    class Meta:
+        unique_together = ("project", "commitid")
+
+    @classmethod
+    def from_log(cls, project, log):
+        commit_log = cls(project=project)
+        for field in cls.LOG_FIELDS:
+            value = log.get(field)
+            if value is not None:
+                max_length = cls._meta.get_field(field).max_length
+                setattr(commit_log, field, force_text(value)[:max_length])
+        return commit_log
+
+    def as_log(self):
+        return dict((field, getattr(self, field)) for field in self.LOG_FIELDS)
+
+
+@python_2_unicode_compatible
+class CommitLogRange(models.Model):
+    """Commits whose logs are shown for a revision, newest first
+
+    Ranges read page by page are stored as their pages are read. Until the
+    last page is read, only the newest commits of the range are listed
+    """
+    project = models.ForeignKey(
+        Project, on_delete=models.CASCADE, related_name="commit_log_ranges")
+    startcommitid = models.CharField(max_length=42)
+    endcommitid = models.CharField(max_length=42)
+    _commitids = models.TextField(default='[]')
+    complete = models.BooleanField(default=True)
+
+    def __str__(self):
+        return u"Commits from %s to %s" % (self.startcommitid, self.endcommitid)
+
+    class Meta:
+        unique_together = ("project", "startcommitid", "endcommitid")
+
+    def get_commitids(self):
+        return json.loads(self._commitids)
+
+    def set_commitids(self, commitids):
+        self._commitids = json.dumps(commitids)
+
+
+@python_2_unicode_compatible
+class RepositoryUpdate(models.Model):
+    """Update of the working copy of a project, done by the fetch_repos
+    command
+
+    Requests made before the fetch starts are coalesced into one fetch.
+    """
+    project = models.OneToOneField(
+        Project, on_delete=models.CASCADE, related_name="repository_update")
+    requested = models.DateTimeField(null=True, blank=True)
+    fetched = models.DateTimeField(null=True, blank=True)
+    # Commits whose metadata will be read once the working copy is fetched
+    _commitids = models.TextField(default='[]')
+
+    def __str__(self):
+        return u"Repository update of %s" % self.project
+
+    def get_commitids(self):
+        return json.loads(self._commitids)
+
+    def set_commitids(self, commitids):
+        self._commitids = json.dumps(commitids)
+
+
+@python_2_unicode_compatible
+class DataVersion(models.Model):
+    """Version of the benchmark data of a project, or of all the data when
+    project is null
+
+    Bumped whenever results or their metadata change, see versions.py
+    """
+    project = models.OneToOneField(
+        Project, on_delete=models.CASCADE, related_name="data_version",
+        null=True, blank=True)
+    version = models.PositiveIntegerField(default=0)
+    # Only bumped when the dimension tables change, see metadata.py
+    metadata_version = models.PositiveIntegerField(default=0)
+    modified = models.DateTimeField()
+
+    def __str__(self):
+        return u"Data version %d of %s" % (
+            self.version, self.project or "all projects")
+
+
 @python_2_unicode_compatible
 class Executable(models.Model):
     name = models.CharField(max_length=30)
@@ -240,12 +366,129 @@ class Result(models.Model):
         Benchmark, on_delete=models.CASCADE, related_name="results")
     environment = models.ForeignKey(
         Environment, on_delete=models.CASCADE, related_name="results")
+    # Copy of revision.branch, so that series can be read without a join
+    branch = models.ForeignKey(
+        Branch, on_delete=models.CASCADE, related_name="results",
+        editable=False)
 
     def __str__(self):
         return u"%s: %s" % (self.benchmark.name, self.value)
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        # Copied on every save that may change the revision
+        if update_fields is None or 'revision' in update_fields:
+            self.branch_id = self.revision.branch_id
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | set(['branch'])
+        super(Result, self).save(*args, **kwargs)
+
     class Meta:
         unique_together = ("revision", "executable", "benchmark", "environment")
+        indexes = [
+            models.Index(
+                fields=["benchmark", "environment", "executable", "branch",
+                        "date"],
+                name="result_series_idx"),
+        ]
+
+
+@python_2_unicode_compatible
+class TimelineSeries(models.Model):
+    """The newest points of a timeline series, serialized for the plots
+
+    Maintained by codespeed.timelines
+    """
+    benchmark = models.ForeignKey(
+        Benchmark, on_delete=models.CASCADE, related_name="timeline_series")
+    environment = models.ForeignKey(
+        Environment, on_delete=models.CASCADE, related_name="timeline_series")
+    executable = models.ForeignKey(
+        Executable, on_delete=models.CASCADE, related_name="timeline_series")
+    branch = models.ForeignKey(
+        Branch, on_delete=models.CASCADE, related_name="timeline_series")
+    _entries = models.TextField(default='[]')
+
+    def __str__(self):
+        return u"Timeline of %s for %s on %s" % (
+            self.benchmark_id, self.executable_id, self.environment_id)
+
+    class Meta:
+        unique_together = ("benchmark", "environment", "executable", "branch")
+        verbose_name_plural = "timeline series"
+
+    def get_entries(self):
+        return json.loads(self._entries)
+
+    def set_entries(self, entries):
+        self._entries = json.dumps(entries)
+
+
+@python_2_unicode_compatible
+class ChangePoint(models.Model):
+    """A lasting change of the results of a series, starting at revision
+
+    Detected by codespeed.changepoints
+    """
+    revision = models.ForeignKey(
+        Revision, on_delete=models.CASCADE, related_name="change_points")
+    benchmark = models.ForeignKey(
+        Benchmark, on_delete=models.CASCADE, related_name="change_points")
+    environment = models.ForeignKey(
+        Environment, on_delete=models.CASCADE, related_name="change_points")
+    executable = models.ForeignKey(
+        Executable, on_delete=models.CASCADE, related_name="change_points")
+    branch = models.ForeignKey(
+        Branch, on_delete=models.CASCADE, related_name="change_points")
+    before = models.FloatField()
+    after = models.FloatField()
+    # Relative change of the mean, in percent
+    change = models.FloatField()
+    detected = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return u"Change of %s at %s" % (self.benchmark, self.revision)
+
+    class Meta:
+        unique_together = ("revision", "benchmark", "executable",
+                           "environment")
+
+    def is_regression(self):
+        if self.benchmark.lessisbetter:
+            return self.change > 0
+        return self.change < 0
+
+    def get_absolute_url(self):
+        return reverse("changes") + "?rev=%s&exe=%s&env=%s" % (
+            self.revision.commitid, self.executable.id, self.environment.name)
+
+
+@python_2_unicode_compatible
+class ReportJob(models.Model):
+    """A report waiting to be (re)generated by a background worker
+
+    Jobs are kept until their report is generated. A job is claimed by the
+    worker processing it, and the error of its last failed attempt is kept.
+    requeued is set when the job is queued again while it is claimed
+    """
+    revision = models.ForeignKey(
+        Revision, on_delete=models.CASCADE, related_name="report_jobs")
+    environment = models.ForeignKey(
+        Environment, on_delete=models.CASCADE, related_name="report_jobs")
+    executable = models.ForeignKey(
+        Executable, on_delete=models.CASCADE, related_name="report_jobs")
+    created = models.DateTimeField(auto_now_add=True)
+    claimed = models.DateTimeField(null=True, blank=True)
+    claim = models.CharField(max_length=32, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    requeued = models.BooleanField(default=False)
+
+    def __str__(self):
+        return u"Report job for %s" % self.revision
+
+    class Meta:
+        unique_together = ("revision", "executable", "environment")
 
 
 @python_2_unicode_compatible
@@ -258,7 +501,6 @@ class Report(models.Model):
         Executable, on_delete=models.CASCADE, related_name="reports")
     summary = models.CharField(max_length=64, blank=True)
     colorcode = models.CharField(max_length=10, default="none")
-    _tablecache = models.TextField(blank=True)
 
     def __str__(self):
         return u"Report for %s" % self.revision
@@ -267,12 +509,38 @@ class Report(models.Model):
         unique_together = ("revision", "executable", "environment")
 
     def save(self, *args, **kwargs):
-        tablelist = self.get_changes_table(force_save=True)
+        changepoints = getattr(settings, 'CHANGEPOINT_DETECTION', False)
+        if not changepoints:
+            trend = self.get_default_trend()
+            tablelist = self.get_changes_tables([trend], cache=False)[trend]
         self.reinitialize()
-        changes = self.aggregate_significant_changes(tablelist)
-        self.update_to_highest_priority_change(changes)
+        if changepoints:
+            self.update_to_change_points()
+        else:
+            changes = self.aggregate_significant_changes(tablelist)
+            self.update_to_highest_priority_change(changes)
 
         super(Report, self).save(*args, **kwargs)
+        # Saving the report bumps the data version, so the tables are built
+        # again, and cached under the version read before building them.
+        # Those built above could be older than the data of that version
+        self.get_changes_tables(self._get_cached_trends())
+
+    def update_to_change_points(self):
+        """Flags the largest change point confirmed by this revision"""
+        from .changepoints import update_change_points
+
+        change = HistoricalValue()
+        for change_point in update_change_points(
+                self.revision, self.executable, self.environment):
+            if change_point.confirmed_by.id != self.revision_id:
+                continue
+            color = "red" if change_point.is_regression() else "green"
+            change.update_if_less_important_than(
+                change_point.change, color, change_point.benchmark.name)
+        if change.color != "none":
+            self.update_summary("{} {}", change)
+            self.colorcode = change.color
 
     def update_to_highest_priority_change(self, changes):
         average_change = changes['average_change']
@@ -404,45 +672,89 @@ class Report(models.Model):
                            exc_info=True)
         return lastrevisions
 
-    def get_changes_table(self, trend_depth=10, force_save=False):
-        # Determine whether required trend value is the default one
-        default_trend = 10
+    @staticmethod
+    def get_default_trend():
         if hasattr(settings, 'TREND') and settings.TREND:
-            default_trend = settings.TREND
-        # If the trend is the default and a forced save is not required
-        # just return the cached changes table
-        if not force_save and trend_depth == default_trend:
-            return self._get_tablecache()
-        # Otherwise generate a new changes table
+            return settings.TREND
+        return 10
+
+    def get_changes_table(self, trend_depth=10, force_save=False):
+        # Unless a forced save is required, return the cached changes table
+        if not force_save:
+            tablelist = self._get_tablecache(trend_depth)
+            if tablelist is not None:
+                return tablelist
+        # Otherwise generate a new changes table. The tables of all cached
+        # depths cost about the same as one, so they are built together
+        trend_depths = set([trend_depth])
+        if trend_depth in self._get_cached_trends():
+            trend_depths.update(self._get_cached_trends())
+        return self.get_changes_tables(trend_depths)[trend_depth]
+
+    def get_changes_tables(self, trend_depths, cache=True):
+        """Builds the changes tables of several trend depths at once
+
+        Revisions and results are loaded once for all depths, so that each
+        additional depth only costs its trend window per benchmark.
+        Returns a dict of tables keyed by trend depth
+        """
+        trend_depths = sorted(set(trend_depths))
+        # Read before the results, so that the tables are at least as recent
+        # as the version they are cached under
+        data_version = self._get_data_version() if cache else None
         # Get latest revisions for this branch (which also sets the project)
-        lastrevisions = self.get_last_revisions(trend_depth)
+        lastrevisions = list(self.get_last_revisions(trend_depths[-1]))
         if not lastrevisions:
-            return []
+            return dict((depth, []) for depth in trend_depths)
 
-        change_list = []
-        pastrevisions = []
+        changerevision = None
+        pastrevisions = dict((depth, []) for depth in trend_depths)
         if len(lastrevisions) > 1:
             changerevision = lastrevisions[1]
-            change_list = Result.objects.filter(
-                revision=changerevision
-            ).filter(
-                environment=self.environment
-            ).filter(
-                executable=self.executable
-            )
-            pastrevisions = lastrevisions[trend_depth - 2:trend_depth + 1]
-
-        result_list = Result.objects.filter(
-            revision=lastrevisions[0]
-        ).filter(
-            environment=self.environment
-        ).filter(
-            executable=self.executable
-        )
-
+            for depth in trend_depths:
+                pastrevisions[depth] = \
+                    lastrevisions[:depth + 1][depth - 2:depth + 1]
+
+        # Load every needed result in a single query and index the values
+        # by revision and benchmark, so that the tables can be built in memory
+        revision_ids = set([lastrevisions[0].id])
+        if changerevision is not None:
+            revision_ids.add(changerevision.id)
+        for revisions in pastrevisions.values():
+            revision_ids.update(rev.id for rev in revisions)
+        results = {}
+        for res in Result.objects.filter(
+                revision__in=revision_ids,
+                environment=self.environment,
+                executable=self.executable):
+            results.setdefault(res.revision_id, {})[res.benchmark_id] = res
+
+        current_results = results.get(lastrevisions[0].id, {})
+        change_results = {}
+        if changerevision is not None:
+            change_results = results.get(changerevision.id, {})
+
+        # Group benchmarks by quantity, keeping the order in which each
+        # quantity first appears
+        benchmarks_by_units = OrderedDict()
+        for bench in Benchmark.objects.order_by('id'):
+            benchmarks_by_units.setdefault(bench.units_title, []).append(bench)
+
+        tables = {}
+        for depth in trend_depths:
+            past_results = [results.get(rev.id, {})
+                            for rev in pastrevisions[depth]]
+            tables[depth] = self._make_changes_table(
+                benchmarks_by_units, current_results, change_results,
+                past_results)
+            if cache:
+                self._save_tablecache(depth, tables[depth], data_version)
+        return tables
+
+    def _make_changes_table(self, benchmarks_by_units, current_results,
+                            change_results, past_results):
         tablelist = []
-        for units_title in Benchmark.objects.all().values_list(
-                'units_title', flat=True).distinct():
+        for units_title, benchmarks in benchmarks_by_units.items():
             currentlist = []
             units = ""
             hasmin = False
@@ -450,15 +762,13 @@ class Report(models.Model):
             has_stddev = False
             smallest = 1000
             totals = {'change': [], 'trend': []}
-            for bench in Benchmark.objects.filter(units_title=units_title):
+            for bench in benchmarks:
                 units = bench.units
                 lessisbetter = bench.lessisbetter
-                resultquery = result_list.filter(benchmark=bench)
-                if not len(resultquery):
+                resobj = current_results.get(bench.id)
+                if resobj is None:
                     continue
 
-                resobj = resultquery.filter(benchmark=bench)[0]
-
                 std_dev = resobj.std_dev
                 if std_dev is not None:
                     has_stddev = True
@@ -480,42 +790,31 @@ class Report(models.Model):
                 # Calculate percentage change relative to previous result
                 result = max(resobj.value, 0)
                 change = "-"
-                if len(change_list):
-                    c = change_list.filter(benchmark=bench)
-                    if c.count() and result is not None:
-                        if c[0].value != 0:
-                            change = (result - c[0].value) * 100 / c[0].value
-                            totals['change'].append(result / c[0].value)
-                        elif c[0].value == 0:
-                            if result == 0:
-                                # 0/0 = 1, in our world
-                                change = 0
-                                totals['change'].append(1)
-                            else:
-                                # n/0 = ∞
-                                change = float("inf")
-                                totals['change'].append(float("inf"))
+                c = change_results.get(bench.id)
+                if c is not None and result is not None:
+                    if c.value != 0:
+                        change = (result - c.value) * 100 / c.value
+                        totals['change'].append(result / c.value)
+                    else:
+                        if result == 0:
+                            # 0/0 = 1, in our world
+                            change = 0
+                            totals['change'].append(1)
                         else:
-                            # no previous result, no change available
-                            pass
+                            # n/0 = ∞
+                            change = float("inf")
+                            totals['change'].append(float("inf"))
 
                 # Calculate trend:
                 # percentage change relative to average of 3 previous results
                 # Calculate past average
                 result_sum = 0
                 num_past_results = 0
-                if len(pastrevisions):
-                    for rev in pastrevisions:
-                        past_result = Result.objects.filter(
-                            revision=rev
-                        ).filter(
-                            environment=self.environment
-                        ).filter(
-                            executable=self.executable
-                        ).filter(benchmark=bench)
-                        if past_result.count():
-                            result_sum += past_result[0].value
-                            num_past_results += 1
+                for revision_results in past_results:
+                    past_result = revision_results.get(bench.id)
+                    if past_result is not None:
+                        result_sum += past_result.value
+                        num_past_results += 1
                 trend = "-"
                 if result_sum:
                     average = result_sum / num_past_results
@@ -569,8 +868,6 @@ class Report(models.Model):
                 'totals': totals,
                 'rows': currentlist
             })
-        if force_save:
-            self._save_tablecache(tablelist)
         return tablelist
 
     def get_absolute_url(self):
@@ -583,10 +880,35 @@ class Report(models.Model):
         else:
             return self.summary
 
-    def _save_tablecache(self, data):
-        self._tablecache = json.dumps(data)
-
-    def _get_tablecache(self):
-        if self._tablecache == '':
-            return {}
-        return json.loads(self._tablecache)
+    def _get_cached_trends(self):
+        return set(CHANGES_TRENDS) | set([self.get_default_trend()])
+
+    def _get_data_version(self):
+        from .versions import get_data_version
+        return get_data_version([self.executable.project_id])[0]
+
+    def _tablecache_key(self, trend_depth, data_version):
+        # The data version of the project changes with its results, so the
+        # tables cached by every process before a change are never read
+        return 'codespeed.changestable.v%d.%s.%s.%s.%d.%s' % (
+            CHANGES_TABLE_VERSION, self.revision_id, self.executable_id,
+            self.environment_id, trend_depth, data_version)
+
+    def _save_tablecache(self, trend_depth, data, data_version):
+        # Only the selectable depths are cached, as they are the only ones
+        # precomputed when the report is saved
+        if trend_depth in self._get_cached_trends():
+            get_changes_table_cache().set(
+                self._tablecache_key(trend_depth, data_version), data,
+                getattr(settings, 'CHANGES_TABLE_CACHE_TIMEOUT', 604800))
+
+    def _get_tablecache(self, trend_depth):
+        if trend_depth not in self._get_cached_trends():
+            return None
+        return get_changes_table_cache().get(
+            self._tablecache_key(trend_depth, self._get_data_version()))
+
+
+def get_changes_table_cache():
+    """Returns the cache holding the changes tables of the reports"""
+    return caches[getattr(settings, 'CHANGES_TABLE_CACHE', 'default')]
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""Background fetching of the working copies of projects
+
+By default, the working copy of a project is pulled inside the request that
+uploads its results, so a slow remote stalls the upload. With the
+``REPOSITORY_FETCH_BACKGROUND`` setting, uploads only request an update, and
+the ``fetch_repos`` management command fetches the working copies. Commits
+that were not fetched yet when their results were uploaded get their
+metadata after the next fetch.
+
+Revisions left without metadata, e.g. because the VCS was unreachable when
+they were created, can be fixed with the ``backfill_revisions`` command.
+"""
+from __future__ import absolute_import
+
+import logging
+import os
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import models, transaction
+from django.utils import timezone
+
+from . import commits
+from .commits.exceptions import CommitLogError
+from .models import (Project, RepositoryUpdate, Revision, Result,
+                     TimelineSeries)
+from .versions import bump_data_versions
+
+logger = logging.getLogger(__name__)
+
+REVISION_LOG_FIELDS = ['author', 'date', 'message', 'tag']
+
+
+def fetches_in_background(project):
+    """Whether the working copy of project is fetched by fetch_repos"""
+    return (getattr(settings, 'REPOSITORY_FETCH_BACKGROUND', False) and
+            project.repo_type in (Project.GIT, Project.MERCURIAL))
+
+
+def is_fetched(project):
+    return os.path.exists(project.working_copy)
+
+
+def request_update(project, commitid=None):
+    """Requests a fetch of the working copy of project
+
+    commitid, when given, is a commit whose metadata should be read once
+    the working copy is fetched.
+    """
+    with transaction.atomic():
+        update, _ = RepositoryUpdate.objects.select_for_update(
+        ).get_or_create(project=project)
+        update.requested = timezone.now()
+        commitids = update.get_commitids()
+        if commitid and commitid not in commitids:
+            update.set_commitids(commitids + [commitid])
+        update.save()
+
+
+def update_revision(rev, log):
+    """Sets the metadata of rev from its commit log"""
+    old_date = rev.date
+    rev.author = log['author']
+    rev.date = log['date']
+    rev.message = log['message']
+    rev.tag = log['tag']
+    rev.full_clean()
+    rev.save()
+    # Results without a date of their own got the date of the revision
+    Result.objects.filter(revision=rev, date=old_date).update(date=rev.date)
+
+
+def fetch_project(project):
+    """Fetches the working copy of project, then reads the metadata of the
+    commits waiting for it
+
+    Returns the number of updated revisions
+    """
+    with transaction.atomic():
+        update, _ = RepositoryUpdate.objects.select_for_update(
+        ).get_or_create(project=project)
+        commitids = update.get_commitids()
+        # Requests made from now on will trigger another fetch
+        update.requested = None
+        update.set_commitids([])
+        update.fetched = timezone.now()
+        update.save()
+
+    try:
+        commits.update_repository(project)
+    except CommitLogError as e:
+        logger.error("Unable to fetch %s: %s", project, e, exc_info=True)
+        if commitids:
+            # Retried with the next fetch
+            with transaction.atomic():
+                update = RepositoryUpdate.objects.select_for_update().get(
+                    pk=update.pk)
+                update.set_commitids(
+                    commitids + [commitid for commitid in update.get_commitids()
+                                 if commitid not in commitids])
+                update.save()
+        return 0
+
+    updated = 0
+    for rev in Revision.objects.filter(
+            branch__project=project, commitid__in=commitids
+    ).select_related('branch__project'):
+        try:
+            logs = commits.get_logs(rev, rev)
+        except CommitLogError as e:
+            logger.warning("unable to save revision %s info: %s", rev, e,
+                           exc_info=True)
+            continue
+        if logs:
+            update_revision(rev, logs[0])
+            updated += 1
+    return updated
+
+
+def get_due_projects(now=None):
+    """Returns the projects whose working copy should be fetched: those with
+    a pending request, and those not fetched for REPOSITORY_FETCH_INTERVAL
+    seconds"""
+    now = timezone.now() if now is None else now
+    interval = timedelta(
+        seconds=getattr(settings, 'REPOSITORY_FETCH_INTERVAL', 300))
+    due = []
+    for project in Project.objects.filter(
+            repo_type__in=(Project.GIT, Project.MERCURIAL)
+    ).select_related('repository_update').order_by('id'):
+        try:
+            update = project.repository_update
+        except RepositoryUpdate.DoesNotExist:
+            update = None
+        if (update is None or update.requested is not None or
+                update.fetched is None or update.fetched + interval <= now):
+            due.append(project)
+    return due
+
+
+def _update_revisions(project, logs_by_id):
+    """Sets the metadata of the revisions of project with the given ids
+    from their commit logs, in one transaction"""
+    from .results import bulk_update
+
+    revisions = list(Revision.objects.in_bulk(list(logs_by_id)).values())
+    date_changes = []
+    for rev in revisions:
+        log = logs_by_id[rev.id]
+        date = datetime.strptime(log['date'], "%Y-%m-%d %H:%M:%S")
+        if rev.date != date:
+            date_changes.append(models.When(
+                revision_id=rev.id, date=rev.date, then=models.Value(date)))
+        rev.author = log['author']
+        rev.date = date
+        rev.message = log['message']
+        rev.tag = log['tag']
+
+    with transaction.atomic():
+        bulk_update(revisions, REVISION_LOG_FIELDS)
+        if date_changes:
+            # Results without a date of their own got the date of the
+            # revision
+            Result.objects.filter(
+                revision__in=[rev.id for rev in revisions]
+            ).update(date=models.Case(
+                *date_changes, default=models.F('date'),
+                output_field=models.DateTimeField()))
+        # Saved in bulk without signals, so the stored series are deleted,
+        # and the versions bumped, here
+        TimelineSeries.objects.filter(
+            branch__in=set(rev.branch_id for rev in revisions)).delete()
+        bump_data_versions([project.id])
+    return len(revisions)
+
+
+def backfill_revisions(project, batch_size=500, progress=None):
+    """Sets the metadata of the revisions of project that have none
+
+    The history of the working copy is read in a single pass, and the
+    revisions are updated in batches of batch_size, each in its own
+    transaction. An interrupted backfill thus resumes where it stopped when
+    it's run again. Commit ids can be abbreviated.
+
+    progress, when given, is called after each batch with the number of
+    updated revisions and of read commits.
+
+    Returns the number of updated revisions and of revisions whose commit
+    was not found.
+    """
+    pending = {}
+    for rev_id, commitid in Revision.objects.filter(
+            branch__project=project, author='').values_list('id', 'commitid'):
+        pending.setdefault(commitid, []).append(rev_id)
+    if not pending:
+        return 0, 0
+    lengths = sorted(set(len(commitid) for commitid in pending))
+
+    updated = read = 0
+    batch = {}
+    logs = commits.iter_logs(project)
+    try:
+        for log in logs:
+            read += 1
+            if log['commitid'] == '-':
+                continue
+            for length in lengths:
+                for rev_id in pending.pop(log['commitid'][:length], []):
+                    batch[rev_id] = log
+            if len(batch) >= batch_size:
+                updated += _update_revisions(project, batch)
+                batch = {}
+                if progress is not None:
+                    progress(updated, read)
+            if not pending:
+                break
+    finally:
+        logs.close()
+    if batch:
+        updated += _update_revisions(project, batch)
+        if progress is not None:
+            progress(updated, read)
+    return updated, sum(len(rev_ids) for rev_ids in pending.values())
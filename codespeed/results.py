@@ -2,16 +2,35 @@
 from __future__ import absolute_import
 
 import logging
+from collections import OrderedDict
 from datetime import datetime
 
 from django.core.exceptions import ValidationError
+from django.db import transaction
 
-from .models import (Environment, Project, Branch, Benchmark, Executable,
+from .models import (Project, Branch, Benchmark, Executable,
                      Revision, Result, Report)
-from . import commits
+from .metadata import get_metadata
+from .timelines import discard_timeline_series, update_timeline_series
+from .versions import bump_data_versions
+from . import commits, repositories
 
 logger = logging.getLogger(__name__)
 
+MANDATORY_DATA = [
+    'commitid',
+    'branch',
+    'project',
+    'executable',
+    'benchmark',
+    'environment',
+    'result_value',
+]
+
+RESULT_VALUE_FIELDS = [
+    'value', 'date', 'std_dev', 'val_min', 'val_max', 'q1', 'q3',
+]
+
 
 def validate_result(item):
     """
@@ -21,97 +40,315 @@ def validate_result(item):
         Environment, False  when no errors where found
         Errormessage, True  when there is an error
     """
-    mandatory_data = [
-        'commitid',
-        'branch',
-        'project',
-        'executable',
-        'benchmark',
-        'environment',
-        'result_value',
-    ]
-
-    error = True
-    for key in mandatory_data:
+    error = _check_mandatory_data(item)
+    if error:
+        return error, True
+
+    # Check that the Environment exists
+    e = get_metadata().environments_by_name.get(item['environment'])
+    if e is None:
+        return "Environment %(environment)s not found" % item, True
+    return e, False
+
+
+def _check_mandatory_data(item):
+    """Returns an error message when a mandatory key is missing or empty"""
+    for key in MANDATORY_DATA:
         if key not in item:
-            return 'Key "' + key + '" missing from request', error
+            return 'Key "' + key + '" missing from request'
         elif key in item and item[key] == "":
-            return 'Value for key "' + key + '" empty in request', error
+            return 'Value for key "' + key + '" empty in request'
+    return None
 
-    # Check that the Environment exists
-    try:
-        e = Environment.objects.get(name=item['environment'])
-        error = False
-        return e, error
-    except Environment.DoesNotExist:
-        return "Environment %(environment)s not found" % item, error
 
+def bulk_update(objects, fields):
+    """Updates the given fields of already saved model instances
 
-def save_result(data, update_repo=True):
-    res, error = validate_result(data)
-    if error:
-        return res, True
+    Uses a single bulk query when the Django version supports it.
+    """
+    if not objects:
+        return
+    manager = type(objects[0])._default_manager
+    if hasattr(manager, 'bulk_update'):
+        manager.bulk_update(objects, fields)
     else:
-        assert(isinstance(res, Environment))
-        env = res
-
-    p, created = Project.objects.get_or_create(name=data["project"])
-    branch, created = Branch.objects.get_or_create(name=data["branch"],
-                                                   project=p)
-    b, created = Benchmark.objects.get_or_create(name=data["benchmark"])
-
-    if created:
-        if "description" in data:
-            b.description = data["description"]
-        if "units" in data:
-            b.units = data["units"]
-        if "units_title" in data:
-            b.units_title = data["units_title"]
-        if "lessisbetter" in data:
-            b.lessisbetter = data["lessisbetter"]
-        b.full_clean()
-        b.save()
+        for obj in objects:
+            obj.save(update_fields=fields)
+
+
+def _lookup_key(model, lookup):
+    """Returns the values of a lookup dict as the database returns them,
+    sorted by field name
+
+    Uploaded values are not always of the type of their field, e.g. commit
+    ids can be given as integers, and would otherwise never match a row.
+    """
+    opts = model._meta
+    return tuple(opts.get_field(field).to_python(lookup[field])
+                 for field in sorted(lookup))
+
 
+def _get_or_create_many(model, lookups, create):
+    """Fetches the model instances matching the given lookups in one query
+
+    :param lookups: list of lookup dicts, all with the same field names.
+                    Foreign keys must be given by their attname (``*_id``)
+    :param create: callable which creates and returns the instance for a
+                   lookup that is not present in the database
+    :return: a dict of instances keyed by the ``_lookup_key`` of the
+             lookups
+    """
+    fields = sorted(lookups[0])
+    found = OrderedDict()
+    for lookup in lookups:
+        found.setdefault(_lookup_key(model, lookup), None)
+
+    query = model.objects.all()
+    for i, field in enumerate(fields):
+        query = query.filter(**{field + '__in': set(k[i] for k in found)})
+    for obj in query:
+        obj_key = tuple(getattr(obj, field) for field in fields)
+        if obj_key in found:
+            found[obj_key] = obj
+
+    for obj_key, obj in found.items():
+        if obj is None:
+            found[obj_key] = create(dict(zip(fields, obj_key)))
+    return found
+
+
+def save_results(data, update_repo=True):
+    """
+    Saves a list of result dictionaries in a single transaction
+
+    Projects, branches, benchmarks, executables and revisions are fetched
+    once for the whole list, and results are inserted and updated in bulk.
+
+    It returns a tuple
+        list of (Revision, Executable, Environment), False  when no errors
+                                                            where found
+        Errormessage, True  when there is an error. Nothing is saved then
+    """
+    for item in data:
+        error = _check_mandatory_data(item)
+        if error:
+            return error, True
+
+    environments = get_metadata().environments_by_name
+    for item in data:
+        if item['environment'] not in environments:
+            return "Environment %(environment)s not found" % item, True
+
+    # Repositories are read before the transaction is opened, so that it is
+    # not kept open while they are updated
+    logs = _read_logs(data, update_repo)
     try:
-        rev = branch.revisions.get(commitid=data['commitid'])
-    except Revision.DoesNotExist:
-        rev_date = data.get("revision_date")
-        # "None" (as string) can happen when we urlencode the POST data
-        if not rev_date or rev_date in ["", "None"]:
-            rev_date = datetime.today()
-        rev = Revision(branch=branch, project=p, commitid=data['commitid'],
-                       date=rev_date)
-        try:
-            rev.full_clean()
-        except ValidationError as e:
-            return str(e), True
-        if p.repo_type not in ("N", ""):
-            try:
-                commit_logs = commits.get_logs(rev, rev, update=update_repo)
-            except commits.exceptions.CommitLogError as e:
-                logger.warning("unable to save revision %s info: %s", rev, e,
-                               exc_info=True)
-            else:
-                if commit_logs:
-                    log = commit_logs[0]
-                    rev.author = log['author']
-                    rev.date = log['date']
-                    rev.message = log['message']
-                    rev.tag = log['tag']
-
-        rev.save()
-
-    exe, created = Executable.objects.get_or_create(
-        name=data['executable'],
-        project=p
-    )
+        with transaction.atomic():
+            saved = _save_results(data, environments, logs, update_repo)
+            bump_data_versions(set(exe.project_id for _, exe, _ in saved))
+    except ValidationError as e:
+        return str(e), True
+    return saved, False
+
+
+def _read_logs(data, update_repo):
+    """Reads the commit logs of the revisions of data that are not saved yet
+
+    Returns a dict of logs, or None when a log could not be read, keyed by
+    (project name, branch name, commit id). New projects have no repository.
+    """
+    projects = dict((p.name, p) for p in Project.objects.filter(
+        name__in=set(item['project'] for item in data),
+    ).exclude(repo_type__in=(Project.NO_LOGS, "")))
+    commitid_field = Revision._meta.get_field('commitid')
+    revision_data = OrderedDict()
+    for item in data:
+        if item['project'] in projects:
+            revision_data.setdefault((
+                item['project'], item['branch'],
+                commitid_field.to_python(item['commitid'])), item)
+    if not revision_data:
+        return {}
+
+    existing = set(Revision.objects.filter(
+        branch__project__in=projects.values(),
+        commitid__in=set(key[2] for key in revision_data),
+    ).values_list('branch__project__name', 'branch__name', 'commitid'))
+    branches = dict(((b.project_id, b.name), b) for b in Branch.objects.filter(
+        project__in=projects.values(),
+        name__in=set(key[1] for key in revision_data)))
+
+    logs = {}
+    updated = set()
+    for key in revision_data:
+        if key in existing:
+            continue
+        p = projects[key[0]]
+        branch = branches.get((p.id, key[1]), Branch(name=key[1], project=p))
+        rev = Revision(branch=branch, project=p, commitid=key[2])
+        # The repository of each project is updated once
+        logs[key] = _read_log(rev, update_repo and p.id not in updated)
+        updated.add(p.id)
+    return logs
 
+
+def _read_log(rev, update_repo):
+    p = rev.branch.project
+    # The working copy is fetched by the fetch_repos command, and only
+    # read here, never cloned
+    background = repositories.fetches_in_background(p)
     try:
-        r = Result.objects.get(
-            revision=rev, executable=exe, benchmark=b, environment=env)
-    except Result.DoesNotExist:
-        r = Result(revision=rev, executable=exe, benchmark=b, environment=env)
+        if background and not repositories.is_fetched(p):
+            raise commits.exceptions.CommitLogError(
+                "%s was not fetched yet" % p)
+        commit_logs = commits.get_logs(
+            rev, rev, update=update_repo and not background)
+    except commits.exceptions.CommitLogError as e:
+        if background:
+            logger.info("revision %s info will be read after the next "
+                        "fetch: %s", rev, e)
+        else:
+            logger.warning("unable to save revision %s info: %s", rev, e,
+                           exc_info=True)
+        return None
+    return commit_logs[0] if commit_logs else None
+
+
+def _save_results(data, environments, logs, update_repo):
+    def project_lookup(item):
+        return {'name': item['project']}
+
+    projects = _get_or_create_many(
+        Project, [project_lookup(item) for item in data],
+        lambda lookup: Project.objects.create(**lookup))
+
+    def get_project(item):
+        return projects[_lookup_key(Project, project_lookup(item))]
+
+    def branch_lookup(item):
+        return {'name': item['branch'], 'project_id': get_project(item).id}
+
+    branches = _get_or_create_many(
+        Branch, [branch_lookup(item) for item in data],
+        lambda lookup: Branch.objects.create(**lookup))
+
+    def get_branch(item):
+        return branches[_lookup_key(Branch, branch_lookup(item))]
+
+    def benchmark_lookup(item):
+        return {'name': item['benchmark']}
+
+    benchmark_data = {}
+    for item in data:
+        benchmark_data.setdefault(
+            _lookup_key(Benchmark, benchmark_lookup(item)), item)
+
+    def create_benchmark(lookup):
+        item = benchmark_data[(lookup['name'],)]
+        b = Benchmark(name=lookup['name'])
+        if "description" in item:
+            b.description = item["description"]
+        if "units" in item:
+            b.units = item["units"]
+        if "units_title" in item:
+            b.units_title = item["units_title"]
+        if "lessisbetter" in item:
+            b.lessisbetter = item["lessisbetter"]
+        b.full_clean()
+        b.save()
+        return b
+
+    benchmarks = _get_or_create_many(
+        Benchmark, [benchmark_lookup(item) for item in data],
+        create_benchmark)
+
+    def executable_lookup(item):
+        return {'name': item['executable'], 'project_id': get_project(item).id}
+
+    executables = _get_or_create_many(
+        Executable, [executable_lookup(item) for item in data],
+        lambda lookup: Executable.objects.create(**lookup))
+
+    def revision_lookup(item):
+        return {'commitid': item['commitid'], 'branch_id': get_branch(item).id}
+
+    revision_data = OrderedDict()
+    for item in data:
+        revision_data.setdefault(
+            _lookup_key(Revision, revision_lookup(item)), item)
+
+    def create_revision(lookup):
+        item = revision_data[(lookup['branch_id'], lookup['commitid'])]
+        log = logs.get((item['project'], item['branch'], lookup['commitid']))
+        return _create_revision(
+            item, get_branch(item), get_project(item), log,
+            update_repo=update_repo)
 
+    revisions = _get_or_create_many(
+        Revision, [revision_lookup(item) for item in data], create_revision)
+
+    existing_results = {}
+    for r in Result.objects.filter(
+            revision__in=[rev.id for rev in revisions.values()],
+            executable__in=[exe.id for exe in executables.values()],
+            benchmark__in=[b.id for b in benchmarks.values()],
+            environment__in=[env.id for env in environments.values()]):
+        existing_results[(r.revision_id, r.executable_id, r.benchmark_id,
+                          r.environment_id)] = r
+
+    new_results = OrderedDict()
+    updated_results = OrderedDict()
+    saved = []
+    for item in data:
+        rev = revisions[_lookup_key(Revision, revision_lookup(item))]
+        exe = executables[_lookup_key(Executable, executable_lookup(item))]
+        b = benchmarks[_lookup_key(Benchmark, benchmark_lookup(item))]
+        env = environments[item['environment']]
+
+        result_key = (rev.id, exe.id, b.id, env.id)
+        if result_key in existing_results:
+            r = existing_results[result_key]
+            updated_results[result_key] = r
+        elif result_key in new_results:
+            r = new_results[result_key]
+        else:
+            r = Result(revision=rev, executable=exe, benchmark=b,
+                       environment=env, branch_id=rev.branch_id)
+            new_results[result_key] = r
+
+        _set_result_values(r, item, rev)
+        if (rev, exe, env) not in saved:
+            saved.append((rev, exe, env))
+
+    Result.objects.bulk_create(new_results.values())
+    bulk_update(list(updated_results.values()), RESULT_VALUE_FIELDS)
+    update_timeline_series(list(new_results) + list(updated_results))
+
+    return saved
+
+
+def _create_revision(data, branch, p, log, update_repo=True):
+    rev_date = data.get("revision_date")
+    # "None" (as string) can happen when we urlencode the POST data
+    if not rev_date or rev_date in ["", "None"]:
+        rev_date = datetime.today()
+    rev = Revision(branch=branch, project=p, commitid=data['commitid'],
+                   date=rev_date)
+    rev.full_clean()
+    if log is not None:
+        rev.author = log['author']
+        rev.date = log['date']
+        rev.message = log['message']
+        rev.tag = log['tag']
+
+    rev.save()
+    # Commits whose log could not be read are read after the next fetch
+    if update_repo and repositories.fetches_in_background(p):
+        repositories.request_update(p, None if log else rev.commitid)
+    return rev
+
+
+def _set_result_values(r, data, rev):
     r.value = data["result_value"]
     if 'result_date' in data:
         r.date = data["result_date"]
@@ -126,10 +363,34 @@ def save_result(data, update_repo=True):
     r.q1 = data.get('q1')
     r.q3 = data.get('q3')
 
-    r.full_clean()
-    r.save()
+    # Related objects are known to exist, and uniqueness is guaranteed
+    # by the caller, so only the values need validation
+    r.full_clean(exclude=['revision', 'executable', 'benchmark',
+                          'environment', 'branch'],
+                 validate_unique=False)
+
 
-    return (rev, exe, env), False
+def save_result(data, update_repo=True):
+    response, error = save_results([data], update_repo=update_repo)
+    if error:
+        return response, True
+    return response[0], False
+
+
+def delete_results(results):
+    """Deletes a queryset of results
+
+    Results have no delete signal receivers, so that they are deleted in a
+    single query along with their revisions. The stored series that contain
+    them are deleted, and the data versions of their projects bumped, here
+    instead.
+    """
+    with transaction.atomic():
+        project_ids = set(
+            results.values_list('executable__project', flat=True))
+        discard_timeline_series(results)
+        results.delete()
+        bump_data_versions(project_ids)
 
 
 def create_report_if_enough_data(rev, exe, e):
@@ -137,12 +398,14 @@ def create_report_if_enough_data(rev, exe, e):
     if exe.project.track is not True:
         return False
 
+    # Compare with the revision preceding rev, so that the outcome does not
+    # depend on newer revisions added before the report is generated
     last_revs = Revision.objects.filter(
-        branch=rev.branch
-    ).order_by('-date')[:2]
-    if len(last_revs) > 1:
+        branch=rev.branch, date__lte=rev.date
+    ).exclude(pk=rev.pk).order_by('-date')[:1]
+    if len(last_revs):
         current_results = rev.results.filter(executable=exe, environment=e)
-        last_results = last_revs[1].results.filter(
+        last_results = last_revs[0].results.filter(
             executable=exe, environment=e)
         # If there is are at least as many results as in the last revision,
         # create new report
@@ -13,6 +13,21 @@ DEF_BASELINE = None # Which executable + revision should be default as a baselin
 TREND = 10 # Default value for the depth of the trend
            # Used by reports for the latest runs and changes view
 
+IMAGE_CACHE = 'default'  # Name of the cache (see CACHES) holding the PNG plots
+                         # returned by makeimage and the render_images command
+IMAGE_CACHE_TIMEOUT = 86400  # Seconds a rendered plot is kept in IMAGE_CACHE
+
+CHANGES_TABLE_CACHE = 'default'  # Name of the cache (see CACHES) holding the
+                                 # changes tables of the reports. Use a cache
+                                 # shared by all server processes, with enough
+                                 # entries for the tables that are browsed
+CHANGES_TABLE_CACHE_TIMEOUT = 604800  # Seconds a changes table is kept. Tables
+                                     # are cached per data version, so outdated
+                                     # ones are only removed when they expire
+
+CHANGES_LOGS_PER_PAGE = 100  # Commit logs shown at once in the changes view. Older
+                             # commits of the range are loaded on demand
+
 # Threshold that determines when a performance change over the last result is significant
 CHANGE_THRESHOLD = 3.0
 
@@ -20,6 +35,36 @@ CHANGE_THRESHOLD = 3.0
 # over a number of revisions is significant
 TREND_THRESHOLD = 5.0
 
+CHANGEPOINT_DETECTION = False  # Flag reports by the change points of their results,
+                               # detected over whole series (requires NumPy), instead
+                               # of by their change and trend. Also listed in the
+                               # regressions view, and by "manage.py detect_changes"
+CHANGEPOINT_DEPTH = 200  # Number of newest revisions searched for change points
+CHANGEPOINT_PENALTY = 4.0  # Larger values detect fewer change points in noisy series
+
+REPORT_QUEUE_BACKEND = None  # How reports are generated after results are added.
+                             # None: synchronously, inside the upload request
+                             # 'codespeed.tasks.DatabaseQueue': report jobs are
+                             #     stored in the database, and generated by running
+                             #     "python manage.py process_reports"
+                             # 'codespeed.tasks.ThreadPoolQueue': same, but also
+                             #     generated by a pool of background threads in the
+                             #     web server process (for single-box deployments)
+
+REPORT_QUEUE_THREADS = 2  # Number of threads used by the ThreadPoolQueue backend
+REPORT_QUEUE_RETRY_DELAY = 600  # Seconds before a failed report job, or one whose
+                                # worker died, is processed again
+REPORT_QUEUE_MAX_ATTEMPTS = 3  # Failed attempts after which a report job is kept
+                               # with its error, and only processed again once
+                               # results for it are added
+
+REPOSITORY_FETCH_BACKGROUND = False  # True to fetch the git and mercurial working copies
+                                     # with "python manage.py fetch_repos" instead of
+                                     # inside the upload requests. Uploads then read the
+                                     # commit metadata from the fetched working copy.
+REPOSITORY_FETCH_INTERVAL = 300  # Seconds between two fetches of a project that no
+                                 # upload requested
+
 ## Home view options ##
 SHOW_REPORTS = True # Show report tables
 SHOW_HISTORICAL = False # Show historical graphs
@@ -55,6 +100,21 @@ TIMELINE_GRID_PAGING = 4   # Number of benchmarks to be send in one grid request
                            # and the database is not fast, it can take a long time
                            # to send all results.
 
+TIMELINE_FETCH_WORKERS = 1  # Number of threads fetching the series of the benchmarks of a
+                            # grid page concurrently, each with its own database
+                            # connection. 1 fetches them one after another.
+
+TIMELINE_DOWNSAMPLE = False  # Whether the timeline view asks for about one point per
+                             # pixel of each plot, keeping tags and regressions,
+                             # instead of every point of the series.
+
+TIMELINE_COLUMNAR = False  # Whether the timeline view asks for its data in the compact
+                           # columnar format, decoded by the browser.
+
+TIMELINE_CACHE_DEPTH = 1000  # Number of newest points of every timeline series that are
+                             # stored precomputed, and updated when results are added.
+                             # Deeper timelines are read from the results. 0 disables it.
+
 #TIMELINE_BRANCHES = True # NOTE: Only the default branch is currently shown
                          # Get timeline results for specific branches
                          # Set to False if you want timeline plots and results only for trunk.
@@ -85,6 +145,10 @@ COMPARISON_COMMIT_TAGS = None  # List of tag names which should be included in t
                                # If this value is set to None (default value), all the available tags will
                                # be included.
 
+COMPARISON_CACHE = 'default'  # Name of the cache (see CACHES) holding the data of
+                              # the comparison page, per data version
+COMPARISON_CACHE_TIMEOUT = 604800  # Seconds the comparison data is kept
+
 TIMELINE_EXECUTABLE_NAME_MAX_LEN = 22  # Maximum length of the executable name used in the
                                        # Changes and Timeline view. If the name is longer, the name
                                        # will be truncated and "..." will be added at the end.
@@ -101,6 +165,17 @@ REQUIRE_SECURE_AUTH = True  # Whether auth needs to be over a secure channel
 US_TZ_AWARE_DATES = False  # True to use timezone aware datetime objects with Github provider.
                            # NOTE: Some database backends may not support tz aware dates.
 
+HG_USE_CMDSERVER = False  # True to run the Mercurial commands of each working copy in a
+                          # pooled "hg serve --cmdserver pipe" process instead of starting
+                          # a new hg process for each command.
+HG_CMDSERVER_IDLE_TIMEOUT = 300  # Seconds after which an unused command server is closed.
+
 GITHUB_OAUTH_TOKEN = None  # Github oAuth token to use when using Github repo type. If not
                            # specified, it will utilize unauthenticated requests which have
                            # low rate limits.
+
+GITHUB_API_URL = 'https://api.github.com'  # Base URL of the Github API, e.g. for
+                                           # Github Enterprise.
+
+GITHUB_FETCH_THREADS = 4  # Maximum number of concurrent requests made to the Github
+                          # API when the logs of a range are fetched commit by commit.
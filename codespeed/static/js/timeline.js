@@ -62,6 +62,80 @@ function getConfiguration() {
   return config;
 }
 
+// Reads a base64 encoded column of little-endian float64 values
+function decodeColumn(encoded) {
+  var binary = atob(encoded);
+  var view = new DataView(new ArrayBuffer(binary.length));
+  for (var i = 0; i < binary.length; i++) {
+    view.setUint8(i, binary.charCodeAt(i));
+  }
+  var column = new Float64Array(binary.length / 8);
+  for (var j = 0; j < column.length; j++) {
+    column[j] = view.getFloat64(j * 8, true);
+  }
+  return column;
+}
+
+// Turns a timeline in the columnar format back into point lists of the form
+// [date, value, ..., commitid, tag, branch]
+function decodeTimeline(timeline) {
+  if (timeline.format !== "columnar") { return timeline; }
+  var revisions = timeline.revisions;
+  for (var branch in timeline.branches) {
+    for (var exe_id in timeline.branches[branch]) {
+      var columns = $.map(timeline.branches[branch][exe_id], function(encoded) {
+        return [decodeColumn(encoded)];
+      });
+      var points = [];
+      for (var i = 0; i < revisions.dates.length; i++) {
+        // NaN values mark revisions without a result in this series
+        if (isNaN(columns[0][i])) { continue; }
+        var point = [revisions.dates[i]];
+        for (var c = 0; c < columns.length; c++) {
+          point.push(isNaN(columns[c][i]) ? "" : columns[c][i]);
+        }
+        point.push(revisions.commitids[i], revisions.tags[i], branch);
+        points.push(point);
+      }
+      timeline.branches[branch][exe_id] = points;
+    }
+  }
+  delete timeline.format;
+  delete timeline.revisions;
+  return timeline;
+}
+
+// Width in pixels of the plots the series are drawn in: the single plot, or
+// the miniplots of the grid
+function getPlotWidth() {
+  if ($("input[name='benchmark']:checked").val() !== "grid") {
+    return Math.round($("#plotgrid").width());
+  }
+  // Miniplots are sized by the stylesheet, relative to the grid
+  var miniplot = $('<div class="miniplot"></div>').css("visibility", "hidden")
+    .appendTo("#plotgrid");
+  var width = Math.round(miniplot.width());
+  miniplot.remove();
+  return width;
+}
+
+// The configuration sent to the server. When enabled, it asks for the
+// columnar format, and for series downsampled to about one point per pixel of
+// their plot, which aren't part of the permalink
+function getDataConfiguration() {
+  var config = getConfiguration();
+  if (defaults.columnar) {
+    config.format = "columnar";
+  }
+  if (defaults.downsample) {
+    var width = getPlotWidth();
+    if (width > 0) {
+      config.points = width;
+    }
+  }
+  return config;
+}
+
 function permalinkToChanges(commitid, executableid, environment) {
   window.location=CHANGES_URL + "?rev=" + commitid + "&" + "exe=" + executableid + "&env=" + environment;
 }
@@ -288,6 +362,7 @@ function renderMiniplot(plotid, data) {
 }
 
 function render(data) {
+  $.each(data.timelines, function(i, timeline) { decodeTimeline(timeline); });
   $("#revisions").attr("disabled", false);
   $("#equidistant").attr("disabled", false);
   $("span.options.median").css("display", "none");
@@ -306,7 +381,7 @@ function render(data) {
     $("#plotgrid").html(getLoadText("No data available", h));
   } else if ($("input[name='benchmark']:checked").val() === "grid") {
     if (data.nextBenchmarks !== false) {
-      var config = getConfiguration();
+      var config = getDataConfiguration();
       config.nextBenchmarks = data.nextBenchmarks;
       $.getJSON("json/", config, render);
     }
@@ -335,7 +410,7 @@ function refreshContent() {
   var h = $("#content").height();//get height for loading text
   $("#plotgrid").fadeOut("fast", function() {
     $("#plotgrid").html(getLoadText("Loading...", h)).show();
-    $.getJSON("json/", getConfiguration(), render);
+    $.getJSON("json/", getDataConfiguration(), render);
   });
 }
 
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""Background generation of reports
+
+Generating a report recomputes its whole changes table, which can take
+longer than saving the results themselves. When a queue backend is
+configured (see ``REPORT_QUEUE_BACKEND`` in settings), uploads only record
+which reports need to be regenerated, and a worker generates them later.
+"""
+from __future__ import absolute_import
+
+import logging
+import threading
+import uuid
+from datetime import timedelta
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import ReportJob
+from .results import create_report_if_enough_data
+
+logger = logging.getLogger(__name__)
+
+_queues = {}
+
+
+class DatabaseQueue(object):
+    """Stores report jobs in the database
+
+    Jobs are deduplicated by (revision, executable, environment), and are
+    processed by running the ``process_reports`` management command. A job
+    is only deleted once its report is generated. Failed jobs are retried
+    after REPORT_QUEUE_RETRY_DELAY seconds, up to REPORT_QUEUE_MAX_ATTEMPTS
+    times, and then kept with their error until they are queued again.
+    """
+
+    def enqueue(self, rev, exe, env):
+        try:
+            with transaction.atomic():
+                job, created = ReportJob.objects.get_or_create(
+                    revision=rev, executable=exe, environment=env)
+        except IntegrityError:
+            # Created by a concurrent upload
+            created = False
+        if not created:
+            # Generated again even when it failed, as results were added
+            # since. A job being processed keeps its claim, and is
+            # processed again once released
+            ReportJob.objects.filter(
+                revision=rev, executable=exe, environment=env,
+            ).update(requeued=True, attempts=0, error='')
+
+    def process(self, limit=None):
+        """Generates the reports of the queued jobs, oldest first
+
+        Several workers can process the same queue: a job is claimed by
+        setting its claim, so that it is only processed by one of them.
+        Claims of workers that died are released after
+        REPORT_QUEUE_RETRY_DELAY seconds.
+
+        Returns the number of processed jobs
+        """
+        retry_delay = getattr(settings, 'REPORT_QUEUE_RETRY_DELAY', 600)
+        max_attempts = getattr(settings, 'REPORT_QUEUE_MAX_ATTEMPTS', 3)
+        processed = 0
+        while limit is None or processed < limit:
+            now = timezone.now()
+            job = ReportJob.objects.filter(
+                Q(claimed__isnull=True) |
+                Q(claimed__lt=now - timedelta(seconds=retry_delay)),
+                attempts__lt=max_attempts,
+            ).select_related(
+                'revision', 'executable', 'environment'
+            ).order_by('created', 'id').first()
+            if job is None:
+                break
+            claim = uuid.uuid4().hex
+            claimed = ReportJob.objects.filter(
+                pk=job.pk, claim=job.claim, attempts=job.attempts
+            ).update(claimed=now, claim=claim, requeued=False)
+            if not claimed:
+                # Claimed by another worker
+                continue
+            try:
+                create_report_if_enough_data(
+                    job.revision, job.executable, job.environment)
+            except Exception as e:
+                logger.error("Unable to generate report for %s: %s",
+                             job.revision, e, exc_info=True)
+                # Still claimed, so that it is only retried after the delay
+                ReportJob.objects.filter(pk=job.pk, claim=claim).update(
+                    attempts=F('attempts') + 1, error=str(e))
+            else:
+                deleted, _ = ReportJob.objects.filter(
+                    pk=job.pk, claim=claim, requeued=False).delete()
+                if not deleted:
+                    # Queued again in the meantime
+                    ReportJob.objects.filter(pk=job.pk, claim=claim).update(
+                        claimed=None, claim='')
+            processed += 1
+        return processed
+
+
+class ThreadPoolQueue(DatabaseQueue):
+    """Stores report jobs in the database and processes them in a pool of
+    background threads of the current process
+
+    Meant for single-box deployments without a separate worker. Jobs left
+    over by a restart are processed on the next upload, or by the
+    ``process_reports`` management command.
+    """
+
+    def __init__(self):
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPool(
+                    getattr(settings, 'REPORT_QUEUE_THREADS', 2))
+            return self._pool
+
+    def enqueue(self, rev, exe, env):
+        super(ThreadPoolQueue, self).enqueue(rev, exe, env)
+        transaction.on_commit(
+            lambda: self.get_pool().apply_async(self._process_in_thread))
+
+    def _process_in_thread(self):
+        try:
+            self.process()
+        finally:
+            # Each thread has its own database connections
+            connections.close_all()
+
+
+def get_report_queue():
+    """Returns the configured report queue, or None when reports are
+    generated synchronously"""
+    path = getattr(settings, 'REPORT_QUEUE_BACKEND', None)
+    if not path:
+        return None
+    if path not in _queues:
+        _queues[path] = import_string(path)()
+    return _queues[path]
+
+
+def enqueue_report(rev, exe, env):
+    """Queues the (re)generation of a report
+
+    Returns False when there is no queue configured, in which case the
+    caller should generate the report itself.
+    """
+    queue = get_report_queue()
+    if queue is None:
+        return False
+    queue.enqueue(rev, exe, env)
+    return True
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+import random
+from datetime import datetime, timedelta
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils.six import StringIO
+
+from codespeed.changepoints import (MIN_SEGMENT_SIZE, detect,
+                                    find_change_points, update_change_points)
+from codespeed.models import (Benchmark, Branch, ChangePoint, Environment,
+                              Executable, Project, Report, Result, Revision)
+
+
+def noisy(level, count, rng):
+    return [rng.gauss(level, 2) for _ in range(count)]
+
+
+class TestFindChangePoints(TestCase):
+    def test_step(self):
+        rng = random.Random(1)
+        values = noisy(100, 40, rng) + noisy(120, 40, rng)
+        self.assertEqual(find_change_points(values), [40])
+        [(index, before, after, change)] = detect(values)
+        self.assertEqual(index, 40)
+        self.assertAlmostEqual(change, 20, delta=3)
+
+    def test_noise_and_outliers_are_ignored(self):
+        rng = random.Random(2)
+        values = noisy(100, 100, rng)
+        values[50] = 200
+        self.assertEqual(find_change_points(values), [])
+
+    def test_series_without_noise(self):
+        self.assertEqual(find_change_points([5.0] * 20), [])
+        self.assertEqual(find_change_points([1.0] * 10 + [2.0] * 10), [10])
+        self.assertEqual(find_change_points([1.0] * 5), [])
+
+    @override_settings(CHANGE_THRESHOLD=30.0)
+    def test_small_changes_are_not_reported(self):
+        rng = random.Random(3)
+        values = noisy(100, 40, rng) + noisy(120, 40, rng)
+        self.assertEqual(find_change_points(values), [40])
+        self.assertEqual(detect(values), [])
+
+
+class TestChangePoints(TestCase):
+    def setUp(self):
+        project = Project.objects.create(name='project', repo_type='N')
+        self.branch = Branch.objects.create(name='default', project=project)
+        self.executable = Executable.objects.create(name='exe',
+                                                    project=project)
+        self.environment = Environment.objects.create(name='env')
+        self.benchmark = Benchmark.objects.create(name='bench')
+        rng = random.Random(4)
+        values = noisy(100, 20, rng) + noisy(130, 10, rng)
+        start = datetime(2020, 1, 1)
+        self.revisions = []
+        for i, value in enumerate(values):
+            rev = Revision.objects.create(
+                commitid=str(i), branch=self.branch,
+                date=start + timedelta(days=i))
+            Result.objects.create(
+                value=value, revision=rev, executable=self.executable,
+                benchmark=self.benchmark, environment=self.environment)
+            self.revisions.append(rev)
+
+    def test_update_change_points(self):
+        [change_point] = update_change_points(
+            self.revisions[-1], self.executable, self.environment)
+        self.assertEqual(change_point.revision, self.revisions[20])
+        self.assertEqual(change_point.confirmed_by,
+                         self.revisions[20 + MIN_SEGMENT_SIZE - 1])
+        self.assertTrue(change_point.is_regression())
+        self.assertEqual(ChangePoint.objects.count(), 1)
+
+        # Detected again, not duplicated
+        update_change_points(
+            self.revisions[-1], self.executable, self.environment)
+        self.assertEqual(ChangePoint.objects.count(), 1)
+        # Only the results up to the revision are searched
+        self.assertEqual(update_change_points(
+            self.revisions[19], self.executable, self.environment), [])
+        self.assertEqual(ChangePoint.objects.count(), 1)
+
+    @override_settings(CHANGEPOINT_DETECTION=True)
+    def test_reports_are_flagged_by_confirming_revision(self):
+        def make_report(rev):
+            return Report.objects.create(
+                revision=rev, executable=self.executable,
+                environment=self.environment)
+
+        self.assertEqual(make_report(self.revisions[20]).colorcode, "none")
+        report = make_report(self.revisions[20 + MIN_SEGMENT_SIZE - 1])
+        self.assertEqual(report.colorcode, "red")
+        self.assertTrue(report.summary.startswith("bench up "))
+        self.assertEqual(make_report(self.revisions[-1]).colorcode, "none")
+
+    def test_regressions_view(self):
+        call_command('detect_changes', stdout=StringIO())
+        response = self.client.get(reverse('regressions'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['change_points']),
+                         list(ChangePoint.objects.all()))
+        self.assertContains(response, self.revisions[20].commitid)
+
+        # Improvements are not listed
+        self.benchmark.lessisbetter = False
+        self.benchmark.save()
+        response = self.client.get(reverse('regressions'))
+        self.assertContains(response, "No regressions detected")
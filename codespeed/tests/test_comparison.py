@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import json
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from codespeed.comparison import build_comparison_data, get_comparison_data
+from codespeed.metadata import get_metadata
+from codespeed.models import Benchmark, Environment, Project, Result
+from codespeed.results import save_results
+from codespeed.versions import ALL_PROJECTS, bump_data_versions
+from codespeed.views_data import getcomparisonexes
+
+
+class TestComparisonData(TestCase):
+    fixtures = ["timeline_tests.json"]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_values_match_results(self):
+        compdata = build_comparison_data()
+        self.assertEqual(compdata['error'], "None")
+
+        executables, exekeys = getcomparisonexes()
+        self.assertEqual(sorted(exekeys),
+                         sorted(k for k in compdata if k != 'error'))
+        for proj in executables:
+            for exe in executables[proj]:
+                for env in Environment.objects.all():
+                    results = dict(Result.objects.filter(
+                        environment=env,
+                        executable=exe['executable'],
+                        revision=exe['revision'],
+                    ).values_list('benchmark', 'value'))
+                    for bench in Benchmark.objects.all():
+                        self.assertEqual(
+                            compdata[exe['key']][env.id][bench.id],
+                            results.get(bench.id))
+        self.assertEqual(compdata['1+L+master'][1][1], 2100.0)
+
+    def test_query_count_independent_of_environments(self):
+        def count_queries():
+            # Not counting the reload of the dimension tables
+            get_metadata()
+            with CaptureQueriesContext(connection) as queries:
+                build_comparison_data()
+            return len(queries)
+
+        before = count_queries()
+        for i in range(5):
+            Environment.objects.create(name='env%d' % i)
+        self.assertEqual(count_queries(), before)
+
+    def test_cached_until_results_are_saved(self):
+        Project.objects.filter(name='MyProject').update(repo_type='N')
+        self.assertEqual(get_comparison_data()['1+L+master'][1][1], 2100.0)
+        # Only the data version is read
+        with self.assertNumQueries(1):
+            get_comparison_data()
+
+        response, error = save_results([{
+            'commitid': '5',
+            'branch': 'master',
+            'project': 'MyProject',
+            'executable': 'myexe O3 64bits',
+            'benchmark': 'float',
+            'environment': 'Dual Core',
+            'result_value': 1900.0,
+        }])
+        self.assertFalse(error)
+        self.assertEqual(get_comparison_data()['1+L+master'][1][1], 1900.0)
+
+    def test_stale_data_of_other_processes_is_not_read(self):
+        self.assertEqual(get_comparison_data()['1+L+master'][1][1], 2100.0)
+        # Saved by another process, which only bumps the data versions
+        Result.objects.filter(value=2100.0).update(value=1900.0)
+        self.assertEqual(get_comparison_data()['1+L+master'][1][1], 2100.0)
+        bump_data_versions([ALL_PROJECTS])
+        self.assertEqual(get_comparison_data()['1+L+master'][1][1], 1900.0)
+
+    def test_getcomparisondata(self):
+        response = self.client.get(reverse('getcomparisondata'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content.decode()),
+                         json.loads(json.dumps(build_comparison_data())))
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import mock
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.utils.six import StringIO
+
+
+class TestMakeImage(TestCase):
+    fixtures = ["timeline_tests.json"]
+
+    def setUp(self):
+        cache.clear()
+        self.path = reverse('makeimage')
+        self.data = {
+            'env': 'Dual Core',
+            'proj': 'MyProject',
+            'branch': 'master',
+            'exe': 'myexe O3 64bits',
+            'ben': 'float',
+        }
+
+    def test_image_is_cached(self):
+        response = self.client.get(self.path, self.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertTrue(response.content.startswith(b'\x89PNG'))
+
+        with mock.patch('codespeed.images.render_image') as render:
+            cached = self.client.get(self.path, self.data)
+            self.assertFalse(render.called)
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(cached['ETag'], response['ETag'])
+
+    def test_etag(self):
+        etag = self.client.get(self.path, self.data)['ETag']
+
+        response = self.client.get(self.path, self.data,
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Normalized parameters give the same image
+        response = self.client.get(
+            self.path, dict(self.data, revs='10', width='600'),
+            HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(self.path, dict(self.data, revs='2'),
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_render_images_command(self):
+        out = StringIO()
+        call_command('render_images', processes=1, stdout=out)
+        self.assertIn("Rendered 3 images", out.getvalue())
+
+        with mock.patch('codespeed.images.render_image') as render:
+            response = self.client.get(self.path, self.data)
+            self.assertFalse(render.called)
+        self.assertEqual(response.status_code, 200)
+
+        # Nothing left to render
+        out = StringIO()
+        call_command('render_images', processes=1, stdout=out)
+        self.assertIn("Rendered 0 images", out.getvalue())
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+from django.test import TestCase
+
+from codespeed.metadata import get_metadata
+from codespeed.models import Benchmark, Environment, Executable, Project
+from codespeed.results import save_results
+from codespeed.tests.utils import make_result_data
+from codespeed.versions import ALL_PROJECTS, bump_data_versions
+from codespeed.views_data import get_num_revs_and_benchmarks
+
+
+class TestMetadata(TestCase):
+    fixtures = ["timeline_tests.json"]
+
+    def test_snapshot_is_reused(self):
+        metadata = get_metadata()
+        # Only the data version is read
+        with self.assertNumQueries(1):
+            self.assertIs(get_metadata(), metadata)
+        self.assertEqual([exe.name for exe in metadata.tracked_executables()],
+                         ['myexe O3 64bits', 'exe'])
+        self.assertEqual(
+            [(branch.project.name, branch.name)
+             for branch in metadata.default_branches()],
+            [('MyProject', 'master'), ('Other', 'default')])
+
+    def test_benchmark_order(self):
+        Benchmark.objects.create(name='a benchmark')
+        ids = list(Benchmark.objects.order_by('id').values_list(
+            'id', flat=True))
+        self.assertEqual([bench.id for bench in get_metadata().benchmarks],
+                         ids)
+        # Grid pages list the benchmarks by name
+        revs, benchmarks = get_num_revs_and_benchmarks({'ben': 'grid'})
+        self.assertEqual([bench.name for bench in benchmarks],
+                         sorted(bench.name for bench in benchmarks))
+        self.assertEqual(benchmarks[0].name, 'a benchmark')
+
+    def test_saves_clear_the_snapshot(self):
+        get_metadata()
+        env = Environment.objects.create(name='Quad Core')
+        self.assertEqual(get_metadata().environments_by_name['Quad Core'], env)
+
+        exe = Executable.objects.get(name='exe')
+        exe.delete()
+        self.assertNotIn(exe.id, get_metadata().executables_by_id)
+
+    def test_changes_of_other_processes(self):
+        metadata = get_metadata()
+        # Saved without signals, as seen from another process
+        Environment.objects.bulk_create([Environment(name='Quad Core')])
+        self.assertIs(get_metadata(), metadata)
+
+        bump_data_versions([ALL_PROJECTS], metadata=True)
+        self.assertIn('Quad Core', get_metadata().environments_by_name)
+
+    def test_saved_results_keep_the_snapshot(self):
+        metadata = get_metadata()
+        Project.objects.update(repo_type='N')
+        save_results([make_result_data('new', project='MyProject',
+                                       executable='myexe O3 64bits',
+                                       branch='master')])
+        self.assertIs(get_metadata(), metadata)
+
+        bump_data_versions([ALL_PROJECTS])
+        self.assertIs(get_metadata(), metadata)
@@ -1,11 +1,19 @@
 # -*- coding: utf-8 -*-
 import os
+import re
+from unittest import skipUnless
 
+import mock
 from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 
 from codespeed.models import (Project, Report, Revision, Branch, Environment,
-                              Benchmark, Executable, Result)
+                              Benchmark, Executable, Result, CHANGES_TRENDS)
+from codespeed.versions import bump_data_versions
 from datetime import timedelta, datetime
 
 
@@ -13,6 +21,7 @@ from datetime import timedelta, datetime
 class TestReport(TestCase):
 
     def setUp(self):
+        cache.clear()
         self.days = 0
         self.starttime = datetime.now() + timedelta(days=-100)
 
@@ -198,6 +207,109 @@ class TestReport(TestCase):
         self.assertRegexpMatches(rep.summary, '[sS]pace')
         self.assertEquals('red', rep.colorcode)
 
+    def test_changes_table_contents(self):
+        b1 = self.make_bench('b1')
+        b2 = self.make_bench('b2', quantity='Space', units='bytes')
+        for value in [10, 11, 12, 13]:
+            rev = self.make_result(value)
+            self.make_result(value * 2, rev=rev, benchmark=b1)
+        self.make_result(100, rev=rev, benchmark=b2)
+
+        report = Report(revision=rev, environment=self.env, executable=self.exe)
+        tablelist = report.get_changes_table(trend_depth=3)
+
+        self.assertEqual([t['units_title'] for t in tablelist],
+                         ['Time', 'Space'])
+        rows = dict((row['bench_name'], row) for row in tablelist[0]['rows'])
+        self.assertEqual(rows['TestBench']['result'], 13)
+        self.assertAlmostEqual(rows['TestBench']['change'], 100.0 / 12)
+        # trend is relative to the average of revisions 1 to 3 back
+        self.assertAlmostEqual(rows['TestBench']['trend'], 100.0 * 2 / 11)
+        self.assertEqual(rows['b1']['result'], 26)
+        self.assertEqual(tablelist[1]['rows'][0]['change'], "-")
+        self.assertEqual(tablelist[1]['rows'][0]['trend'], "-")
+
+    def test_changes_table_query_count_independent_of_benchmarks(self):
+        def count_queries(num_benchmarks):
+            benchmarks = [self.make_bench('bench%d-%d' % (num_benchmarks, i))
+                          for i in range(num_benchmarks)]
+            for value in range(1, 8):
+                rev = self.make_result(value)
+                for bench in benchmarks:
+                    self.make_result(value, rev=rev, benchmark=bench)
+            report = Report(revision=rev, environment=self.env,
+                            executable=self.exe)
+            report.revision = Revision.objects.get(pk=rev.pk)
+            with CaptureQueriesContext(connection) as queries:
+                report.get_changes_table(trend_depth=5)
+            return len(queries)
+
+        self.assertEqual(count_queries(2), count_queries(20))
+
+    def test_changes_tables_cached_per_trend(self):
+        for value in [1.0, 1.0, 1.0, 1.0]:
+            rev = self.make_result(value)
+        report = self.make_report(rev)
+
+        # Only the data version is read
+        with self.assertNumQueries(1):
+            report.get_changes_table(settings.TREND)
+        table = report.get_changes_table(5)
+        with self.assertNumQueries(1):
+            self.assertEqual(report.get_changes_table(5), table)
+        # Other depths are not invalidated, so they are not cached
+        report.get_changes_table(3)
+        self.assertGreater(
+            count_queries(lambda: report.get_changes_table(3)), 0)
+
+        Result.objects.filter(revision=rev).update(value=2.0)
+        self.assertEqual(report.get_changes_table(5), table)
+        report.save()
+        self.assertEqual(
+            report.get_changes_table(5)[0]['rows'][0]['result'], 2.0)
+
+        # Results saved by another process bump the data version, which
+        # hides the tables cached before
+        Result.objects.filter(revision=rev).update(value=3.0)
+        bump_data_versions([self.pro.id])
+        self.assertEqual(
+            report.get_changes_table(5)[0]['rows'][0]['result'], 3.0)
+
+        with mock.patch('codespeed.models.CHANGES_TABLE_VERSION', 2):
+            self.assertGreater(count_queries(
+                lambda: report.get_changes_table(settings.TREND)), 0)
+
+    def test_changes_during_save_are_not_hidden(self):
+        for value in [1.0, 1.0, 1.0, 1.0]:
+            rev = self.make_result(value)
+        report = self.make_report(rev)
+        aggregate = report.aggregate_significant_changes
+
+        def aggregate_then_change(tablelist):
+            # Results saved by another process while the report is saved
+            Result.objects.filter(revision=rev).update(value=2.0)
+            bump_data_versions([self.pro.id])
+            return aggregate(tablelist)
+
+        with mock.patch.object(report, 'aggregate_significant_changes',
+                               side_effect=aggregate_then_change):
+            report.save()
+        self.assertEqual(
+            report.get_changes_table(5)[0]['rows'][0]['result'], 2.0)
+
+    def test_all_trends_precomputed_on_save(self):
+        for value in range(1, 106):
+            rev = self.make_result(float(value % 7 + 1))
+        report = self.make_report(rev)
+
+        for depth in CHANGES_TRENDS:
+            with self.assertNumQueries(1):
+                table = report.get_changes_table(depth)
+            # Same table as when the depth is built on its own
+            self.assertEqual(table, report.get_changes_tables([depth])[depth])
+        self.assertNotEqual(report.get_changes_table(5),
+                            report.get_changes_table(100))
+
     def make_result(self, value, rev=None, benchmark=None):
         from uuid import uuid4
 
@@ -219,7 +331,8 @@ class TestReport(TestCase):
     def make_report(self, revision):
         Report(revision=revision, environment=self.env,
                executable=self.exe).save()
-        return Report.objects.get(revision=revision)
+        return Report.objects.select_related('executable').get(
+            revision=revision)
 
     def make_bench(self, name, quantity='Time', units='seconds'):
         Benchmark(name=name, units_title=quantity, units=units).save()
@@ -237,6 +350,74 @@ class TestReport(TestCase):
                 for x in range(settings.TREND)]
 
 
+def count_queries(func):
+    with CaptureQueriesContext(connection) as queries:
+        func()
+    return len(queries)
+
+
+@skipUnless(connection.vendor == 'sqlite', "Query plans are SQLite specific")
+class TestQueryPlans(TestCase):
+    """The hot result queries must be answered from an index"""
+    fixtures = ["timeline_tests.json"]
+
+    def setUp(self):
+        cache.clear()
+
+    def get_result_plans(self, func):
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        plans = []
+        cursor = connection.cursor()
+        for query in queries:
+            if 'FROM "codespeed_result"' not in query['sql']:
+                continue
+            cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+            plans.append(' / '.join(row[-1] for row in cursor.fetchall()))
+        self.assertTrue(plans)
+        for plan in plans:
+            self.assertIsNone(
+                re.search(r'\bSCAN (TABLE )?codespeed_result\b', plan), plan)
+        return plans
+
+    @override_settings(TIMELINE_CACHE_DEPTH=0)
+    def test_timeline_query(self):
+        from codespeed.timelines import get_timeline_series
+        branch = Branch.objects.get(name='master')
+        plans = self.get_result_plans(lambda: get_timeline_series(
+            Benchmark.objects.all(), Environment.objects.get(),
+            Executable.objects.filter(project=branch.project), [branch], 10))
+        for plan in plans:
+            self.assertIn('result_series_idx', plan)
+
+    def test_changes_query(self):
+        report = Report.objects.order_by('-revision__date')[0]
+        self.get_result_plans(
+            lambda: report.get_changes_table(10, force_save=True))
+
+    def test_comparison_query(self):
+        self.get_result_plans(
+            lambda: self.client.get(reverse('getcomparisondata')))
+
+
+class TestResult(TestCase):
+    fixtures = ["timeline_tests.json"]
+
+    def test_branch_follows_revision(self):
+        res = Result.objects.filter(branch__name='master').first()
+        feature = Branch.objects.get(name='feature')
+        res.branch = Branch.objects.get(name='default', project__name='Other')
+        res.save()
+        self.assertEqual(Result.objects.get(pk=res.pk).branch.name, 'master')
+
+        res = Result.objects.get(pk=res.pk)
+        res.revision = Revision.objects.create(
+            commitid='7', branch=feature, project=feature.project,
+            date=datetime(2011, 4, 15, 10, 0, 0))
+        res.save(update_fields=['revision'])
+        self.assertEqual(Result.objects.get(pk=res.pk).branch, feature)
+
+
 class TestProject(TestCase):
 
     def setUp(self):
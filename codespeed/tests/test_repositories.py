@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from datetime import datetime, timedelta
+from unittest import skipUnless
+try:
+    from shutil import which
+except ImportError:
+    # Python 2
+    from distutils.spawn import find_executable as which
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.six import StringIO
+from mock import patch
+
+from codespeed.commits.exceptions import CommitLogError
+from codespeed.models import (Benchmark, Branch, Environment, Executable,
+                              Project, RepositoryUpdate, Revision, Result,
+                              TimelineSeries)
+from codespeed.repositories import (backfill_revisions, fetch_project,
+                                    get_due_projects)
+from codespeed.tests.utils import make_result_data
+
+
+def make_log(commitid):
+    return {
+        'date': datetime(2020, 3, 6, 4, 14, 41),
+        'message': 'message of %s' % commitid,
+        'commitid': commitid,
+        'author': 'author',
+        'author_email': 'email',
+        'body': 'body',
+        'short_commit_id': commitid,
+        'tag': '',
+    }
+
+
+def bulk_update_without_signals(objects, fields):
+    for obj in objects:
+        type(obj).objects.filter(pk=obj.pk).update(
+            **dict((field, getattr(obj, field)) for field in fields))
+
+
+@override_settings(ALLOW_ANONYMOUS_POST=True,
+                   REPOSITORY_FETCH_BACKGROUND=True,
+                   REPOSITORY_FETCH_INTERVAL=300)
+@patch('codespeed.commits.git.updaterepo')
+@patch('codespeed.commits.git.getlogs')
+class TestBackgroundFetch(TestCase):
+
+    def setUp(self):
+        Environment.objects.create(name='Dual Core')
+        self.project = Project.objects.create(
+            name='MyProject', repo_type=Project.GIT,
+            repo_path='https://example.com/repo.git')
+        self.base_path = tempfile.mkdtemp()
+        self.settings = override_settings(REPOSITORY_BASE_PATH=self.base_path)
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.base_path)
+
+    def post_results(self, data):
+        response = self.client.post(reverse('add-json-results'),
+                                    {'json': json.dumps(data)})
+        self.assertEqual(response.status_code, 202)
+
+    def test_upload_reads_fetched_copy(self, getlogs, updaterepo):
+        os.mkdir(self.project.working_copy)
+        getlogs.side_effect = lambda rev, startrev: [make_log(rev.commitid)]
+
+        self.post_results([make_result_data('1')])
+        self.post_results([make_result_data('2')])
+
+        self.assertFalse(updaterepo.called)
+        self.assertEqual(Revision.objects.get(commitid='2').author, 'author')
+        # Both requests are coalesced into one fetch
+        update = RepositoryUpdate.objects.get()
+        self.assertIsNotNone(update.requested)
+        self.assertEqual(update.get_commitids(), [])
+
+        self.assertEqual(fetch_project(self.project), 0)
+        self.assertEqual(updaterepo.call_count, 1)
+        self.assertIsNone(RepositoryUpdate.objects.get().requested)
+
+    def test_metadata_read_after_fetch(self, getlogs, updaterepo):
+        self.post_results([make_result_data('1')])
+
+        self.assertFalse(getlogs.called)
+        self.assertEqual(Revision.objects.get().author, '')
+        self.assertEqual(RepositoryUpdate.objects.get().get_commitids(), ['1'])
+
+        getlogs.side_effect = lambda rev, startrev: [make_log(rev.commitid)]
+        out = StringIO()
+        call_command('fetch_repos', once=True, stdout=out)
+        self.assertIn("Fetched MyProject, updated 1 revisions", out.getvalue())
+
+        rev = Revision.objects.get()
+        self.assertEqual(rev.author, 'author')
+        self.assertEqual(rev.message, 'message of 1')
+        self.assertEqual(Result.objects.get().date, rev.date)
+        self.assertEqual(RepositoryUpdate.objects.get().get_commitids(), [])
+
+    def test_every_new_commit_is_queued(self, getlogs, updaterepo):
+        other = Project.objects.create(
+            name='Other', repo_type=Project.GIT,
+            repo_path='https://example.com/other.git')
+        self.post_results([
+            make_result_data('1'),
+            make_result_data('2'),
+            make_result_data('3', project='Other'),
+        ])
+
+        # Nothing is cloned while the results are saved
+        self.assertFalse(getlogs.called)
+        self.assertFalse(updaterepo.called)
+        self.assertEqual(RepositoryUpdate.objects.get(
+            project=self.project).get_commitids(), ['1', '2'])
+        self.assertEqual(RepositoryUpdate.objects.get(
+            project=other).get_commitids(), ['3'])
+
+    def test_failed_fetch_keeps_commits(self, getlogs, updaterepo):
+        self.post_results([make_result_data('1')])
+        updaterepo.side_effect = CommitLogError("unreachable")
+
+        with patch('codespeed.repositories.logger') as logger:
+            self.assertEqual(fetch_project(self.project), 0)
+        self.assertTrue(logger.error.called)
+        self.assertEqual(RepositoryUpdate.objects.get().get_commitids(), ['1'])
+
+    def test_due_projects(self, getlogs, updaterepo):
+        now = timezone.now()
+        self.assertEqual(get_due_projects(now), [self.project])
+
+        fetch_project(self.project)
+        self.assertEqual(get_due_projects(now), [])
+        self.assertEqual(
+            get_due_projects(now + timedelta(seconds=301)), [self.project])
+
+        RepositoryUpdate.objects.update(requested=now)
+        self.assertEqual(get_due_projects(now), [self.project])
+
+    @override_settings(REPOSITORY_FETCH_BACKGROUND=False)
+    def test_upload_updates_repository(self, getlogs, updaterepo):
+        getlogs.side_effect = lambda rev, startrev: [make_log(rev.commitid)]
+        self.post_results([make_result_data('1')])
+        self.assertEqual(updaterepo.call_count, 1)
+        self.assertEqual(RepositoryUpdate.objects.count(), 0)
+
+        # Once per project
+        Project.objects.create(name='Other', repo_type=Project.GIT,
+                               repo_path='https://example.com/other.git')
+        self.post_results([
+            make_result_data('2'),
+            make_result_data('3'),
+            make_result_data('4', project='Other'),
+        ])
+        self.assertEqual(updaterepo.call_count, 3)
+        self.assertEqual(getlogs.call_count, 4)
+
+
+@skipUnless(which('git'), "git is not installed")
+class TestBackfillRevisions(TestCase):
+
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+        self.settings = override_settings(REPOSITORY_BASE_PATH=self.base_path)
+        self.settings.enable()
+        self.project = Project.objects.create(
+            name='MyProject', repo_type=Project.GIT,
+            repo_path='https://example.com/repo.git')
+        path = self.project.working_copy
+        env = dict(os.environ, GIT_AUTHOR_NAME='author',
+                   GIT_AUTHOR_EMAIL='author@example.com',
+                   GIT_COMMITTER_NAME='author',
+                   GIT_COMMITTER_EMAIL='author@example.com')
+        subprocess.check_call(['git', 'init', '-q', path])
+        for i in range(5):
+            env['GIT_AUTHOR_DATE'] = '2020-03-0%d 10:00:00' % (i + 1)
+            subprocess.check_call(
+                ['git', 'commit', '-q', '--allow-empty', '-m', 'commit %d' % i],
+                cwd=path, env=env)
+        subprocess.check_call(['git', 'tag', 'v1.0', 'HEAD~1'], cwd=path)
+        self.commitids = subprocess.check_output(
+            ['git', 'rev-list', 'HEAD'], cwd=path).decode().split()
+
+        branch = Branch.objects.create(name='default', project=self.project)
+        self.today = datetime(2021, 1, 1)
+        for commitid in [self.commitids[0], self.commitids[1][:7],
+                         self.commitids[3], 'unknown']:
+            Revision.objects.create(commitid=commitid, branch=branch,
+                                    date=self.today)
+        Revision.objects.create(commitid=self.commitids[4], branch=branch,
+                                author='someone', date=self.today)
+        Result.objects.create(
+            value=1.0, date=self.today,
+            revision=Revision.objects.get(commitid=self.commitids[3]),
+            executable=Executable.objects.create(name='exe',
+                                                 project=self.project),
+            benchmark=Benchmark.objects.create(name='float'),
+            environment=Environment.objects.create(name='env'))
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.base_path)
+
+    def test_backfill(self):
+        out = StringIO()
+        call_command('backfill_revisions', batch_size=2, stdout=out)
+        self.assertEqual(out.getvalue().splitlines(), [
+            "MyProject: 2 revisions updated, 2 commits read",
+            "MyProject: 3 revisions updated, 5 commits read",
+            "MyProject: updated 3 revisions, 1 not found",
+        ])
+
+        rev = Revision.objects.get(commitid=self.commitids[1][:7])
+        self.assertEqual(rev.author, 'author')
+        self.assertEqual(rev.message, 'commit 3')
+        self.assertEqual(rev.tag, 'v1.0')
+        self.assertEqual(rev.date, datetime.fromtimestamp(int(
+            subprocess.check_output(
+                ['git', 'log', '-1', '--format=%at', self.commitids[1]],
+                cwd=self.project.working_copy))))
+
+        rev = Revision.objects.get(commitid=self.commitids[3])
+        self.assertEqual(Result.objects.get().date, rev.date)
+        self.assertNotEqual(rev.date, self.today)
+
+        # Revisions with metadata are left alone
+        self.assertEqual(
+            Revision.objects.get(commitid=self.commitids[4]).date, self.today)
+
+    def test_backfill_changes_etag(self):
+        path = reverse('gettimelinedata')
+        data = {'exe': Executable.objects.get().id, 'ben': 'float',
+                'env': Environment.objects.get().id, 'revs': 10}
+        response = self.client.get(path, data)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        # Saved without signals, as by the bulk_update of Django >= 2.2
+        with patch('codespeed.results.bulk_update',
+                   side_effect=bulk_update_without_signals):
+            call_command('backfill_revisions', batch_size=2,
+                         stdout=StringIO())
+        response = self.client.get(path, data, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_backfill_clears_series_per_batch(self):
+        res = Result.objects.get()
+        TimelineSeries.objects.create(
+            benchmark=res.benchmark, environment=res.environment,
+            executable=res.executable, branch=res.branch)
+
+        stored = []
+        with patch('codespeed.results.bulk_update',
+                   side_effect=bulk_update_without_signals):
+            backfill_revisions(
+                self.project, batch_size=2,
+                progress=lambda *args: stored.append(
+                    TimelineSeries.objects.exists()))
+        self.assertEqual(stored, [False, False])
+
+    def test_resume(self):
+        call_command('backfill_revisions', 'MyProject', stdout=StringIO())
+        out = StringIO()
+        call_command('backfill_revisions', 'MyProject', stdout=out)
+        self.assertIn("updated 0 revisions, 1 not found", out.getvalue())
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from mock import patch
+
+from codespeed.models import (Project, Benchmark, Revision, Executable,
+                              Environment, Result)
+from codespeed.metadata import get_metadata
+from codespeed.results import save_results
+from codespeed.tests.utils import make_result_data
+
+
+class TestSaveResults(TestCase):
+
+    def setUp(self):
+        self.env = Environment.objects.create(name='Dual Core')
+
+    def test_save_results(self):
+        data = [
+            make_result_data('1', 'float', 1.5, std_dev=0.1),
+            make_result_data('1', 'int', 2, units='bytes'),
+            make_result_data('2', 'float', 1.2),
+        ]
+
+        response, error = save_results(data)
+
+        self.assertFalse(error)
+        self.assertEqual(len(response), 2)
+        self.assertEqual([rev.commitid for rev, exe, env in response],
+                         ['1', '2'])
+        self.assertEqual(Project.objects.count(), 1)
+        self.assertEqual(Executable.objects.count(), 1)
+        self.assertEqual(Revision.objects.count(), 2)
+        self.assertEqual(Benchmark.objects.get(name='int').units, 'bytes')
+        res = Result.objects.get(revision__commitid='1', benchmark__name='float')
+        self.assertEqual(res.value, 1.5)
+        self.assertEqual(res.std_dev, 0.1)
+        self.assertEqual(res.date, res.revision.date)
+
+    def test_existing_results_are_updated(self):
+        save_results([make_result_data('1', 'float', 1.5)])
+
+        response, error = save_results([
+            make_result_data('1', 'float', 2.5),
+            make_result_data('1', 'int', 3),
+        ])
+
+        self.assertFalse(error)
+        self.assertEqual(Result.objects.count(), 2)
+        self.assertEqual(
+            Result.objects.get(benchmark__name='float').value, 2.5)
+
+    def test_duplicated_items_save_last_value(self):
+        response, error = save_results([
+            make_result_data('1', 'float', 1.5),
+            make_result_data('1', 'float', 1.7),
+        ])
+
+        self.assertFalse(error)
+        self.assertEqual(Result.objects.get().value, 1.7)
+
+    def test_errors_save_nothing(self):
+        response, error = save_results([
+            make_result_data('1', 'float', 1.5),
+            make_result_data('2', 'float', 'not a number'),
+        ])
+
+        self.assertTrue(error)
+        self.assertIn('not a number', response)
+        self.assertEqual(Revision.objects.count(), 0)
+        self.assertEqual(Result.objects.count(), 0)
+
+    def test_missing_environment_is_reported(self):
+        response, error = save_results([
+            make_result_data('1', 'float', 1.5),
+            make_result_data('1', 'int', 1.5, environment='Quad Core'),
+        ])
+
+        self.assertTrue(error)
+        self.assertEqual(response, 'Environment Quad Core not found')
+        self.assertEqual(Result.objects.count(), 0)
+
+    def test_query_count_independent_of_number_of_results(self):
+        def count_queries(commitid, num_benchmarks):
+            data = [make_result_data(commitid, 'bench%d' % i, i)
+                    for i in range(num_benchmarks)]
+            with CaptureQueriesContext(connection) as queries:
+                response, error = save_results(data)
+            self.assertFalse(error)
+            return len(queries)
+
+        # Create the benchmarks first, so that only results are inserted
+        count_queries('1', 50)
+        get_metadata()
+        self.assertEqual(count_queries('2', 2), count_queries('3', 50))
+
+
+class TestRevisionLogs(TransactionTestCase):
+
+    def setUp(self):
+        Environment.objects.create(name='Dual Core')
+        Project.objects.create(name='MyProject', repo_type=Project.GIT,
+                               repo_path='/tmp/myproject')
+
+    def test_logs_are_read_before_saving(self):
+        def get_logs(rev, startrev, update=False):
+            # No transaction is kept open while the repository is read
+            self.assertFalse(connection.in_atomic_block)
+            return [{'commitid': rev.commitid, 'author': 'Alice',
+                     'date': datetime(2011, 4, 15, 10, 0, 0),
+                     'message': 'Fix', 'tag': 'v' + rev.commitid}]
+
+        with patch('codespeed.results.commits.get_logs',
+                   side_effect=get_logs) as get_logs_mock:
+            response, error = save_results([
+                make_result_data('1'),
+                make_result_data('1', 'int'),
+                make_result_data(2),
+            ])
+        self.assertFalse(error)
+        self.assertEqual(get_logs_mock.call_count, 2)
+        rev = Revision.objects.get(commitid='2')
+        self.assertEqual(rev.author, 'Alice')
+        self.assertEqual(rev.tag, 'v2')
+
+        # Only the logs of new revisions are read
+        with patch('codespeed.results.commits.get_logs',
+                   side_effect=get_logs) as get_logs_mock:
+            save_results([make_result_data('2', 'int')])
+        self.assertFalse(get_logs_mock.called)
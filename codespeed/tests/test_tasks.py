@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+import json
+
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils.six import StringIO
+from mock import patch
+
+from codespeed.models import Environment, Report, ReportJob
+from codespeed.tasks import DatabaseQueue
+from codespeed.tests.utils import make_result_data
+
+
+@override_settings(ALLOW_ANONYMOUS_POST=True,
+                   REPORT_QUEUE_BACKEND='codespeed.tasks.DatabaseQueue')
+class TestDatabaseQueue(TestCase):
+
+    def setUp(self):
+        Environment.objects.create(name='Dual Core')
+
+    def post_results(self, data):
+        response = self.client.post(reverse('add-json-results'),
+                                    {'json': json.dumps(data)})
+        self.assertEqual(response.status_code, 202)
+
+    def test_upload_queues_reports(self):
+        self.post_results([make_result_data('1', value=1.0)])
+        self.post_results([make_result_data('2', value=1.5)])
+
+        self.assertEqual(Report.objects.count(), 0)
+        self.assertEqual(ReportJob.objects.count(), 2)
+
+        out = StringIO()
+        call_command('process_reports', once=True, stdout=out)
+
+        self.assertEqual(ReportJob.objects.count(), 0)
+        self.assertEqual(Report.objects.get().revision.commitid, '2')
+        self.assertIn('Processed 2 report jobs', out.getvalue())
+
+    def test_older_revisions_do_not_depend_on_newer_ones(self):
+        self.post_results([make_result_data('1', value=1.0)])
+        self.post_results([make_result_data('2', value=1.5)])
+        self.post_results([make_result_data('3', value=1.5),
+                           make_result_data('3', 'int', 1.5)])
+
+        call_command('process_reports', once=True, stdout=StringIO())
+
+        self.assertEqual(
+            sorted(r.revision.commitid for r in Report.objects.all()),
+            ['2', '3'])
+
+    def test_jobs_are_deduplicated(self):
+        self.post_results([make_result_data('1', value=1.0)])
+        self.post_results([make_result_data('1', value=1.1)])
+        response = self.client.post(reverse('add-result'),
+                                    make_result_data('1', value=1.2))
+        self.assertEqual(response.status_code, 202)
+
+        self.assertEqual(ReportJob.objects.count(), 1)
+
+    @patch('codespeed.tasks.create_report_if_enough_data')
+    def test_failed_jobs_are_retried(self, create_report):
+        create_report.side_effect = ValueError("no results")
+        self.post_results([make_result_data('1', value=1.0)])
+
+        with override_settings(REPORT_QUEUE_RETRY_DELAY=0,
+                               REPORT_QUEUE_MAX_ATTEMPTS=2):
+            call_command('process_reports', once=True, stdout=StringIO())
+            job = ReportJob.objects.get()
+            self.assertEqual(job.attempts, 2)
+            self.assertEqual(job.error, "no results")
+            self.assertEqual(create_report.call_count, 2)
+
+            # Kept, but no longer processed
+            call_command('process_reports', once=True, stdout=StringIO())
+            self.assertEqual(create_report.call_count, 2)
+
+            # Until results are added again
+            create_report.side_effect = None
+            self.post_results([make_result_data('1', value=1.1)])
+            call_command('process_reports', once=True, stdout=StringIO())
+        self.assertEqual(create_report.call_count, 3)
+        self.assertEqual(ReportJob.objects.count(), 0)
+
+    @patch('codespeed.tasks.create_report_if_enough_data')
+    def test_failed_jobs_wait_for_the_retry_delay(self, create_report):
+        create_report.side_effect = ValueError("no results")
+        self.post_results([make_result_data('1', value=1.0)])
+
+        call_command('process_reports', once=True, stdout=StringIO())
+        call_command('process_reports', once=True, stdout=StringIO())
+        self.assertEqual(create_report.call_count, 1)
+        self.assertEqual(ReportJob.objects.get().attempts, 1)
+
+    def test_jobs_queued_while_processed_are_kept(self):
+        queue = DatabaseQueue()
+
+        def create_report(rev, exe, env):
+            # Results added by another request meanwhile
+            queue.enqueue(rev, exe, env)
+            # Still claimed, so not processed by another worker
+            self.assertEqual(DatabaseQueue().process(), 0)
+
+        self.post_results([make_result_data('1', value=1.0)])
+        with patch('codespeed.tasks.create_report_if_enough_data',
+                   side_effect=create_report):
+            self.assertEqual(queue.process(limit=1), 1)
+        job = ReportJob.objects.get()
+        self.assertIsNone(job.claimed)
+
+        self.assertEqual(queue.process(), 1)
+        self.assertEqual(ReportJob.objects.count(), 0)
+
+    def test_concurrently_created_jobs_are_queued_again(self):
+        self.post_results([make_result_data('1', value=1.0)])
+        job = ReportJob.objects.get()
+        ReportJob.objects.update(attempts=3, error="no results")
+
+        with patch.object(ReportJob.objects, 'get_or_create',
+                          side_effect=IntegrityError):
+            DatabaseQueue().enqueue(
+                job.revision, job.executable, job.environment)
+        job = ReportJob.objects.get()
+        self.assertEqual(job.attempts, 0)
+        self.assertEqual(job.error, '')
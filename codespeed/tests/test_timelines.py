@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+import base64
+import json
+import math
+import struct
+from datetime import datetime
+
+from django.db.models.deletion import Collector
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from codespeed.models import (Benchmark, Branch, Project, Result, Revision,
+                              TimelineSeries)
+from codespeed.metadata import clear_metadata
+from codespeed.results import delete_results, save_results
+from codespeed.timelines import downsample
+
+
+class TestTimelineSeries(TestCase):
+    fixtures = ["timeline_tests.json"]
+
+    def setUp(self):
+        self.path = reverse('gettimelinedata')
+        self.data = {
+            "exe": "1,2",
+            "base": "2+4",
+            "ben": "float",
+            "env": "1",
+            "revs": "10"
+        }
+
+    def get_timelines(self, **kwargs):
+        data = dict(self.data, **kwargs)
+        response = self.client.get(self.path, data)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.getvalue().decode())
+
+    def test_stored_series_match_results(self):
+        with override_settings(TIMELINE_CACHE_DEPTH=0):
+            expected = self.get_timelines()
+        self.assertEqual(TimelineSeries.objects.count(), 0)
+
+        self.assertEqual(self.get_timelines(), expected)
+        self.assertEqual(TimelineSeries.objects.count(), 2)
+        # Served from the stored series the second time
+        self.assertEqual(self.get_timelines(), expected)
+        with override_settings(TIMELINE_CACHE_DEPTH=0):
+            expected = self.get_timelines(revs="1")
+        self.assertEqual(self.get_timelines(revs="1"), expected)
+
+    def test_deeper_timelines_are_not_stored(self):
+        with override_settings(TIMELINE_CACHE_DEPTH=5):
+            timelines = self.get_timelines(revs="6")
+        self.assertEqual(len(timelines['timelines']), 1)
+        self.assertEqual(TimelineSeries.objects.count(), 0)
+
+    def test_saved_results_update_stored_series(self):
+        # Don't look for the commit logs of the fixture's repository
+        Project.objects.filter(name='MyProject').update(repo_type='N')
+        self.get_timelines()
+        save_results([{
+            'commitid': '6',
+            'branch': 'master',
+            'project': 'MyProject',
+            'executable': 'myexe O3 64bits',
+            'benchmark': 'float',
+            'environment': 'Dual Core',
+            'result_value': 1234,
+            'revision_date': datetime(2011, 4, 15, 10, 0, 0),
+        }])
+
+        timelines = self.get_timelines()
+        points = timelines['timelines'][0]['branches']['master']['1']
+        self.assertEqual(points[0][:2], ['2011/04/15 10:00:00 ', 1234.0])
+        with override_settings(TIMELINE_CACHE_DEPTH=0):
+            self.assertEqual(self.get_timelines(), timelines)
+
+    def test_revision_changes_discard_stored_series(self):
+        self.get_timelines()
+        rev = Revision.objects.get(commitid='2', branch__name='master')
+        rev.tag = 'v2'
+        rev.save()
+
+        self.assertEqual(TimelineSeries.objects.filter(
+            branch=rev.branch).count(), 0)
+        points = self.get_timelines()['timelines'][0]['branches']['master']['1']
+        self.assertIn('v2', [point[4] for point in points])
+
+    def test_edited_results_update_stored_series(self):
+        self.get_timelines()
+        res = Result.objects.filter(
+            executable=1, benchmark__name='float', branch__name='master',
+        ).latest('revision__date')
+        res.value = 12345
+        res.save()
+
+        timelines = self.get_timelines()
+        points = timelines['timelines'][0]['branches']['master']['1']
+        self.assertEqual(points[0][1], 12345.0)
+        with override_settings(TIMELINE_CACHE_DEPTH=0):
+            self.assertEqual(self.get_timelines(), timelines)
+
+        # Moved to another revision
+        res.revision = Revision.objects.create(
+            commitid='7', branch=res.branch, project=res.branch.project,
+            date=datetime(2011, 4, 15, 10, 0, 0))
+        res.save()
+        self.assertFalse(TimelineSeries.objects.filter(
+            executable=1, branch=res.branch).exists())
+
+    def test_branch_renames_discard_stored_series(self):
+        self.get_timelines()
+        branch = Branch.objects.get(name='master', project__name='MyProject')
+        stored = TimelineSeries.objects.filter(branch=branch).count()
+        self.assertGreater(stored, 0)
+        branch.display_on_comparison_page = False
+        branch.save()
+        self.assertEqual(
+            TimelineSeries.objects.filter(branch=branch).count(), stored)
+
+        branch.name = 'trunk'
+        branch.save()
+        self.assertEqual(
+            TimelineSeries.objects.filter(branch=branch).count(), 0)
+
+    def test_deleted_results_discard_stored_series(self):
+        self.get_timelines()
+        delete_results(Result.objects.filter(
+            executable=1, benchmark__name='float', branch__name='master',
+            revision__commitid='2'))
+        self.assertFalse(TimelineSeries.objects.filter(executable=1).exists())
+        self.assertTrue(TimelineSeries.objects.filter(executable=2).exists())
+
+        timelines = self.get_timelines()
+        Revision.objects.filter(commitid='5', branch__name='master').delete()
+        self.assertFalse(TimelineSeries.objects.filter(
+            branch__name='master').exists())
+        with override_settings(TIMELINE_CACHE_DEPTH=0):
+            expected = self.get_timelines()
+        self.assertNotEqual(expected, timelines)
+        self.assertEqual(self.get_timelines(), expected)
+
+    def test_results_are_deleted_in_bulk(self):
+        # No delete receivers, so that the results of a deleted revision or
+        # branch are not fetched one by one
+        self.assertTrue(Collector('default').can_fast_delete(
+            Result.objects.all()))
+
+    def test_series_are_downsampled_to_points(self):
+        full = self.get_timelines()['timelines'][0]['branches']['master']['1']
+        self.assertGreater(len(full), 2)
+
+        with override_settings(CHANGE_THRESHOLD=1000.0):
+            points = self.get_timelines(
+                points="2")['timelines'][0]['branches']['master']['1']
+        self.assertEqual(len(points), 2)
+        self.assertEqual(points[0], full[0])
+        self.assertEqual(points[-1], full[-1])
+        # Invalid budgets are ignored
+        self.assertEqual(self.get_timelines(
+            points="x")['timelines'][0]['branches']['master']['1'], full)
+
+    def test_columnar_format(self):
+        Benchmark.objects.filter(name='float').update(data_type='M')
+        # Queryset updates don't drop the snapshot of the dimension tables
+        clear_metadata()
+        expected = self.get_timelines()
+        timelines = self.get_timelines(format='columnar')
+        self.assertEqual(len(timelines['timelines']), 1)
+        timeline = timelines['timelines'][0]
+        self.assertEqual(timeline.pop('format'), 'columnar')
+        revisions = timeline.pop('revisions')
+
+        for branch, series in timeline['branches'].items():
+            for exe, columns in series.items():
+                columns = [decode_column(column) for column in columns]
+                self.assertEqual(len(columns), 5)
+                points = []
+                for i, date in enumerate(revisions['dates']):
+                    if math.isnan(columns[0][i]):
+                        continue
+                    points.append(
+                        [date] +
+                        ["" if math.isnan(column[i]) else column[i]
+                         for column in columns] +
+                        [revisions['commitids'][i], revisions['tags'][i],
+                         branch])
+                series[exe] = points
+        self.assertEqual(timelines, expected)
+
+    def test_data_type_changes_discard_stored_series(self):
+        self.get_timelines()
+        bench = Benchmark.objects.get(name='float')
+        bench.data_type = 'M'
+        bench.save()
+
+        self.assertEqual(TimelineSeries.objects.count(), 0)
+
+
+def decode_column(encoded):
+    data = base64.b64decode(encoded)
+    return struct.unpack('<%dd' % (len(data) // 8), data)
+
+
+def make_point(value, tag=''):
+    return ['2011/04/15 10:00:00 ', value, '', 'abc', tag, 'master']
+
+
+def index_of(points, point):
+    return [id(p) for p in points].index(id(point))
+
+
+@override_settings(CHANGE_THRESHOLD=50.0)
+class TestDownsample(TestCase):
+    def test_short_series_are_unchanged(self):
+        points = [make_point(value) for value in (1, 2, 3)]
+        self.assertEqual(downsample(points, 3), points)
+        self.assertEqual(downsample(points, 0), points)
+
+    @override_settings(CHANGE_THRESHOLD=500.0)
+    def test_keeps_shape(self):
+        values = [10, 10, 11, 10, 30, 10, 11, 10, 10, 9, 10, 10]
+        points = [make_point(value) for value in values]
+        sampled = downsample(points, 6)
+        self.assertEqual(len(sampled), 6)
+        self.assertEqual(sampled[0], points[0])
+        self.assertEqual(sampled[-1], points[-1])
+        # The spike is kept
+        self.assertIn(points[4], sampled)
+
+    def test_keeps_tags_and_regressions(self):
+        values = [10] * 20
+        # Newest first: the value doubles at index 10
+        values[:10] = [20] * 10
+        points = [make_point(value) for value in values]
+        points[15] = make_point(10, tag='v1.0')
+
+        sampled = downsample(points, 4)
+        self.assertIn(points[15], sampled)
+        self.assertIs(sampled[index_of(sampled, points[9]) + 1], points[10])
+        self.assertLessEqual(len(sampled), 6)
+
+        # Improvements don't have to be kept
+        sampled = downsample(points, 4, lessisbetter=False)
+        self.assertEqual(len(sampled), 4)
+        self.assertIn(points[15], sampled)
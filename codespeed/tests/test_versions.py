@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from django.utils.http import http_date
+
+from codespeed.models import Benchmark, DataVersion, Project, Result
+from codespeed.results import delete_results, save_results
+from codespeed.tests.utils import make_result_data
+from codespeed.versions import get_data_version
+
+
+class TestDataVersions(TestCase):
+    fixtures = ["timeline_tests.json"]
+
+    def setUp(self):
+        cache.clear()
+        Project.objects.update(repo_type='N')
+        DataVersion.objects.all().delete()
+        self.timeline = (reverse('gettimelinedata'), {
+            'exe': '1', 'ben': 'float', 'env': '1', 'revs': '2'})
+
+    def versions(self):
+        return dict(DataVersion.objects.values_list('project_id', 'version'))
+
+    def test_save_results_bumps_versions(self):
+        save_results([make_result_data('new', project='MyProject',
+                                       executable='myexe O3 64bits',
+                                       branch='master')])
+        first = self.versions()
+        self.assertEqual(sorted(first, key=str), [1, None])
+
+        save_results([make_result_data('new', project='Other',
+                                       executable='exe')])
+        second = self.versions()
+        self.assertGreater(second[None], first[None])
+        self.assertEqual(second[1], first[1])
+        self.assertIn(2, second)
+
+        # Benchmarks are shared by all projects
+        Benchmark.objects.get(name='float').save()
+        third = self.versions()
+        for project_id in second:
+            self.assertEqual(third[project_id], second[project_id] + 1)
+
+    def test_unchanged_timeline(self):
+        path, data = self.timeline
+        response = self.client.get(path, data)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+        etag = response['ETag']
+
+        # Only the executables and the data versions are read
+        with self.assertNumQueries(2):
+            response = self.client.get(path, data, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Other parameters are another resource
+        response = self.client.get(path, dict(data, revs='3'),
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        # Results of other projects don't change the timeline
+        save_results([make_result_data('new', project='Other',
+                                       executable='exe')])
+        response = self.client.get(path, data, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        save_results([make_result_data('new', project='MyProject',
+                                       executable='myexe O3 64bits',
+                                       branch='master')])
+        response = self.client.get(path, data, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_comparison_last_modified(self):
+        save_results([make_result_data('new', project='Other',
+                                       executable='exe')])
+        path = reverse('getcomparisondata')
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Last-Modified'],
+                         http_date(get_data_version()[1].timestamp()))
+
+        response = self.client.get(
+            path, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_deleted_projects(self):
+        save_results([make_result_data('new', project='Other',
+                                       executable='exe')])
+        global_version = self.versions()[None]
+
+        # Along with their branches, revisions and results
+        Project.objects.get(name='Other').delete()
+        self.assertFalse(Project.objects.filter(name='Other').exists())
+        # Its version would break the foreign key constraint on commit
+        versions = self.versions()
+        self.assertEqual(list(versions), [None])
+        self.assertGreater(versions[None], global_version)
+
+        Project.objects.create(name='Empty').delete()
+        self.assertGreater(self.versions()[None], versions[None])
+
+    def test_deleted_results(self):
+        save_results([make_result_data('new', project='Other',
+                                       executable='exe')])
+        first = self.versions()
+
+        delete_results(Result.objects.filter(revision__commitid='new'))
+        self.assertFalse(Result.objects.filter(
+            revision__commitid='new').exists())
+        second = self.versions()
+        self.assertEqual(second[2], first[2] + 1)
+        self.assertEqual(second[None], first[None] + 1)
@@ -2,12 +2,16 @@
 from datetime import datetime, timedelta
 import copy
 import json
+import threading
+import time
 
-from django.test import TestCase, override_settings
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
+from mock import patch
 
 from codespeed.models import (Project, Benchmark, Revision, Branch, Executable,
                               Environment, Result, Report)
+from codespeed.views import get_timeline_for_benchmark
 
 
 @override_settings(ALLOW_ANONYMOUS_POST=True)
@@ -261,6 +265,20 @@ class TestAddJSONResults(TestCase):
         )
         self.assertTrue(res.value, 458)
 
+    def test_add_integer_commitid_twice(self):
+        """Should match the saved revision when commitid is not a string"""
+        for item in self.data:
+            item['commitid'] = int(item['commitid'])
+        for value in (456, 500):
+            self.data[0]['result_value'] = value
+            response = self.client.post(self.path,
+                                        {'json': json.dumps(self.data)})
+            self.assertEquals(response.status_code, 202)
+
+        self.assertEquals(Revision.objects.count(), 3)
+        self.assertEquals(
+            Result.objects.get(revision__commitid='123').value, 500)
+
     def test_bad_environment(self):
         """Add result associated with non-existing environment.
            Only change one item in the list.
@@ -339,6 +357,14 @@ class TestTimeline(TestCase):
         self.assertEquals(response.status_code, 200)
         responsedata = response.content.decode()
         self.assertIn('My Own Title\n: Timeline', responsedata)
+        self.assertIn('downsample: false', responsedata)
+        self.assertIn('columnar: false', responsedata)
+
+        with override_settings(TIMELINE_DOWNSAMPLE=True,
+                               TIMELINE_COLUMNAR=True):
+            response = self.client.get(path)
+        self.assertIn('downsample: true', response.content.decode())
+        self.assertIn('columnar: true', response.content.decode())
 
     def test_gettimelinedata(self):
         """Test that gettimelinedata returns correct timeline data
@@ -375,6 +401,90 @@ class TestTimeline(TestCase):
             responsedata['timelines'][0]['branches']['master']['1'][1],
             [u'2011/04/13 17:04:22 ', 2000.0, 1.11111, u'2', u'', u'master'])
 
+    @patch('codespeed.views.get_timeline_for_benchmark')
+    def test_grid_pages_with_workers(self, get_timeline):
+        for i in range(6):
+            Benchmark.objects.create(name='bench%d' % i)
+        names = list(Benchmark.objects.order_by(
+            'name').values_list('name', flat=True))
+
+        def timeline(baseline_exe, baseline_rev, bench, *args):
+            if bench.name == 'bench1':
+                return ""
+            # The first benchmarks of a page are the slowest
+            time.sleep(0.01 * (len(names) - names.index(bench.name)))
+            return json.dumps({'benchmark': bench.name})
+        get_timeline.side_effect = timeline
+
+        def get_pages():
+            pages = []
+            data = {"exe": "1,2", "ben": "grid", "env": "1"}
+            while True:
+                response = self.client.get(reverse('gettimelinedata'), data)
+                page = json.loads(response.getvalue().decode())
+                pages.append((page['timelines'], page['nextBenchmarks']))
+                if page['nextBenchmarks'] is False:
+                    return pages
+                data['nextBenchmarks'] = page['nextBenchmarks']
+
+        with override_settings(TIMELINE_GRID_PAGING=3):
+            expected = get_pages()
+            with override_settings(TIMELINE_FETCH_WORKERS=3):
+                self.assertEqual(get_pages(), expected)
+        sent = [timeline['benchmark'] for timelines, _ in expected
+                for timeline in timelines]
+        self.assertEqual(sent, [name for name in names if name != 'bench1'])
+        self.assertEqual(len(expected[0][0]), 3)
+
+
+class TestTimelineWorkers(TransactionTestCase):
+    """The workers use their own database connections, which only see
+    committed data"""
+    fixtures = ["timeline_tests.json"]
+
+    def get_pages(self):
+        pages = []
+        data = {"exe": "1,2", "base": "2+4", "ben": "grid", "env": "1"}
+        while True:
+            response = self.client.get(reverse('gettimelinedata'), data)
+            self.assertEqual(response.status_code, 200)
+            page = json.loads(response.getvalue().decode())
+            pages.append(page)
+            if page['nextBenchmarks'] is False:
+                return pages
+            data['nextBenchmarks'] = page['nextBenchmarks']
+
+    @override_settings(TIMELINE_GRID_PAGING=2)
+    def test_grid_pages_with_workers(self):
+        bench = Benchmark.objects.get(name='float')
+        for i in range(3):
+            other = Benchmark.objects.create(name='float%d' % i)
+            for res in bench.results.all():
+                res.pk = None
+                res.benchmark = other
+                res.value += i
+                res.save()
+
+        threads = set()
+
+        def record_thread(*args):
+            threads.add(threading.current_thread())
+            return get_timeline_for_benchmark(*args)
+
+        # The workers build the stored series the first time
+        with override_settings(TIMELINE_FETCH_WORKERS=3):
+            with patch('codespeed.views.get_timeline_for_benchmark',
+                       side_effect=record_thread):
+                pages = self.get_pages()
+            self.assertEqual(self.get_pages(), pages)
+        self.assertNotIn(threading.current_thread(), threads)
+        self.assertEqual(
+            [timeline['benchmark'] for page in pages
+             for timeline in page['timelines']],
+            ['float', 'float0', 'float1', 'float2'])
+        with override_settings(TIMELINE_CACHE_DEPTH=0):
+            self.assertEqual(self.get_pages(), pages)
+
 
 @override_settings(ALLOW_ANONYMOUS_POST=True)
 class TestReports(TestCase):
@@ -413,6 +523,59 @@ class TestReports(TestCase):
         self.assertEqual(response.status_code, 405)
 
 
+@override_settings(CHANGES_LOGS_PER_PAGE=2)
+@patch('codespeed.commits.git.getlogs')
+class TestDisplayLogs(TestCase):
+
+    def setUp(self):
+        project = Project.objects.create(name='project', repo_path='path',
+                                         repo_type=Project.GIT)
+        branch = Branch.objects.create(name='default', project=project)
+        Revision.objects.create(commitid='id0', branch=branch,
+                                date=datetime.now() - timedelta(days=1))
+        self.rev = Revision.objects.create(commitid='id5', branch=branch,
+                                           date=datetime.now())
+        self.logs = [{
+            'date': '2020-03-06 04:14:41', 'message': 'message %d' % i,
+            'commitid': 'id%d' % i, 'short_commit_id': 'id%d' % i,
+            'author': 'author', 'author_email': '', 'body': '', 'tag': '',
+        } for i in range(5, 0, -1)]
+
+    def get_page(self, page):
+        return self.client.get(reverse('displaylogs'), {
+            'revisionid': self.rev.id, 'page': page}).content.decode()
+
+    def test_pages(self, getlogs):
+        getlogs.side_effect = lambda rev, startrev, limit, offset: (
+            self.logs[offset:offset + limit])
+
+        content = self.get_page(1)
+        self.assertIn('message 5', content)
+        self.assertIn('message 4', content)
+        self.assertNotIn('message 3', content)
+        self.assertIn('data-page="2"', content)
+        getlogs.assert_called_with(self.rev, Revision.objects.get(
+            commitid='id0'), limit=3, offset=0)
+
+        content = self.get_page(3)
+        self.assertIn('message 1', content)
+        self.assertNotIn('data-page', content)
+
+        self.assertNotIn('No logs found', self.get_page(4))
+
+    def test_long_ranges_are_stored(self, getlogs):
+        getlogs.side_effect = lambda rev, startrev, limit, offset: (
+            self.logs[offset:offset + limit])
+
+        for page in (1, 2, 3):
+            self.get_page(page)
+        self.assertEqual(getlogs.call_count, 3)
+        # The whole range is read from the database afterwards
+        self.assertIn('message 5', self.get_page(1))
+        self.assertIn('message 1', self.get_page(3))
+        self.assertEqual(getlogs.call_count, 3)
+
+
 class TestFeeds(TestCase):
 
     def test_latest_result_feed(self):
@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
+from django.db import connection
 from django.test import TestCase
 from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 
 from codespeed.models import Project, Executable, Branch, Revision
 from codespeed.views import getbaselineexecutables
 from codespeed.views import getcomparisonexes
+from codespeed.views_data import get_baseline_catalog
 from codespeed.views_data import get_sanitized_executable_name_for_timeline_view
 from codespeed.views_data import get_sanitized_executable_name_for_comparison_view
 
@@ -43,6 +46,33 @@ class TestGetBaselineExecutables(TestCase):
         result = getbaselineexecutables()
         self.assertEqual(len(result), 3)
 
+    def test_catalog_is_read_again_for_changed_projects(self):
+        revision = Revision.objects.create(commitid='1', tag='0.1',
+                                           branch=self.branch)
+        other = Project.objects.create(name='Other')
+        other_branch = Branch.objects.create(name='master', project=other)
+        Executable.objects.create(name='OtherExecutable', project=other)
+        Revision.objects.create(commitid='1', tag='1.0', branch=other_branch)
+        self.assertEqual(len(getbaselineexecutables()), 3)
+
+        # Data versions of the dimension tables and the projects
+        with self.assertNumQueries(2):
+            result = getbaselineexecutables()
+        self.assertEqual([base['key'] for base in result[1:]],
+                         [base['key'] for base in get_baseline_catalog(
+                         )[self.project.id] + get_baseline_catalog()[other.id]])
+
+        revision.tag = '0.1.1'
+        revision.save()
+        with CaptureQueriesContext(connection) as queries:
+            result = getbaselineexecutables()
+        self.assertEqual(result[1]['name'], 'TestExecutable 0.1.1')
+        # Only the tagged revisions of the changed project are read again
+        revision_queries = [query['sql'] for query in queries
+                            if 'codespeed_revision' in query['sql']]
+        self.assertEqual(len(revision_queries), 1)
+        self.assertIn('IN (%d)' % self.project.id, revision_queries[0])
+
 
 class TestGetComparisonExes(TestCase):
     def setUp(self):
@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+
+
+def make_result_data(commitid, benchmark='float', value=1.0, **kwargs):
+    """Returns the data of a result as it is uploaded, for the
+    environment named 'Dual Core'"""
+    data = {
+        'commitid': commitid,
+        'branch': 'default',
+        'project': 'MyProject',
+        'executable': 'myexe',
+        'benchmark': benchmark,
+        'environment': 'Dual Core',
+        'result_value': value,
+    }
+    data.update(kwargs)
+    return data
@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+"""Precomputed timeline series
+
+The points of a timeline plot only change when results are added, so the
+newest points of every (benchmark, environment, executable, branch) series
+are stored already serialized in TimelineSeries rows. Rows are built the
+first time a series is requested, and kept up to date by save_results and
+by the receivers of the model signals below.
+
+Long series can be downsampled to a number of points, see downsample, and
+sent in a compact columnar format, see to_columnar.
+"""
+from __future__ import absolute_import
+
+import base64
+import struct
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models.signals import pre_save, post_save, pre_delete
+from django.dispatch import receiver
+
+from .models import Benchmark, Branch, Revision, Result, TimelineSeries
+from .views_data import get_stats_with_defaults
+
+
+def get_series_depth():
+    """Number of points stored per series. 0 disables the stored series"""
+    return getattr(settings, 'TIMELINE_CACHE_DEPTH', 1000)
+
+
+def serialize_result(res, bench, branch):
+    """Returns the point sent to the timeline plots for a result"""
+    if bench.data_type == 'M':
+        q1, q3, val_max, val_min = get_stats_with_defaults(res)
+        return [
+            res.revision.date.strftime('%Y/%m/%d %H:%M:%S %z'),
+            res.value, val_max, q3, q1, val_min,
+            res.revision.get_short_commitid(), res.revision.tag, branch.name
+        ]
+    else:
+        std_dev = ""
+        if res.std_dev is not None:
+            std_dev = res.std_dev
+        return [
+            res.revision.date.strftime('%Y/%m/%d %H:%M:%S %z'),
+            res.value, std_dev,
+            res.revision.get_short_commitid(), res.revision.tag, branch.name
+        ]
+
+
+def _make_entry(res, bench, branch):
+    # Entries keep the revision, to replace the point when a result is
+    # updated, and a sortable date, to insert new points in place
+    return [res.revision_id, res.revision.date.isoformat(),
+            serialize_result(res, bench, branch)]
+
+
+def _query_entries(bench, environment, executable, branch, number_of_revs):
+    resultquery = Result.objects.filter(
+        benchmark=bench
+    ).filter(
+        environment=environment
+    ).filter(
+        executable=executable
+    ).filter(
+        branch=branch
+    ).select_related(
+        "revision"
+    ).order_by('-revision__date')[:number_of_revs]
+    return [_make_entry(res, bench, branch) for res in resultquery]
+
+
+def get_timeline_series(benchmarks, environment, executables, branches,
+                        number_of_revs):
+    """Returns the newest points of the timeline series
+
+    :return: a dict of point lists, newest first, keyed by
+             (benchmark id, executable id, branch id). Only executables of
+             the branch's project are considered, and series without
+             results are left out.
+    """
+    keys = []
+    for bench in benchmarks:
+        for branch in branches:
+            for executable in executables:
+                if executable.project_id == branch.project_id:
+                    keys.append((bench, executable, branch))
+
+    depth = get_series_depth()
+    if number_of_revs > depth:
+        # Deeper than stored, query the results directly
+        series = {}
+        for bench, executable, branch in keys:
+            entries = _query_entries(
+                bench, environment, executable, branch, number_of_revs)
+            if entries:
+                series[(bench.id, executable.id, branch.id)] = [
+                    entry[2] for entry in entries]
+        return series
+
+    stored = {}
+    if keys:
+        for row in TimelineSeries.objects.filter(
+                benchmark__in=set(key[0].id for key in keys),
+                environment=environment,
+                executable__in=set(key[1].id for key in keys),
+                branch__in=set(key[2].id for key in keys)):
+            stored[(row.benchmark_id, row.executable_id, row.branch_id)] = \
+                row.get_entries()
+
+    new_rows = []
+    for bench, executable, branch in keys:
+        key = (bench.id, executable.id, branch.id)
+        if key not in stored:
+            stored[key] = _query_entries(
+                bench, environment, executable, branch, depth)
+            row = TimelineSeries(benchmark=bench, environment=environment,
+                                 executable=executable, branch=branch)
+            row.set_entries(stored[key])
+            new_rows.append(row)
+    if new_rows:
+        try:
+            with transaction.atomic():
+                TimelineSeries.objects.bulk_create(new_rows)
+        except IntegrityError:
+            # Built concurrently by another request
+            pass
+
+    series = {}
+    for key, entries in stored.items():
+        if entries:
+            series[key] = [entry[2] for entry in entries[:number_of_revs]]
+    return series
+
+
+def _get_change_threshold():
+    threshold = getattr(settings, 'CHANGE_THRESHOLD', None)
+    return 3.0 if threshold is None else threshold
+
+
+def _is_regression(point, previous, lessisbetter, threshold):
+    if not previous[1]:
+        return False
+    change = (point[1] - previous[1]) * 100.0 / previous[1]
+    if lessisbetter:
+        return change > threshold
+    return change < -threshold
+
+
+def _largest_triangles(values, threshold):
+    """Returns the indexes of the values selected by the
+    largest-triangle-three-buckets algorithm
+
+    The first and last values are always selected. The others are split in
+    threshold - 2 buckets, and the value of each bucket that forms the
+    largest triangle with the value selected in the previous bucket and the
+    average of the next bucket is selected.
+    """
+    length = len(values)
+    if threshold >= length:
+        return set(range(length))
+    if threshold < 3:
+        return set([0, length - 1])
+
+    selected = [0]
+    every = float(length - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, length)
+        avg_x = (avg_start + avg_end - 1) / 2.0
+        avg_y = sum(values[avg_start:avg_end]) / float(avg_end - avg_start)
+
+        best, best_area = None, -1
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            area = abs((a - avg_x) * (values[j] - values[a]) -
+                       (a - j) * (avg_y - values[a]))
+            if area > best_area:
+                best, best_area = j, area
+        selected.append(best)
+        a = best
+    selected.append(length - 1)
+    return set(selected)
+
+
+def downsample(points, budget, lessisbetter=True):
+    """Reduces the points of a timeline series, newest first, to about
+    budget points
+
+    The points are selected by largest-triangle-three-buckets, spaced by
+    revision, which keeps the shape of the series, including its spikes.
+    The points of tagged revisions and those of regressions larger than
+    CHANGE_THRESHOLD, along with the point before them, are always kept,
+    even when there are more of them than budget.
+    """
+    length = len(points)
+    if not budget or length <= budget:
+        return points
+
+    threshold = _get_change_threshold()
+    kept = set([0, length - 1])
+    for i, point in enumerate(points):
+        # The tag is the next to last field of both point formats
+        if point[-2]:
+            kept.add(i)
+        if i + 1 < length and _is_regression(
+                point, points[i + 1], lessisbetter, threshold):
+            kept.update([i, i + 1])
+
+    selected = _largest_triangles([point[1] for point in points],
+                                  budget - len(kept) + 2)
+    return [points[i] for i in sorted(kept | selected)]
+
+
+def _pack(column):
+    return base64.b64encode(
+        struct.pack('<%dd' % len(column), *column)).decode('ascii')
+
+
+def to_columnar(timeline):
+    """Replaces the point lists of a timeline by a columnar encoding
+
+    The dates, commit ids and tags of the revisions of all the series are
+    sent once, newest first, in timeline['revisions']. Each series becomes
+    a list of columns, one per numeric field of its points (value, then
+    std_dev or max, q3, q1 and min), aligned with the revisions. Columns
+    are little-endian float64 arrays encoded in base64, as read by a
+    Float64Array, where NaN marks a missing point or field.
+    """
+    nan = float('nan')
+    axis = set()
+    for series in timeline['branches'].values():
+        for points in series.values():
+            axis.update((point[0], point[-3], point[-2]) for point in points)
+    axis = sorted(axis, reverse=True)
+    positions = dict((key, i) for i, key in enumerate(axis))
+
+    for series in timeline['branches'].values():
+        for exe, points in series.items():
+            # Numeric fields are between the date and the commit id, tag
+            # and branch name
+            columns = [[nan] * len(axis) for _ in range(len(points[0]) - 4)]
+            for point in points:
+                i = positions[(point[0], point[-3], point[-2])]
+                for column, value in zip(columns, point[1:-3]):
+                    if value != "":
+                        column[i] = value
+            series[exe] = [_pack(column) for column in columns]
+
+    timeline['format'] = 'columnar'
+    timeline['revisions'] = {
+        'dates': [key[0] for key in axis],
+        'commitids': [key[1] for key in axis],
+        'tags': [key[2] for key in axis],
+    }
+    return timeline
+
+
+def update_timeline_series(result_keys):
+    """Adds saved results to the stored series that contain them
+
+    :param result_keys: (revision id, executable id, benchmark id,
+                        environment id) tuples of the saved results
+    """
+    depth = get_series_depth()
+    if not result_keys or not depth:
+        return
+    result_keys = set(result_keys)
+
+    results = {}
+    for res in Result.objects.filter(
+            revision__in=set(key[0] for key in result_keys),
+            executable__in=set(key[1] for key in result_keys),
+            benchmark__in=set(key[2] for key in result_keys),
+            environment__in=set(key[3] for key in result_keys),
+    ).select_related('revision', 'branch', 'benchmark'):
+        key = (res.revision_id, res.executable_id, res.benchmark_id,
+               res.environment_id)
+        if key in result_keys:
+            series_key = (res.benchmark_id, res.environment_id,
+                          res.executable_id, res.branch_id)
+            results.setdefault(series_key, []).append(res)
+    if not results:
+        return
+
+    rows = TimelineSeries.objects.filter(
+        benchmark__in=set(key[0] for key in results),
+        environment__in=set(key[1] for key in results),
+        executable__in=set(key[2] for key in results),
+        branch__in=set(key[3] for key in results))
+    updated = []
+    for row in rows:
+        key = (row.benchmark_id, row.environment_id, row.executable_id,
+               row.branch_id)
+        if key not in results:
+            continue
+        entries = row.get_entries()
+        for res in results[key]:
+            entry = _make_entry(res, res.benchmark, res.branch)
+            entries = [e for e in entries if e[0] != entry[0]]
+            position = 0
+            while position < len(entries) and entries[position][1] > entry[1]:
+                position += 1
+            entries.insert(position, entry)
+        row.set_entries(entries[:depth])
+        updated.append(row)
+
+    for row in updated:
+        row.save(update_fields=['_entries'])
+
+
+def discard_timeline_series(results):
+    """Deletes the stored series that contain a queryset of results"""
+    for benchmark, environment, executable, branch in results.values_list(
+            'benchmark', 'environment', 'executable', 'branch').distinct():
+        TimelineSeries.objects.filter(
+            benchmark=benchmark,
+            environment=environment,
+            executable=executable,
+            branch=branch,
+        ).delete()
+
+
+@receiver(pre_save, sender=Revision)
+def revision_changed(sender, instance, raw=False, **kwargs):
+    """Stored points include the revision date and tag"""
+    if raw or instance.pk is None:
+        return
+    try:
+        old = Revision.objects.get(pk=instance.pk)
+    except Revision.DoesNotExist:
+        return
+    if (old.date != instance.date or old.tag != instance.tag or
+            old.commitid != instance.commitid):
+        TimelineSeries.objects.filter(branch=old.branch_id).delete()
+
+
+@receiver(pre_save, sender=Benchmark)
+def benchmark_changed(sender, instance, raw=False, **kwargs):
+    """The data type of a benchmark determines the format of its points"""
+    if raw or instance.pk is None:
+        return
+    TimelineSeries.objects.filter(
+        benchmark=instance.pk
+    ).exclude(benchmark__data_type=instance.data_type).delete()
+
+
+@receiver(pre_save, sender=Branch)
+def branch_changed(sender, instance, raw=False, **kwargs):
+    """Stored points include the branch name"""
+    if raw or instance.pk is None:
+        return
+    TimelineSeries.objects.filter(
+        branch=instance.pk
+    ).exclude(branch__name=instance.name).delete()
+
+
+@receiver(pre_save, sender=Result)
+def result_changed(sender, instance, raw=False, update_fields=None, **kwargs):
+    """A result moved to another revision or series is removed from the
+    series that contains it"""
+    # Results saved field by field are updated in bulk by save_results,
+    # which updates the stored series itself
+    if raw or update_fields is not None or instance.pk is None:
+        return
+    fields = ('revision', 'benchmark', 'environment', 'executable', 'branch')
+    old = Result.objects.filter(pk=instance.pk).values_list(*fields).first()
+    if old is not None and old != tuple(
+            getattr(instance, field + '_id') for field in fields):
+        TimelineSeries.objects.filter(
+            benchmark=old[1],
+            environment=old[2],
+            executable=old[3],
+            branch=old[4],
+        ).delete()
+
+
+@receiver(post_save, sender=Result)
+def result_saved(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or update_fields is not None:
+        return
+    update_timeline_series([(instance.revision_id, instance.executable_id,
+                             instance.benchmark_id, instance.environment_id)])
+
+
+@receiver(pre_delete, sender=Revision)
+def revision_deleted(sender, instance, **kwargs):
+    """Results have no delete receivers, so that they are deleted in a
+    single query along with their revision"""
+    TimelineSeries.objects.filter(branch=instance.branch_id).delete()
@@ -18,6 +18,7 @@ urlpatterns = [
 urlpatterns += [
     url(r'^historical/json/$', views.gethistoricaldata, name='gethistoricaldata'),
     url(r'^reports/$', views.reports, name='reports'),
+    url(r'^regressions/$', views.regressions, name='regressions'),
     url(r'^changes/$', views.changes, name='changes'),
     url(r'^changes/table/$', views.getchangestable, name='getchangestable'),
     url(r'^changes/logs/$', views.displaylogs, name='displaylogs'),
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""Versions of the benchmark data, for conditional requests
+
+A global version, and one per project, are bumped whenever results or their
+metadata change. The JSON endpoints derive their ETag and Last-Modified
+headers from them, so that a client polling for unchanged data gets a 304
+response without any query on the results.
+"""
+from __future__ import absolute_import
+
+import hashlib
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.db.models.signals import post_save, pre_delete
+from django.utils import timezone
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+
+from .models import (DataVersion, Project, Branch, Revision, Executable,
+                     Benchmark, Environment, Result, Report)
+
+ALL_PROJECTS = None
+
+# The dimension tables, see metadata.py
+METADATA_MODELS = (Project, Branch, Executable, Benchmark, Environment)
+
+
+def bump_data_versions(project_ids, metadata=False):
+    """Bumps the global data version and those of the given projects
+
+    ALL_PROJECTS in project_ids bumps the versions of every project.
+    metadata also bumps the version of the dimension tables, for changes of
+    projects, branches, executables, benchmarks or environments.
+    """
+    project_ids = set(project_ids)
+    now = timezone.now()
+    versions = DataVersion.objects.all()
+    if ALL_PROJECTS not in project_ids:
+        versions = versions.filter(
+            Q(project__isnull=True) | Q(project__in=project_ids))
+    fields = dict(version=F('version') + 1, modified=now)
+    if metadata:
+        # Only read from the global version
+        fields['metadata_version'] = F('metadata_version') + 1
+    updated = versions.update(**fields)
+
+    if ALL_PROJECTS in project_ids:
+        project_ids = set()
+    if updated < len(project_ids) + 1:
+        existing = set(DataVersion.objects.filter(
+            Q(project__isnull=True) | Q(project__in=project_ids)
+        ).values_list('project_id', flat=True))
+        for project_id in (project_ids | set([None])) - existing:
+            try:
+                with transaction.atomic():
+                    DataVersion.objects.create(
+                        project_id=project_id, version=1,
+                        metadata_version=1 if metadata else 0,
+                        modified=now)
+            except IntegrityError:
+                # Created concurrently, or the project was just deleted
+                pass
+
+
+def get_data_version(project_ids=None):
+    """Returns a string identifying the version of the data of the given
+    projects, or of all the data, and the time it was last modified"""
+    if project_ids is None:
+        versions = DataVersion.objects.filter(project__isnull=True)
+    else:
+        versions = DataVersion.objects.filter(project__in=project_ids)
+    versions = list(versions.order_by('project_id').values_list(
+        'project_id', 'version', 'modified'))
+    version = ",".join("%s:%d" % (project_id, version)
+                       for project_id, version, _ in versions)
+    modified = max([modified for _, _, modified in versions] or [None])
+    return version, modified
+
+
+def get_metadata_version():
+    """Returns the version of the dimension tables"""
+    return DataVersion.objects.filter(project__isnull=True).values_list(
+        'metadata_version', flat=True).first() or 0
+
+
+def data_version_condition(get_project_ids=None):
+    """Decorates a view returning data from the database with ETag and
+    Last-Modified headers, answering unchanged requests with a 304
+
+    get_project_ids takes the request and returns the ids of the projects
+    the response depends on. By default, it depends on all the data.
+    """
+    def get_version(request):
+        if not hasattr(request, '_data_version'):
+            project_ids = None
+            if get_project_ids is not None:
+                project_ids = get_project_ids(request)
+            request._data_version = get_data_version(project_ids)
+        return request._data_version
+
+    def etag_func(request, *args, **kwargs):
+        version = "%s %s" % (get_version(request)[0], request.get_full_path())
+        return hashlib.sha1(version.encode('utf-8')).hexdigest()
+
+    def last_modified_func(request, *args, **kwargs):
+        modified = get_version(request)[1]
+        if modified is not None and timezone.is_naive(modified):
+            # Taken as UTC otherwise
+            modified = timezone.make_aware(modified)
+        return modified
+
+    def decorator(view):
+        # no-cache: browsers keep the response, but revalidate it each time
+        return cache_control(no_cache=True)(
+            condition(etag_func, last_modified_func)(view))
+    return decorator
+
+
+def _project_ids(instance):
+    if isinstance(instance, Project):
+        return [instance.pk]
+    elif isinstance(instance, (Branch, Executable)):
+        return [instance.project_id]
+    elif isinstance(instance, Revision):
+        return [instance.branch.project_id]
+    elif isinstance(instance, (Result, Report)):
+        return [instance.executable.project_id]
+    return [ALL_PROJECTS]
+
+
+def _saved(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Results saved field by field are updated in bulk by save_results,
+    # which bumps the versions itself
+    if raw or (sender is Result and update_fields is not None):
+        return
+    bump_data_versions(_project_ids(instance),
+                       metadata=sender in METADATA_MODELS)
+
+
+def _deleted(sender, instance, **kwargs):
+    # Bumped before anything is deleted: when a project is deleted, the
+    # versions created here for it are then deleted along with it, and the
+    # project of the deleted objects can still be read
+    bump_data_versions(_project_ids(instance),
+                       metadata=sender in METADATA_MODELS)
+
+
+# Results inserted in bulk by save_results send no signals, it bumps the
+# versions itself
+for model in (Project, Branch, Revision, Executable, Benchmark, Environment,
+              Result, Report):
+    post_save.connect(_saved, sender=model,
+                      dispatch_uid='versions_%s_saved' % model.__name__)
+
+# Results have no delete receivers, so that they are deleted in a single
+# query along with their revision, branch or project, whose receivers bump
+# the versions. delete_results bumps them for results deleted on their own
+for model in (Project, Branch, Revision, Executable, Benchmark, Environment,
+              Report):
+    pre_delete.connect(_deleted, sender=model,
+                       dispatch_uid='versions_%s_deleted' % model.__name__)
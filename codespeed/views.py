@@ -3,30 +3,38 @@ from __future__ import absolute_import, unicode_literals
 
 import json
 import logging
+from multiprocessing.pool import ThreadPool
 
 import django
 from django.conf import settings
 from django.urls import reverse
 from django.core.exceptions import ValidationError, ObjectDoesNotExist
 from django.http import HttpResponse, Http404, HttpResponseBadRequest, \
-    HttpResponseNotFound, StreamingHttpResponse
-from django.db.models import F
+    HttpResponseNotFound, HttpResponseNotModified, StreamingHttpResponse
+from django.db import connections
+from django.db.models import Q
 from django.shortcuts import get_object_or_404, render_to_response
+from django.utils.http import parse_etags, quote_etag
 from django.views.decorators.http import require_GET, require_POST
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic.base import TemplateView
 
 from .auth import basic_auth_required
 from .models import (Environment, Report, Project, Revision, Result,
-                     Executable, Benchmark, Branch)
+                     Executable, Benchmark, Branch, ChangePoint, CHANGES_TRENDS)
 from .views_data import (get_default_environment, getbaselineexecutables,
                          getdefaultexecutable, getcomparisonexes,
-                         get_benchmark_results, get_num_revs_and_benchmarks,
-                         get_stats_with_defaults)
-from .results import save_result, create_report_if_enough_data
+                         get_benchmark_results, get_num_revs_and_benchmarks)
+from .results import (save_result, save_results,
+                      create_report_if_enough_data)
+from .comparison import get_comparison_data
+from .tasks import enqueue_report
+from .timelines import get_timeline_series, downsample, to_columnar
 from . import commits
 from .validators import validate_results_request
-from .images import gen_image_from_results
+from .versions import data_version_condition
+from .metadata import get_metadata
+from .images import get_plot_data, get_plot_etag, get_cached_image
 
 logger = logging.getLogger(__name__)
 
@@ -82,7 +90,18 @@ class HomeView(TemplateView):
         return context
 
 
+def _get_executables_project_ids(request):
+    """Projects of the executables selected by the exe and base parameters
+    of a data request"""
+    exe_ids = request.GET.get('exe', '').split(',')
+    exe_ids.append(request.GET.get('base', '').split('+')[0])
+    executables = get_metadata().executables_by_id
+    return list(set(executables[int(i)].project_id for i in exe_ids
+                    if i.isdigit() and int(i) in executables))
+
+
 @require_GET
+@data_version_condition()
 def gethistoricaldata(request):
     data = {'results': {}, 'benchmarks': []}
     env = Environment.objects.all()
@@ -160,34 +179,9 @@ def gethistoricaldata(request):
 
 
 @require_GET
+@data_version_condition()
 def getcomparisondata(request):
-    executables, exekeys = getcomparisonexes()
-    benchmarks = Benchmark.objects.all()
-    environments = Environment.objects.all()
-
-    compdata = {}
-    compdata['error'] = "Unknown error"
-    for proj in executables:
-        for exe in executables[proj]:
-            compdata[exe['key']] = {}
-            for env in environments:
-                compdata[exe['key']][env.id] = {}
-
-                # Load all results for this env/executable/revision in a
-                # dict for fast lookup
-                results = dict(Result.objects.filter(
-                    environment=env,
-                    executable=exe['executable'],
-                    revision=exe['revision'],
-                ).values_list('benchmark', 'value'))
-
-                for bench in benchmarks:
-                    compdata[exe['key']][env.id][bench.id] = results.get(
-                        bench.id, None)
-
-    compdata['error'] = "None"
-
-    return HttpResponse(json.dumps(compdata))
+    return HttpResponse(json.dumps(get_comparison_data()))
 
 
 @require_GET
@@ -293,7 +287,6 @@ def comparison(request):
     elif (len(exekeys) > 1 and hasattr(settings, 'NORMALIZATION') and
             settings.NORMALIZATION):
         try:
-            # TODO: Avoid calling twice getbaselineexecutables
             selectedbaseline = getbaselineexecutables()[1]['key']
             # Uncheck exe used for normalization
             try:
@@ -331,10 +324,12 @@ def get_setting(name, default = None):
 
 
 @require_GET
+@data_version_condition(_get_executables_project_ids)
 def gettimelinedata(request):
     data = request.GET
 
     timeline_list = {'error': 'None', 'timelines': []}
+    metadata = get_metadata()
 
     executable_ids = data.get('exe', '').split(',')
 
@@ -342,17 +337,17 @@ def gettimelinedata(request):
     for i in executable_ids:
         if not i:
             continue
-        try:
-            executables.append(Executable.objects.get(id=int(i)))
-        except Executable.DoesNotExist:
-            pass
+        if int(i) in metadata.executables_by_id:
+            executables.append(metadata.executables_by_id[int(i)])
 
     if not executables:
         timeline_list['error'] = "No executables selected"
         return HttpResponse(json.dumps(timeline_list))
     environment = None
     try:
-        environment = get_object_or_404(Environment, id=data.get('env'))
+        environment = metadata.environments_by_id[int(data.get('env'))]
+    except (KeyError, TypeError):
+        raise Http404
     except ValueError:
         Http404()
 
@@ -363,7 +358,7 @@ def gettimelinedata(request):
     if data.get('base') not in (None, 'none', 'undefined'):
         exe_id, rev_id = data['base'].split("+")
         baseline_rev = Revision.objects.get(id=rev_id)
-        baseline_exe = Executable.objects.get(id=exe_id)
+        baseline_exe = metadata.executables_by_id.get(int(exe_id))
 
     next_benchmarks = data.get('nextBenchmarks', False)
     if next_benchmarks is not False:
@@ -380,23 +375,54 @@ def stream_timeline(baseline_exe, baseline_rev, benchmarks, data, environment, e
                     number_of_revs, next_benchmarks):
     yield '{"timelines": ['
     num_results = {"results": 0}
-    num_benchmark = 0
+    num_benchmark = next_benchmarks or 0
     transmitted_benchmarks = 0
     timeline_grid_paging = get_setting('TIMELINE_GRID_PAGING', 10)
+    branches = get_metadata().default_branches()
+    try:
+        # Maximum number of points per series, e.g. the width of the plot
+        points = int(data.get('points', 0))
+    except ValueError:
+        points = 0
+    columnar = data.get('format') == 'columnar'
 
-    for bench in benchmarks:
-        if transmitted_benchmarks + 1 > timeline_grid_paging:
-            # don't send more results than configured
-            break
-
-        num_benchmark += 1
+    workers = get_setting('TIMELINE_FETCH_WORKERS', 1)
+    pool = ThreadPool(workers) if workers > 1 else None
 
-        if not next_benchmarks or num_benchmark > next_benchmarks:
-            result = get_timeline_for_benchmark(baseline_exe, baseline_rev, bench, environment,
-                                                executables, number_of_revs, num_results)
-            if result != "":
-                transmitted_benchmarks += 1
-                yield result
+    def fetch(bench):
+        try:
+            return get_timeline_for_benchmark(baseline_exe, baseline_rev, bench, environment,
+                                              executables, number_of_revs, {"results": 0},
+                                              branches, points, columnar)
+        finally:
+            if pool is not None:
+                # Each thread of the pool opened its own connection
+                connections.close_all()
+
+    pending = list(benchmarks)[num_benchmark:]
+    try:
+        while pending and transmitted_benchmarks < timeline_grid_paging:
+            # don't send more results than configured. Benchmarks without
+            # results don't count, so fetch as many as the free places, in
+            # parallel when there are workers, and yield them in order
+            chunk = pending[:timeline_grid_paging - transmitted_benchmarks]
+            pending = pending[len(chunk):]
+            if pool is not None:
+                results = pool.imap(fetch, chunk)
+            else:
+                results = (fetch(bench) for bench in chunk)
+            for result in results:
+                num_benchmark += 1
+                if result != "":
+                    transmitted_benchmarks += 1
+                    if num_results['results'] > 0:
+                        result = "," + result
+                    num_results['results'] += 1
+                    yield result
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
 
     if not next_benchmarks or (next_benchmarks < len(benchmarks)
                                and transmitted_benchmarks > 0):
@@ -416,7 +442,8 @@ def stream_timeline(baseline_exe, baseline_rev, benchmarks, data, environment, e
 
 
 def get_timeline_for_benchmark(baseline_exe, baseline_rev, bench, environment, executables,
-                               number_of_revs, num_results):
+                               number_of_revs, num_results, branches=None, points=0,
+                               columnar=False):
     lessisbetter = bench.lessisbetter and ' (less is better)' or ' (more is better)'
     timeline = {
         'benchmark': bench.name,
@@ -429,50 +456,19 @@ def get_timeline_for_benchmark(baseline_exe, baseline_rev, bench, environment, e
         'baseline': "None",
     }
     append = False
-    for branch in Branch.objects.filter(
-            project__track=True, name=F('project__default_branch')):
-        # For now, we'll only work with default branches
+    if branches is None:
+        branches = get_metadata().default_branches()
+    # For now, we'll only work with default branches
+    series = get_timeline_series(
+        [bench], environment, executables, branches, number_of_revs)
+    for branch in branches:
         for executable in executables:
-            if executable.project != branch.project:
-                continue
-
-            resultquery = Result.objects.filter(
-                benchmark=bench
-            ).filter(
-                environment=environment
-            ).filter(
-                executable=executable
-            ).filter(
-                revision__branch=branch
-            ).select_related(
-                "revision"
-            ).order_by('-revision__date')[:number_of_revs]
-            if not len(resultquery):
+            results = series.get((bench.id, executable.id, branch.id))
+            if results is None:
                 continue
             timeline['branches'].setdefault(branch.name, {})
-
-            results = []
-            for res in resultquery:
-                if bench.data_type == 'M':
-                    q1, q3, val_max, val_min = get_stats_with_defaults(res)
-                    results.append(
-                        [
-                            res.revision.date.strftime('%Y/%m/%d %H:%M:%S %z'),
-                            res.value, val_max, q3, q1, val_min,
-                            res.revision.get_short_commitid(), res.revision.tag, branch.name
-                        ]
-                    )
-                else:
-                    std_dev = ""
-                    if res.std_dev is not None:
-                        std_dev = res.std_dev
-                    results.append(
-                        [
-                            res.revision.date.strftime('%Y/%m/%d %H:%M:%S %z'),
-                            res.value, std_dev,
-                            res.revision.get_short_commitid(), res.revision.tag, branch.name
-                        ]
-                    )
+            if points > 0:
+                results = downsample(results, points, bench.lessisbetter)
             timeline['branches'][branch.name][executable.id] = results
             append = True
     if baseline_rev is not None and append:
@@ -500,6 +496,8 @@ def get_timeline_for_benchmark(baseline_exe, baseline_rev, bench, environment, e
                 [str(end), baselinevalue]
             ]
     if append:
+        if columnar:
+            to_columnar(timeline)
         old_num_results = num_results['results']
         json_str = json.dumps(timeline)
         num_results['results'] = old_num_results + len(timeline)
@@ -516,15 +514,17 @@ def get_timeline_for_benchmark(baseline_exe, baseline_rev, bench, environment, e
 def timeline(request):
     data = request.GET
 
+    metadata = get_metadata()
+
     # Configuration of default parameters #
     # Default Environment
-    enviros = Environment.objects.all()
+    enviros = metadata.environments
     if not enviros:
         return no_environment_error(request)
     defaultenviro = get_default_environment(enviros, data)
 
     # Default Project
-    defaultproject = Project.objects.filter(track=True)
+    defaultproject = metadata.tracked_projects()
     if not len(defaultproject):
         return no_default_project_error(request)
     else:
@@ -535,20 +535,18 @@ def timeline(request):
         for i in data['exe'].split(","):
             if not i:
                 continue
-            try:
-                checkedexecutables.append(Executable.objects.get(id=int(i)))
-            except Executable.DoesNotExist:
-                pass
+            if int(i) in metadata.executables_by_id:
+                checkedexecutables.append(metadata.executables_by_id[int(i)])
 
     if not checkedexecutables:
-        checkedexecutables = Executable.objects.filter(project__track=True)
+        checkedexecutables = metadata.tracked_executables()
 
     if not len(checkedexecutables):
         return no_executables_error(request)
 
     # TODO: we need branches for all tracked projects
     branch_list = [
-        branch.name for branch in Branch.objects.filter(project=defaultproject)]
+        branch.name for branch in metadata.project_branches(defaultproject)]
     branch_list.sort()
 
     defaultbranch = ""
@@ -575,7 +573,7 @@ def timeline(request):
             lastrevisions.append(data['revs'])
         defaultlast = data['revs']
 
-    benchmarks = Benchmark.objects.all()
+    benchmarks = metadata.benchmarks
 
     defaultbenchmark = "grid"
     if not len(benchmarks):
@@ -586,11 +584,8 @@ def timeline(request):
         if settings.DEF_BENCHMARK in ['grid', 'show_none']:
             defaultbenchmark = settings.DEF_BENCHMARK
         else:
-            try:
-                defaultbenchmark = Benchmark.objects.get(
-                    name=settings.DEF_BENCHMARK)
-            except Benchmark.DoesNotExist:
-                pass
+            defaultbenchmark = metadata.benchmarks_by_name.get(
+                settings.DEF_BENCHMARK, defaultbenchmark)
     elif len(benchmarks) >= get_setting('TIMELINE_GRID_LIMIT', 30):
         defaultbenchmark = 'show_none'
 
@@ -598,7 +593,9 @@ def timeline(request):
         if data['ben'] == "show_none":
             defaultbenchmark = data['ben']
         else:
-            defaultbenchmark = get_object_or_404(Benchmark, name=data['ben'])
+            defaultbenchmark = metadata.benchmarks_by_name.get(data['ben'])
+            if defaultbenchmark is None:
+                raise Http404
 
     if 'equid' in data:
         defaultequid = data['equid']
@@ -620,8 +617,8 @@ def timeline(request):
         pagedesc = "Results timeline for the '%s' benchmark (project %s)" % \
             (defaultbenchmark, defaultproject)
     executables = {}
-    for proj in Project.objects.filter(track=True):
-        executables[proj] = Executable.objects.filter(project=proj)
+    for proj in metadata.tracked_projects():
+        executables[proj] = metadata.project_executables(proj)
     use_median_bands = hasattr(settings, 'USE_MEDIAN_BANDS') and settings.USE_MEDIAN_BANDS
     return render_to_response('codespeed/timeline.html', {
         'pagedesc': pagedesc,
@@ -641,10 +638,13 @@ def timeline(request):
         'defaultquarts': defaultquarts,
         'defaultextr': defaultextr,
         'use_median_bands': use_median_bands,
+        'downsample': get_setting('TIMELINE_DOWNSAMPLE', False),
+        'columnar': get_setting('TIMELINE_COLUMNAR', False),
     })
 
 
 @require_GET
+@data_version_condition(_get_executables_project_ids)
 def getchangestable(request):
     executable = get_object_or_404(Executable, pk=request.GET.get('exe'))
     environment = get_object_or_404(Environment, pk=request.GET.get('env'))
@@ -733,7 +733,7 @@ def changes(request):
         defaulttrendthres = settings.TREND_THRESHOLD
 
     defaulttrend = 10
-    trends = [5, 10, 20, 50, 100]
+    trends = CHANGES_TRENDS
     if 'tre' in data and int(data['tre']) in trends:
         defaulttrend = int(data['tre'])
 
@@ -843,9 +843,29 @@ def reports(request):
     return render_to_response('codespeed/reports.html', context)
 
 
+@require_GET
+def regressions(request):
+    """Lists the latest detected change points that made a benchmark worse"""
+    change_points = ChangePoint.objects.filter(
+        Q(benchmark__lessisbetter=True, change__gt=0) |
+        Q(benchmark__lessisbetter=False, change__lt=0)
+    ).select_related(
+        'revision__branch__project', 'benchmark', 'executable', 'environment'
+    ).order_by('-revision__date', 'benchmark__name')[:50]
+    return render_to_response('codespeed/regressions.html', {
+        'change_points': change_points,
+    })
+
+
 @require_GET
 def displaylogs(request):
     rev = get_object_or_404(Revision, pk=request.GET.get('revisionid'))
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    per_page = getattr(settings, 'CHANGES_LOGS_PER_PAGE', 100)
+    next_page = None
     logs = []
     logs.append(
         {
@@ -865,7 +885,13 @@ def displaylogs(request):
         else:
             startrev = startrev[0]
 
-        remotelogs = commits.get_logs(rev, startrev)
+        # One more log tells whether there is a next page
+        remotelogs = commits.get_logs(rev, startrev, cached=True,
+                                      limit=per_page + 1,
+                                      offset=(page - 1) * per_page)
+        if len(remotelogs) > per_page:
+            remotelogs = remotelogs[:per_page]
+            next_page = page + 1
         if len(remotelogs):
             try:
                 if remotelogs[0]['error']:
@@ -873,7 +899,7 @@ def displaylogs(request):
             except KeyError:
                 pass  # no errors
             logs = remotelogs
-        else:
+        elif page == 1:
             error = 'No logs found'
     except commits.exceptions.CommitLogError as e:
         logger.error('Unhandled exception displaying logs for %s: %s',
@@ -888,7 +914,7 @@ def displaylogs(request):
     return render_to_response(
         'codespeed/changes_logs.html',
         {
-            'error': error, 'logs': logs,
+            'error': error, 'logs': logs, 'next_page': next_page,
             'show_email_address': settings.SHOW_AUTHOR_EMAIL_ADDRESS
         })
 
@@ -902,7 +928,8 @@ def add_result(request):
         logger.error("Could not save result: " + response)
         return HttpResponseBadRequest(response)
     else:
-        create_report_if_enough_data(response[0], response[1], response[2])
+        if not enqueue_report(response[0], response[1], response[2]):
+            create_report_if_enough_data(response[0], response[1], response[2])
         return HttpResponse("Result data saved successfully", status=202)
 
 
@@ -915,20 +942,15 @@ def add_json_results(request):
     data = json.loads(request.POST['json'])
     logger.info("add_json_results request with %d entries." % len(data))
 
-    unique_reports = set()
-    for (i, result) in enumerate(data):
-        logger.debug("add_json_results: save item %d." % i)
-        response, error = save_result(result, update_repo=(i==0))
-        if error:
-            logger.debug(
-                "add_json_results: could not save item %d because %s" % (
-                    i, response))
-            return HttpResponseBadRequest(response)
-        else:
-            unique_reports.add(response)
+    response, error = save_results(data)
+    if error:
+        logger.debug(
+            "add_json_results: could not save items because %s" % response)
+        return HttpResponseBadRequest(response)
 
-    for rep in unique_reports:
-        create_report_if_enough_data(rep[0], rep[1], rep[2])
+    for rep in response:
+        if not enqueue_report(rep[0], rep[1], rep[2]):
+            create_report_if_enough_data(rep[0], rep[1], rep[2])
 
     return HttpResponse("All result data saved successfully", status=202)
 
@@ -951,10 +973,19 @@ def makeimage(request):
     except ObjectDoesNotExist as err:
         return HttpResponseNotFound(str(err))
 
-    image_data = gen_image_from_results(
+    plot_data = get_plot_data(
                     result_data,
                     int(data['width']) if 'width' in data else None,
                     int(data['height']) if 'height' in data else None)
+    digest = get_plot_etag(plot_data)
+    etag = quote_etag(digest)
+
+    if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    image_data = get_cached_image(plot_data, etag=digest)
 
     if django_has_content_type():
         response = HttpResponse(content=image_data, content_type='image/png')
@@ -963,5 +994,6 @@ def makeimage(request):
 
     response['Content-Length'] = len(image_data)
     response['Content-Disposition'] = 'attachment; filename=image.png'
+    response['ETag'] = etag
 
     return response
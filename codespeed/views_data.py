@@ -3,10 +3,12 @@ from __future__ import absolute_import
 
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
-from django.shortcuts import get_object_or_404
+from django.db.models import OuterRef, Subquery
+from django.http import Http404
 
+from codespeed.metadata import get_metadata
 from codespeed.models import (
-    Executable, Revision, Project, Branch,
+    DataVersion, Executable, Revision, Project, Branch,
     Environment, Benchmark, Result)
 
 
@@ -49,6 +51,62 @@ def get_default_environment(enviros, data, multi=False):
         return defaultenviros[0]
 
 
+# project id -> (data version of the project, its baseline executables)
+_baseline_catalog = {}
+
+
+def _get_project_versions():
+    return dict(
+        (project_id, (version, modified))
+        for project_id, version, modified in DataVersion.objects.filter(
+            project__isnull=False
+        ).values_list('project_id', 'version', 'modified'))
+
+
+def get_baseline_catalog():
+    """Returns the baseline executables of every project, by project id
+
+    A baseline executable is an executable at a tagged revision of its
+    project. They are kept by the process, and only read again for the
+    projects whose data version changed since, e.g. because a revision was
+    tagged or results were added.
+    """
+    metadata = get_metadata()
+    versions = _get_project_versions()
+    catalog = {}
+    stale = []
+    for proj in metadata.projects:
+        cached = _baseline_catalog.get(proj.id)
+        if (proj.id in versions and cached is not None and
+                cached[0] == versions[proj.id]):
+            catalog[proj.id] = cached[1]
+        else:
+            stale.append(proj.id)
+            catalog[proj.id] = []
+    if not stale:
+        return catalog
+
+    for rev in Revision.objects.filter(
+            branch__project__in=stale
+    ).exclude(tag="").select_related('branch__project').order_by('id'):
+        # Add executables that correspond to each tagged revision.
+        project_id = rev.branch.project_id
+        for exe in metadata.project_executables(rev.branch.project):
+            exestring = get_sanitized_executable_name_for_timeline_view(exe)
+            catalog[project_id].append({
+                'key': str(exe.id) + "+" + str(rev.id),
+                'executable': exe,
+                'revision': rev,
+                'name': exestring + " " + rev.tag,
+            })
+    for project_id in stale:
+        if project_id in versions:
+            # Projects without a data version can't tell when they change
+            _baseline_catalog[project_id] = (
+                versions[project_id], catalog[project_id])
+    return catalog
+
+
 def getbaselineexecutables(include_tags=None):
     """
     :param include_tags: A list of tags to include in the result. If set to
@@ -61,27 +119,18 @@ def getbaselineexecutables(include_tags=None):
         'executable': "none",
         'revision': "none",
     }]
-    executables = Executable.objects.select_related('project')
-
-    if include_tags is not None:
-        revs = Revision.objects.filter(tag__in=include_tags)
-    else:
-        revs = Revision.objects.exclude(tag="")
-
-    revs = revs.select_related('branch__project')
-
-    for rev in revs:
-        # Add executables that correspond to each tagged revision.
-        for exe in [e for e in executables if e.project == rev.branch.project]:
-            exestring = get_sanitized_executable_name_for_timeline_view(exe)
-            name = exestring + " " + rev.tag
-            key = str(exe.id) + "+" + str(rev.id)
-            baseline.append({
-                'key': key,
-                'executable': exe,
-                'revision': rev,
-                'name': name,
-            })
+    entries = []
+    for project_entries in get_baseline_catalog().values():
+        if include_tags is None:
+            entries.extend(project_entries)
+        else:
+            entries.extend(entry for entry in project_entries
+                           if entry['revision'].tag in include_tags)
+    # In the order of the revisions, then of their executables
+    entries.sort(key=lambda entry: (entry['revision'].id,
+                                    entry['executable'].id))
+    # Copied, since the default is moved below
+    baseline.extend(dict(entry) for entry in entries)
     # move default to first place
     if hasattr(settings, 'DEF_BASELINE') and settings.DEF_BASELINE is not None:
         try:
@@ -125,7 +174,29 @@ def getcomparisonexes():
     exekeys = []
     baselines = getbaselineexecutables(include_tags=comparison_commit_tags)
 
-    for proj in Project.objects.all():
+    metadata = get_metadata()
+    project_executables = {}
+    for exe in metadata.executables:
+        project_executables.setdefault(exe.project_id, []).append(exe)
+
+    # Latest revision of every branch, fetched for all branches at once.
+    # Ties (e.g. revisions without a date) go to the oldest row, so
+    # that the result doesn't depend on the index used for sorting
+    latest = Revision.objects.filter(
+        branch=OuterRef('pk')).order_by('-date', 'id')
+    branches = list(Branch.objects.filter(
+        display_on_comparison_page=True
+    ).annotate(
+        latest_revision=Subquery(latest.values('pk')[:1])
+    ).order_by('id'))
+    revisions = Revision.objects.in_bulk(
+        [branch.latest_revision for branch in branches
+         if branch.latest_revision is not None])
+    project_branches = {}
+    for branch in branches:
+        project_branches.setdefault(branch.project_id, []).append(branch)
+
+    for proj in metadata.projects:
         executables = []
         executablekeys = []
         # add all tagged revs for any project
@@ -135,16 +206,14 @@ def getcomparisonexes():
                 executables.append(exe)
 
         # add latest revs of the project
-        branches = Branch.objects.filter(project=proj, display_on_comparison_page=True)
-        for branch in branches:
-            try:
-                rev = Revision.objects.filter(branch=branch).latest('date')
-            except Revision.DoesNotExist:
+        for branch in project_branches.get(proj.id, []):
+            rev = revisions.get(branch.latest_revision)
+            if rev is None:
                 continue
             # Now only append when tag == "",
             # because we already added tagged revisions
             if rev.tag == "":
-                for exe in Executable.objects.filter(project=proj):
+                for exe in project_executables.get(proj.id, []):
                     exestring = get_sanitized_executable_name_for_comparison_view(exe)
                     name = exestring + " latest"
                     if branch.name != proj.default_branch:
@@ -184,9 +253,7 @@ def get_benchmark_results(data):
     ).filter(
         executable=executable
     ).filter(
-        revision__project=project
-    ).filter(
-        revision__branch=branch
+        branch=branch
     ).select_related(
         "revision"
     ).order_by('-date')[:number_of_revs]
@@ -221,8 +288,7 @@ def get_benchmark_results(data):
                                 benchmark=benchmark,
                                 environment=baseline_env,
                                 executable=baseline_exe,
-                                revision__project=baseline_proj,
-                                revision__branch=baseline_branch,
+                                branch=baseline_branch,
                                 revision__commitid=baseline_commit_name)
 
         ref_value = base_data.value
@@ -243,14 +309,17 @@ def get_benchmark_results(data):
 
 
 def get_num_revs_and_benchmarks(data):
+    metadata = get_metadata()
     if data['ben'] == 'grid':
-        benchmarks = Benchmark.objects.all().order_by('name')
+        benchmarks = sorted(metadata.benchmarks, key=lambda bench: bench.name)
         number_of_revs = 15
     elif data['ben'] == 'show_none':
         benchmarks = []
         number_of_revs = int(data.get('revs', 10))
     else:
-        benchmarks = [get_object_or_404(Benchmark, name=data['ben'])]
+        if data['ben'] not in metadata.benchmarks_by_name:
+            raise Http404
+        benchmarks = [metadata.benchmarks_by_name[data['ben']]]
         number_of_revs = int(data.get('revs', 10))
     return number_of_revs, benchmarks
 
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""Measures the git processes spawned and the time taken to get the logs
+of a large commit range
+
+A temporary repository is created with --commits commits, one in ten of
+them tagged. The logs of the whole range are then read:
+
+* per-commit tags: one "git tag --points-at" per commit, as Codespeed did
+  before tags were listed once per call
+* getlogs, cold: tags listed with a single "git show-ref"
+* getlogs, warm: tags served from the cache, as the refs did not change
+
+Usage (from the repository root):
+
+    python tools/bench_git_logs.py [--commits 300]
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sample_project.settings')
+
+import django  # noqa: E402
+django.setup()
+
+from codespeed.commits import git  # noqa: E402
+
+
+class Stub(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def make_repo(path, commits):
+    env = dict(os.environ, GIT_AUTHOR_NAME='a', GIT_AUTHOR_EMAIL='a@a',
+               GIT_COMMITTER_NAME='a', GIT_COMMITTER_EMAIL='a@a')
+    subprocess.check_call(['git', 'init', '-q', path])
+    for i in range(commits):
+        subprocess.check_call(
+            ['git', 'commit', '-q', '--allow-empty', '-m', 'commit %d' % i],
+            cwd=path, env=env)
+        if i % 10 == 0:
+            subprocess.check_call(['git', 'tag', 'v%d' % i], cwd=path)
+    return subprocess.check_output(
+        ['git', 'rev-list', '--max-parents=0', 'HEAD'], cwd=path
+    ).decode().strip(), subprocess.check_output(
+        ['git', 'rev-parse', 'HEAD'], cwd=path).decode().strip()
+
+
+class CountingPopen(object):
+    calls = 0
+
+    def __init__(self, *args, **kwargs):
+        CountingPopen.calls += 1
+        self.process = subprocess.Popen(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.process, name)
+
+
+def per_commit_tags(endrev, startrev):
+    get_tags = git.get_tags
+    git.get_tags = lambda working_copy: {}
+    try:
+        logs = git.getlogs(endrev, startrev)
+    finally:
+        git.get_tags = get_tags
+    for log in logs:
+        git.execute_command(['git', 'tag', '--points-at', log['commitid']],
+                            endrev.branch.project.working_copy)
+    return logs
+
+
+def measure(label, func, endrev, startrev):
+    CountingPopen.calls = 0
+    start = time.time()
+    logs = func(endrev, startrev)
+    elapsed = time.time() - start
+    print("%-20s %4d commits %5d processes %8.3f s" % (
+        label, len(logs), CountingPopen.calls, elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--commits', type=int, default=300)
+    args = parser.parse_args()
+
+    path = tempfile.mkdtemp()
+    try:
+        first, last = make_repo(path, args.commits)
+        project = Stub(working_copy=path)
+        branch = Stub(project=project)
+        startrev = Stub(commitid=first, branch=branch)
+        endrev = Stub(commitid=last, branch=branch)
+
+        git.Popen = CountingPopen
+        measure("per-commit tags", per_commit_tags, endrev, startrev)
+        git._tags_cache.clear()
+        measure("getlogs, cold", git.getlogs, endrev, startrev)
+        measure("getlogs, warm", git.getlogs, endrev, startrev)
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Measures the time taken to get Mercurial logs with and without the
+command server
+
+A temporary repository is created with --commits commits, and the logs of
+its last commit are read --calls times:
+
+* hg per call: a new hg process for each "hg log", as Codespeed does by
+  default
+* cmdserver: every "hg log" runs in the same pooled command server, as with
+  the HG_USE_CMDSERVER setting
+
+Usage (from the repository root):
+
+    python tools/bench_hg_logs.py [--commits 50] [--calls 100]
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sample_project.settings')
+
+import django  # noqa: E402
+django.setup()
+
+from django.test import override_settings  # noqa: E402
+
+from codespeed.commits import cmdserver, mercurial  # noqa: E402
+
+
+class Stub(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def make_repo(path, commits):
+    subprocess.check_call(['hg', 'init', path])
+    for i in range(commits):
+        with open(os.path.join(path, 'file'), 'w') as f:
+            f.write('%d\n' % i)
+        if i == 0:
+            subprocess.check_call(['hg', 'add', 'file'], cwd=path)
+        subprocess.check_call(
+            ['hg', 'commit', '-q', '-u', 'a <a@a>', '-m', 'commit %d' % i],
+            cwd=path)
+    return subprocess.check_output(
+        ['hg', 'log', '-r', 'tip', '--template', '{node|short}'], cwd=path
+    ).decode().strip()
+
+
+def measure(label, rev, calls, use_cmdserver):
+    with override_settings(HG_USE_CMDSERVER=use_cmdserver):
+        start = time.time()
+        for _ in range(calls):
+            mercurial.getlogs(rev, rev)
+        elapsed = time.time() - start
+    print("%-15s %4d calls %8.3f s %8.1f ms/call" % (
+        label, calls, elapsed, elapsed * 1000 / calls))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--commits', type=int, default=50)
+    parser.add_argument('--calls', type=int, default=100)
+    args = parser.parse_args()
+
+    path = tempfile.mkdtemp()
+    try:
+        tip = make_repo(path, args.commits)
+        project = Stub(working_copy=path)
+        rev = Stub(commitid=tip, branch=Stub(project=project))
+
+        measure("hg per call", rev, args.calls, False)
+        measure("cmdserver", rev, args.calls, True)
+    finally:
+        cmdserver.close_servers()
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""Compares the size and serialization time of the timeline data formats
+
+A timeline with --revisions points for each of --executables executables is
+serialized --calls times:
+
+* points: the default format, one JSON array per point
+* columnar: the format=columnar format, with the revisions sent once and
+  the values packed in base64 float64 columns
+
+Sizes are given as sent, and gzip compressed.
+
+Usage (from the repository root):
+
+    python tools/bench_timeline_format.py [--revisions 1000] [--executables 6]
+"""
+from __future__ import print_function
+
+import argparse
+import copy
+import gzip
+import io
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sample_project.settings')
+
+import django  # noqa: E402
+django.setup()
+
+from codespeed.timelines import to_columnar  # noqa: E402
+
+
+def make_timeline(revisions, executables, data_type):
+    start = datetime(2020, 1, 1)
+    axis = []
+    for i in range(revisions, 0, -1):
+        date = (start + timedelta(hours=i)).strftime('%Y/%m/%d %H:%M:%S %z')
+        tag = 'v%d' % i if i % 100 == 0 else ''
+        axis.append((date, '%010x' % random.getrandbits(40), tag))
+
+    series = {}
+    for exe in range(1, executables + 1):
+        points = []
+        for date, commitid, tag in axis:
+            value = random.uniform(10, 20)
+            if data_type == 'M':
+                numbers = [value, value * 1.2, value * 1.1, value * 0.9,
+                           value * 0.8]
+            else:
+                numbers = [value, value * 0.05]
+            points.append([date] + numbers + [commitid, tag, 'master'])
+        series[str(exe)] = points
+    return {
+        'benchmark': 'bench',
+        'benchmark_id': 1,
+        'benchmark_description': '',
+        'data_type': data_type,
+        'units': 'seconds',
+        'lessisbetter': ' (less is better)',
+        'branches': {'master': series},
+        'baseline': "None",
+    }
+
+
+def gzipped_size(data):
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+        f.write(data.encode('utf-8'))
+    return len(buf.getvalue())
+
+
+def measure(label, timeline, calls, columnar):
+    elapsed = 0
+    for _ in range(calls):
+        # to_columnar replaces the points in place
+        data = copy.deepcopy(timeline)
+        start = time.time()
+        if columnar:
+            to_columnar(data)
+        payload = json.dumps(data)
+        elapsed += time.time() - start
+    print("%-10s %9d bytes %8d gzipped %8.1f ms/call" % (
+        label, len(payload), gzipped_size(payload), elapsed * 1000 / calls))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--revisions', type=int, default=1000)
+    parser.add_argument('--executables', type=int, default=6)
+    parser.add_argument('--data-type', choices=['U', 'M'], default='U')
+    parser.add_argument('--calls', type=int, default=20)
+    args = parser.parse_args()
+
+    timeline = make_timeline(args.revisions, args.executables,
+                             args.data_type)
+    measure("points", timeline, args.calls, False)
+    measure("columnar", timeline, args.calls, True)
+
+
+if __name__ == '__main__':
+    main()
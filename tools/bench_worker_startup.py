@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""Measures the cold start time and memory of a Codespeed worker
+
+Each sample is a fresh Python process that sets up Django and imports the
+URLconf, which is what a web server worker does before serving its first
+request. With --eager-images, the plotting libraries are also imported at
+startup, like Codespeed did before they were loaded on first use.
+
+Usage (from the repository root):
+
+    python tools/bench_worker_startup.py [--samples 10] [--eager-images]
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+WORKER = """
+import json, os, resource, sys, time
+start = time.time()
+import django
+django.setup()
+import sample_project.urls
+if %(eager)r:
+    import matplotlib.backends.backend_agg, matplotlib.figure
+print(json.dumps({
+    'seconds': time.time() - start,
+    'maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'matplotlib': 'matplotlib' in sys.modules,
+}))
+"""
+
+
+def run_worker(eager):
+    env = dict(os.environ)
+    env.setdefault('DJANGO_SETTINGS_MODULE', 'sample_project.settings')
+    output = subprocess.check_output(
+        [sys.executable, '-W', 'ignore', '-c', WORKER % {'eager': eager}],
+        env=env, stderr=subprocess.STDOUT)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--samples', type=int, default=10)
+    parser.add_argument('--eager-images', action='store_true', default=False)
+    args = parser.parse_args()
+
+    samples = [run_worker(args.eager_images) for _ in range(args.samples)]
+    print("matplotlib loaded at startup: %s" % samples[0]['matplotlib'])
+    print("startup time (median of %d): %.3f s" % (
+        args.samples, median([s['seconds'] for s in samples])))
+    print("max RSS (median of %d): %.1f MB" % (
+        args.samples, median([s['maxrss_kb'] for s in samples]) / 1024.0))
+
+
+if __name__ == '__main__':
+    main()